@@ -6,19 +6,15 @@
 # source .\venv\scripts\acttivate
 # pip install --upgrade pip
 
-# Run data ingestion
-echo "Ingesting data.py ....."
-python src/data_ingestion.py
-echo "Data ingestion completed."
-
-# Run data transformation
-echo "Transforming data....."
-python src/data_transformation.py
-echo "Data transformation completed."
+# Run data ingestion and data transformation in one process,
+# stages whose inputs, config and code did not change are loaded from .cache/pipeline
+echo "Running pipeline....."
+python src/pipeline.py --until transformation
+echo "Pipeline completed."
 
 # Run model training
 # echo "Building model ....."
-# python src/model_training.py
+# python src/pipeline.py --from preprocessing --until training
 
 # echo "Do you want to make a prediction? (Y/N)"
 # read response
@@ -32,4 +28,4 @@ echo "Data transformation completed."
 #     echo "Prediction not requested. Exiting."
 # fi
 
-# read -p "Press any key to exit..."
\ No newline at end of file
+# read -p "Press any key to exit..."
@@ -0,0 +1,993 @@
+import os
+import sys
+import time
+import tempfile
+import sqlite3
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from data_transformation import DataTransformation
+from utils import INTERMEDIATE_EXTENSIONS, read_frame, write_frame
+
+
+def legacy_merge_rows(group):
+    """
+    Row by row merge used by drop_duplicates_merge before coalesce_rows, kept as a reference.
+    """
+    merged = group.iloc[0].copy()
+    for i in range(1, len(group)):
+        for col in group.columns:
+            if pd.isna(merged[col]) or merged[col] in [None, '-', '--']:
+                merged[col] = group.iloc[i][col] if not pd.isna(group.iloc[i][col]) and group.iloc[i][col] not in [None, '-', '--'] else merged[col]
+    return merged
+
+
+def legacy_numeric_stage(df):
+    """
+    Separate pandas passes of cleaning_formatting_value before the fused kernel, kept as a reference.
+    The log guard checks the values, the original `0 in df[feature]` checked the index. Modifies df.
+    """
+    from scipy import stats
+
+    df['average_wind_speed'] = (df['Min Wind Speed (km/h)'] + df['Max Wind Speed (km/h)']) /2
+    df['average_temperature'] = (df['Min Temperature (deg C)']+ df['Maximum Temperature (deg C)']) /2
+    df['psi_average'] = (df['psi_north'] + df['psi_central'] + df['psi_east'] + df['psi_south'] + df['psi_west']) /5
+    df['pm25_average'] = (df['pm25_central'] + df['pm25_north'] + df['pm25_south'] + df['pm25_east'] + df['pm25_west']) / 5
+
+    for feature in DataTransformation.LOG_FEATURES:
+        if not (df[feature] <= 0).any():
+            df[feature] = np.log(df[feature])
+    df = df.drop(columns=DataTransformation.DROP_COLUMNS)
+
+    mask = np.ones(len(df), dtype=bool)
+    for feature in DataTransformation.LOG_FEATURES:
+        mask &= np.abs(stats.zscore(df[feature])) < 3
+    return df[mask]
+
+
+def fused_numeric_stage(transformation, df):
+    block = transformation.numeric_block(df)
+    transformation.log_transform(block)
+    mask = transformation.zscore_mask(block)
+    return transformation.store_block(df, block, mask)
+
+
+def make_air_quality_duplicates(n_groups, seed=42):
+    """
+    This function create an air_quality like dataframe where every data_ref appears twice,
+    psi on one row and pm25 on the other, with '-' / '--' placeholders sprinkled in.
+
+    return
+        pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    regions = ['north', 'south', 'east', 'west', 'central']
+    n_rows = n_groups * 2
+    df = pd.DataFrame({
+        'data_ref': np.repeat(np.arange(n_groups), 2),
+        'date': np.repeat(pd.date_range('2014-01-01', periods=n_groups, freq='h').strftime('%d/%m/%Y'), 2),
+    })
+    first = np.tile([True, False], n_groups)
+    for region in regions:
+        pm25 = rng.integers(5, 80, n_rows).astype(object)
+        psi = rng.integers(20, 120, n_rows).astype(object)
+        pm25[~first] = None
+        psi[first] = None
+        # Placeholders on a small share of the valid values
+        pm25[rng.random(n_rows) < 0.02] = '-'
+        psi[rng.random(n_rows) < 0.02] = '--'
+        df[f'pm25_{region}'] = pm25
+        df[f'psi_{region}'] = psi
+    return df
+
+
+def make_merged_frame(n_rows, seed=42):
+    """
+    This function create a dataframe shaped like merged_data, numeric columns and a few labels.
+
+    return
+        pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'date': pd.date_range('2014-01-01', periods=n_rows, freq='h').strftime('%d/%m/%Y'),
+        'Wind Direction': rng.choice(['N', 'NE', 'east', 'SW.', 'south'], n_rows),
+        'Dew Point Category': rng.choice(['High', 'VL', 'moderate', 'Low'], n_rows),
+        'Daily Solar Panel Efficiency': rng.choice(['Low', 'Medium', 'High'], n_rows),
+    })
+    numeric = ['Daily Rainfall Total (mm)', 'Highest 30 Min Rainfall (mm)', 'Highest 60 Min Rainfall (mm)',
+               'Highest 120 Min Rainfall (mm)', 'Min Temperature (deg C)', 'Maximum Temperature (deg C)',
+               'Min Wind Speed (km/h)', 'Max Wind Speed (km/h)', 'Sunshine Duration (hrs)', 'Cloud Cover (%)',
+               'Relative Humidity (%)', 'Air Pressure (hPa)', 'Wet Bulb Temperature (deg F)']
+    for column in numeric:
+        df[column] = rng.normal(50, 15, n_rows).round(1)
+    for region in ['north', 'south', 'east', 'west', 'central']:
+        df[f'pm25_{region}'] = rng.integers(5, 80, n_rows).astype(float)
+        df[f'psi_{region}'] = rng.integers(20, 120, n_rows).astype(float)
+    return df
+
+
+def make_raw_merged_frame(n_rows, seed=42, offset=0):
+    """
+    This function create a dataframe shaped like merged_data as written by drop_duplicates_merge :
+    NUMERIC_COLUMNS as text with '-' / '--' placeholders and missing values, labels with aliases.
+
+    Args:
+    n_rows (int): rows to create
+    seed (int): seed of the chunk, use a different one per chunk
+    offset (int): data_ref of the first row
+
+    return
+        pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'data_ref_y': np.arange(offset, offset + n_rows),
+        'date': pd.Timestamp('2014-01-01') + pd.to_timedelta(rng.integers(0, 3650, n_rows), unit='D'),
+        'Wind Direction': rng.choice(['N', 'NE', 'east', 'SW.', 'south', 'Northward', 'W'], n_rows),
+        'Dew Point Category': rng.choice(['High', 'VL', 'moderate', 'Low', 'H', 'Normal'], n_rows),
+        'Daily Solar Panel Efficiency': rng.choice(['Low', 'Medium', 'High'], n_rows),
+    })
+    df['date'] = df['date'].dt.strftime(DataTransformation.DATE_FORMAT)
+    for column in ['Sunshine Duration (hrs)', 'Cloud Cover (%)', 'Relative Humidity (%)', 'Air Pressure (hPa)',
+                   'Wet Bulb Temperature (deg F)']:
+        values = rng.lognormal(3.5, 0.3, n_rows).round(1)
+        values[rng.random(n_rows) < 0.01] = np.nan
+        df[column] = values
+    for column in DataTransformation.NUMERIC_COLUMNS:
+        values = rng.lognormal(3, 0.4, n_rows).round(1).astype(str).astype(object)
+        values[rng.random(n_rows) < 0.02] = '-'
+        values[rng.random(n_rows) < 0.01] = '--'
+        values[rng.random(n_rows) < 0.01] = None
+        df[column] = values
+    return df
+
+
+def frames_match(left, right):
+    """
+    This function compare two dataframes value by value, treating missing values on both sides as equal.
+    """
+    if not left.index.equals(right.index) or not left.columns.equals(right.columns):
+        return False
+    both_missing = left.isna() & right.isna()
+    return bool(((left == right) | both_missing).all().all())
+
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_coalesce(sizes, legacy_limit=10_000):
+    """
+    This function time coalesce_rows against the legacy groupby-apply merge for each group count.
+
+    The legacy merge is only run up to legacy_limit groups, its cost grows too fast beyond that.
+    """
+    print(f"{'groups':>10} {'vectorized (s)':>15} {'legacy (s)':>12} {'speedup':>9} {'match':>6}")
+    for n_groups in sizes:
+        df = make_air_quality_duplicates(n_groups)
+        fast, fast_time = time_call(DataTransformation.coalesce_rows, df, 'data_ref')
+
+        if n_groups <= legacy_limit:
+            slow, slow_time = time_call(
+                lambda: df.groupby('data_ref').apply(legacy_merge_rows, include_groups=False))
+            match = frames_match(fast, slow)
+            print(f"{n_groups:>10} {fast_time:>15.3f} {slow_time:>12.3f} {slow_time / fast_time:>8.1f}x {str(match):>6}")
+        else:
+            print(f"{n_groups:>10} {fast_time:>15.3f} {'-':>12} {'-':>9} {'-':>6}")
+
+
+def benchmark_storage(n_rows, formats=tuple(INTERMEDIATE_EXTENSIONS)):
+    """
+    This function time a write and a full / projected read of each intermediate format and report the file size.
+    """
+    df = make_merged_frame(n_rows)
+    projection = ['date', 'Daily Rainfall Total (mm)', 'psi_north']
+
+    print(f"{'format':>8} {'write (s)':>10} {'read (s)':>9} {'project (s)':>12} {'size (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "merged_data.csv")
+        for fmt in formats:
+            out_path, write_time = time_call(write_frame, df, path, fmt)
+            _, read_time = time_call(read_frame, path, fmt)
+            _, project_time = time_call(read_frame, path, fmt, columns=projection, memory_map=fmt != "csv")
+            size = os.path.getsize(out_path) / 1e6
+            print(f"{fmt:>8} {write_time:>10.3f} {read_time:>9.3f} {project_time:>12.3f} {size:>10.1f}")
+
+
+def benchmark_ingestion(repeats=3):
+    """
+    This function time loading every configured source one after the other against the thread pool.
+    The source databases have to be downloaded already.
+    """
+    from data_ingestion import DataIngestion
+
+    ingestion = DataIngestion()
+    workers = ingestion.ingestion_config.max_workers
+    print(f"{'workers':>8} {'wall (s)':>9} {'sum of sources (s)':>19} per source (s)")
+    for max_workers in [1, workers]:
+        ingestion.ingestion_config.max_workers = max_workers
+        for _ in range(repeats):
+            ingestion.load_sources()
+            latencies = ingestion.latencies
+            per_source = ", ".join(f"{name} {latency:.3f}" for name, latency in latencies["sources"].items())
+            print(f"{max_workers:>8} {latencies['wall']:>9.3f} {sum(latencies['sources'].values()):>19.3f} {per_source}")
+
+
+def benchmark_categories(sizes):
+    """
+    This function time normalize_categories against a row by row Series.replace with the alias dicts.
+    """
+    from data_transformation import WIND_DIRECTION_ALIASES, WIND_DIRECTION_TABLE
+
+    rng = np.random.default_rng(42)
+    labels = list(WIND_DIRECTION_ALIASES) + [' sw ', 'North-East', 'nne']
+    print(f"{'rows':>10} {'normalize (s)':>14} {'replace (s)':>12} {'speedup':>9} {'unmapped':>9}")
+    for n_rows in sizes:
+        series = pd.Series(rng.choice(labels, n_rows), name='Wind Direction', dtype=object)
+        (_, unmapped), fast_time = time_call(DataTransformation.normalize_categories, series, WIND_DIRECTION_TABLE)
+        _, slow_time = time_call(series.replace, WIND_DIRECTION_ALIASES)
+        print(f"{n_rows:>10} {fast_time:>14.4f} {slow_time:>12.4f} {slow_time / fast_time:>8.1f}x {unmapped:>9}")
+
+
+def benchmark_service(url, n_requests=1000, clients=16, records_per_request=1):
+    """
+    This function send concurrent /predict requests built from final_data to a running prediction
+    service and print the service metrics.
+    """
+    import json
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+    from data_preprocessing import DataPreprocessing
+
+    config = DataPreprocessing().preprocess_config
+    df = read_frame(config.clean_data_path, config.intermediate_format)
+    df = df.drop(columns=['Daily Solar Panel Efficiency', 'date'], errors='ignore')
+    records = json.loads(df.to_json(orient='records'))
+
+    def send(i):
+        start = i * records_per_request % max(len(records) - records_per_request, 1)
+        body = json.dumps({"records": records[start:start + records_per_request]}).encode()
+        request = urllib.request.Request(f"{url}/predict", data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    _, wall = time_call(lambda: list(ThreadPoolExecutor(clients).map(send, range(n_requests))))
+    with urllib.request.urlopen(f"{url}/metrics") as response:
+        metrics = json.load(response)
+
+    print(f"{n_requests} requests from {clients} clients in {wall:.2f}s, {n_requests / wall:.0f} requests/s")
+    for key, value in metrics.items():
+        print(f"{key:>20} : {value}")
+
+
+def traced_peak_mb(func, *args):
+    """
+    This function return the peak of memory allocated while func runs, numpy buffers included.
+    """
+    import tracemalloc
+
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def benchmark_features(sizes, repeats=3):
+    """
+    This function time the fused numeric kernel against the separate pandas passes on float64 and
+    downcast float32 data, best of repeats, and check both keep the same rows and values.
+
+    The kernel column times numeric_block, log_transform and zscore_mask alone, the rest of the
+    fused time is dropping columns and filtering rows of the frame. Peak is the memory allocated
+    on top of the input.
+    """
+    transformation = DataTransformation()
+
+    def kernel(df):
+        block = transformation.numeric_block(df)
+        transformation.log_transform(block)
+        transformation.zscore_mask(block)
+
+    print(f"{'rows':>10} {'dtype':>8} {'pandas (s)':>11} {'fused (s)':>10} {'kernel (s)':>11} {'speedup':>8} "
+          f"{'Mrows/s':>8} {'pandas peak (MB)':>17} {'fused peak (MB)':>16} {'match':>6}")
+    for n_rows in sizes:
+        df = make_merged_frame(n_rows)
+        for dtype in [np.float64, np.float32]:
+            numeric = df.columns[df.dtypes == np.float64]
+            typed = df.astype({column: dtype for column in numeric})
+            # Both get a fresh copy, the pandas passes add columns to their input
+            slow_time = min(time_call(legacy_numeric_stage, typed.copy())[1] for _ in range(repeats))
+            fast_time = min(time_call(fused_numeric_stage, transformation, typed.copy())[1] for _ in range(repeats))
+            kernel_time = min(time_call(kernel, typed)[1] for _ in range(repeats))
+            slow_peak = traced_peak_mb(legacy_numeric_stage, typed.copy())
+            fast_peak = traced_peak_mb(fused_numeric_stage, transformation, typed.copy())
+
+            slow, fast = legacy_numeric_stage(typed.copy()), fused_numeric_stage(transformation, typed.copy())
+            rtol = 1e-5 if dtype == np.float32 else 1e-9
+            match = fast.index.equals(slow.index) and all(
+                np.allclose(fast[feature], slow[feature], rtol=rtol) for feature in transformation.LOG_FEATURES)
+            print(f"{n_rows:>10} {np.dtype(dtype).name:>8} {slow_time:>11.3f} {fast_time:>10.3f} {kernel_time:>11.3f} "
+                  f"{slow_time / fast_time:>7.1f}x {n_rows / fast_time / 1e6:>8.1f} {slow_peak:>17.0f} {fast_peak:>16.0f} {str(match):>6}")
+
+
+def benchmark_imbalance(n_rows, n_features=20, n_estimators=100):
+    """
+    This function compare the imbalance strategies on a synthetic 3 class set shaped like the efficiency labels :
+    cost of preparing the training set (time, traced peak memory), fit time of a random forest on it
+    and macro f1 on a held out split. SMOTE is run on one core and on all of them, and loaded from its cache.
+    """
+    from sklearn.datasets import make_classification
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import f1_score
+    from sklearn.model_selection import train_test_split
+    from imbalance import ImbalanceHandler, STRATEGIES
+
+    X, y = make_classification(n_rows, n_features, n_informative=8, n_classes=3, weights=[0.6, 0.25, 0.15], random_state=42)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    print(f"{'strategy':>18} {'n_jobs':>6} {'prepare (s)':>12} {'peak (MB)':>10} {'rows':>9} {'fit (s)':>8} {'f1 macro':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runs = [("smote", 1, False), ("smote", -1, False), ("smote", -1, True)] + [(strategy, -1, False) for strategy in STRATEGIES[1:]]
+        for strategy, n_jobs, cached in runs:
+            handler = ImbalanceHandler(strategy)
+            handler.imbalance_config.n_jobs = n_jobs
+            handler.imbalance_config.cache_path = tmp_dir
+            X_res, y_res = handler.resample(X_train, y_train, use_cache=cached, trace_memory=True)
+            if cached:
+                # First call fills the cache
+                X_res, y_res = handler.resample(X_train, y_train, trace_memory=True)
+
+            model = handler.wrap_model(RandomForestClassifier(n_estimators=n_estimators, n_jobs=-1, random_state=42))
+            _, fit_time = time_call(model.fit, X_res, y_res)
+            f1 = f1_score(y_test, model.predict(X_test), average="macro")
+            report = handler.report
+            label = strategy + (" (cached)" if cached else "")
+            print(f"{label:>18} {n_jobs:>6} {report['seconds']:>12.3f} {report['peak_mb']:>10.1f} {report['rows_after']:>9} "
+                  f"{fit_time:>8.2f} {f1:>9.3f}")
+
+
+def benchmark_trees(n_rows=4000, n_features=13, batch_sizes=(1, 10, 100, 1000), repeats=20):
+    """
+    This function fit the Random Forest and Decision Tree of config.json on a synthetic 3 class set,
+    flatten them with tree_runtime.TreeEnsemble and compare predict_proba latency per batch size.
+    Outputs of both must be identical.
+    """
+    from sklearn.datasets import make_classification
+    from model_training import ModelTrainer
+    from tree_runtime import TreeEnsemble
+
+    X, y = make_classification(n_rows + max(batch_sizes), n_features, n_informative=8, n_classes=3,
+                               weights=[0.6, 0.25, 0.15], random_state=42)
+    X_train, y_train, X_query = X[:n_rows], y[:n_rows], X[n_rows:]
+    trainer = ModelTrainer()
+
+    for model_name in ["Random Forest", "Decision Tree"]:
+        model = trainer.get_model(model_name).set_params(**trainer.modeltrainer_config.config[model_name]['params'])
+        model.fit(X_train, y_train)
+        ensemble, flatten_time = time_call(TreeEnsemble.from_model, model)
+        identical = np.array_equal(model.predict_proba(X_query), ensemble.predict_proba(X_query))
+        print(f"{model_name} : {ensemble.n_trees} trees, {len(ensemble.feature)} nodes, max depth {ensemble.max_depth}, "
+              f"flattened in {flatten_time:.2f}s, identical predict_proba : {identical}")
+
+        print(f"{'batch':>8} {'sklearn (ms)':>13} {'flattened (ms)':>15} {'speedup':>8}")
+        for batch_size in batch_sizes:
+            batch = X_query[:batch_size]
+            sklearn_ms = min(time_call(model.predict_proba, batch)[1] for _ in range(repeats)) * 1000
+            flat_ms = min(time_call(ensemble.predict_proba, batch)[1] for _ in range(repeats)) * 1000
+            print(f"{batch_size:>8} {sklearn_ms:>13.3f} {flat_ms:>15.3f} {sklearn_ms / flat_ms:>7.1f}x")
+
+
+# Cold start of each runtime in a fresh interpreter : import, load the exported network, predict one row
+DENSE_COLD_START = {
+    "numpy": """
+from dense_runtime import DenseNetwork
+network = DenseNetwork.load(path)
+network.predict_proba(np.zeros((1, network.kernels[0].shape[0])))
+""",
+    "keras": """
+import tensorflow as tf
+from dense_runtime import DenseNetwork
+network = DenseNetwork.load(path)
+model = tf.keras.Sequential([tf.keras.layers.Input((network.kernels[0].shape[0],))] +
+                            [tf.keras.layers.Dense(len(bias), activation=activation)
+                             for bias, activation in zip(network.biases, network.activations)])
+model.set_weights([array for pair in zip(network.kernels, network.biases) for array in pair])
+model.predict(np.zeros((1, network.kernels[0].shape[0]), dtype=np.float32), verbose=0)
+""",
+}
+
+
+def dense_cold_start(runtime, path, cwd):
+    """
+    This function run the cold start of a runtime in a new interpreter that imports nothing else,
+    and return its seconds and peak RSS in MB (Linux only).
+    """
+    # ru_maxrss carries the peak of the forking parent over exec, VmHWM starts from the new image
+    code = ("import time\nstart = time.perf_counter()\nimport numpy as np\n"
+            f"path = {path!r}\n" + DENSE_COLD_START[runtime] +
+            "peak_kb = [line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM')][0]\n"
+            "print(time.perf_counter() - start, int(peak_kb) / 1024)")
+    env = dict(os.environ, PYTHONPATH=current_dir)
+    result = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    seconds, peak_mb = result.stdout.split()[-2:]
+    return float(seconds), float(peak_mb)
+
+
+def benchmark_dense(n_features=13, batch_sizes=(1, 32, 1024, 100_000), repeats=20):
+    """
+    This function compare the NumPy runtime of dense_runtime with Keras on the network of
+    DeepLearningModel.model_architect : cold start (import, load, first prediction) and peak memory
+    in a fresh interpreter, latency per batch size, and the largest difference between their outputs.
+
+    Without TensorFlow installed the network gets random weights and only the NumPy runtime is measured.
+    """
+    from dense_runtime import DenseNetwork, export_dense
+
+    try:
+        import tensorflow as tf
+    except ImportError:
+        tf = None
+        print("tensorflow is not installed, measuring the NumPy runtime on random weights only")
+
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(max(batch_sizes), n_features)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "dense_network.npz")
+        if tf is not None:
+            from dl_model import DeepLearningModel
+            model = DeepLearningModel().model_architect(X)
+            export_dense(model, path)
+            network = DenseNetwork.load(path)
+            diff = np.abs(network.predict_proba(X) - model.predict(X, verbose=0)).max()
+            print(f"max |numpy - keras| on {len(X)} rows : {diff:.2e}")
+        else:
+            units = [n_features, 32, 32, 3]
+            network = DenseNetwork([rng.normal(size=(a, b)) / np.sqrt(a) for a, b in zip(units, units[1:])],
+                                   [rng.normal(size=b) * 0.1 for b in units[1:]], ["relu", "relu", "softmax"])
+            network.save(path)
+        print(f"exported file : {os.path.getsize(path) / 1e3:.1f} kB")
+
+        runtimes = ["numpy"] + (["keras"] if tf is not None else [])
+        print(f"{'runtime':>8} {'import (ms)':>12} {'cold start (s)':>15} {'peak RSS (MB)':>14}")
+        for runtime in runtimes:
+            import_ms = cold_import_time("dense_runtime" if runtime == "numpy" else "tensorflow", tmp_dir)
+            seconds, peak_mb = dense_cold_start(runtime, path, tmp_dir)
+            print(f"{runtime:>8} {import_ms:>12.1f} {seconds:>15.3f} {peak_mb:>14.0f}")
+
+    print(f"{'batch':>8} {'numpy (ms)':>11}" + (f" {'predict (ms)':>13} {'call (ms)':>10}" if tf is not None else ""))
+    for batch_size in batch_sizes:
+        batch = X[:batch_size]
+        numpy_ms = min(time_call(network.predict_proba, batch)[1] for _ in range(repeats)) * 1000
+        line = f"{batch_size:>8} {numpy_ms:>11.3f}"
+        if tf is not None:
+            predict_ms = min(time_call(model.predict, batch, verbose=0)[1] for _ in range(repeats)) * 1000
+            call_ms = min(time_call(model, batch, training=False)[1] for _ in range(repeats)) * 1000
+            line += f" {predict_ms:>13.3f} {call_ms:>10.3f}"
+        print(line)
+
+
+def streaming_worker(mode, chunk_rows):
+    """
+    This function run one cleaning path in the current working directory and print its time,
+    peak memory and rows kept as json, called in a fresh interpreter by benchmark_streaming.
+    """
+    import json
+    import resource
+
+    transformation = DataTransformation()
+    start = time.perf_counter()
+    if mode == "stream":
+        rows_out = transformation.cleaning_formatting_stream(chunk_rows)["rows_out"]
+    else:
+        rows_out = len(transformation.cleaning_formatting_value())
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"seconds": time.perf_counter() - start, "peak_mb": peak_mb, "rows_out": rows_out}))
+
+
+def benchmark_streaming(n_rows=None, ram_multiple=None, chunk_rows=100_000, workdir=None):
+    """
+    This function write a synthetic merged_data chunk by chunk, then run cleaning_formatting_stream and,
+    when the data fits in memory, cleaning_formatting_value, each in a fresh interpreter.
+
+    With ram_multiple the row count is chosen so the merged frame would take that multiple of the
+    physical memory once loaded by pandas. Nothing but one chunk is ever held in memory here.
+    """
+    import json
+    from utils import FrameWriter
+
+    ram_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1e6
+    sample = make_raw_merged_frame(10_000)
+    row_bytes = sample.memory_usage(deep=True).sum() / len(sample)
+    if ram_multiple:
+        n_rows = int(ram_multiple * ram_mb * 1e6 / row_bytes)
+    in_memory_mb = n_rows * row_bytes / 1e6
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp_dir:
+        transformation = DataTransformation()
+        config = transformation.transform_config
+        merged_path = os.path.join(tmp_dir, config.merged_data_path)
+
+        start = time.perf_counter()
+        with FrameWriter(merged_path, config.intermediate_format) as writer:
+            for seed, offset in enumerate(range(0, n_rows, chunk_rows)):
+                writer.write(make_raw_merged_frame(min(chunk_rows, n_rows - offset), seed, offset))
+        size_mb = os.path.getsize(writer.out_path) / 1e6
+        print(f"{n_rows} rows, {in_memory_mb:.0f} MB in pandas ({in_memory_mb / ram_mb:.2f}x of {ram_mb:.0f} MB RAM), "
+              f"{size_mb:.0f} MB as {config.intermediate_format}, written in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'path':>8} {'time (s)':>9} {'peak memory (MB)':>17} {'rows kept':>10}")
+        env = dict(os.environ, PYTHONPATH=current_dir)
+        for mode in ["stream", "exact"]:
+            if mode == "exact" and in_memory_mb * 3 > ram_mb:
+                print(f"{mode:>8} {'skipped, does not fit in memory':>38}")
+                continue
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "streaming-worker", mode, str(chunk_rows)],
+                                    cwd=tmp_dir, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"{mode:>8} {'failed':>9} {result.stderr.strip().splitlines()[-1]}")
+                continue
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{mode:>8} {run['seconds']:>9.1f} {run['peak_mb']:>17.0f} {run['rows_out']:>10}")
+
+
+def benchmark_partitioned(scale=10, workers=(1, 2, 4, 8), repeats=1):
+    """
+    This function time dedup_merge_frames + cleaning_formatting_value against transform_partitioned
+    with each worker count on synthetic databases of scale, and check that the outputs match.
+    """
+    from synthetic_data import SyntheticData
+
+    manifest = SyntheticData().generate(scale)
+    frames = {}
+    for name, path in manifest["paths"].items():
+        with sqlite3.connect(path) as conn:
+            frames[name] = pd.read_sql_query(f"SELECT * FROM {name}", conn)
+    weather_df, air_df = frames["weather"], frames["air_quality"]
+    print(f"{scale:g}x : {len(weather_df)} weather and {len(air_df)} air_quality rows, {os.cpu_count()} cores")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            transformation = DataTransformation()
+            single, single_time = min((time_call(lambda: transformation.cleaning_formatting_value(
+                transformation.dedup_merge_frames(weather_df, air_df))) for _ in range(repeats)), key=lambda run: run[1])
+            print(f"{'workers':>8} {'time (s)':>9} {'speedup':>8} {'match':>6}")
+            print(f"{'single':>8} {single_time:>9.2f} {1:>8.2f} {'-':>6}")
+            for n_workers in workers:
+                partitioned, partitioned_time = min((time_call(transformation.transform_partitioned, weather_df, air_df, n_workers)
+                                                     for _ in range(repeats)), key=lambda run: run[1])
+                match = frames_match(single, partitioned) and single.dtypes.equals(partitioned.dtypes)
+                print(f"{n_workers:>8} {partitioned_time:>9.2f} {single_time / partitioned_time:>8.2f} {str(match):>6}")
+        finally:
+            os.chdir(cwd)
+
+
+def sqlite_worker(mode, out_path):
+    """
+    This function run one merge path on the source databases and print its time, peak memory and
+    rows as json, the merged frame is pickled to out_path. Called in a fresh interpreter by benchmark_sqlite.
+    """
+    import json
+    import resource
+    from data_ingestion import DataIngestion
+
+    transformation = DataTransformation()
+    start = time.perf_counter()
+    if mode == "sqlite":
+        df = transformation.dedup_merge_sqlite()
+    else:
+        df = transformation.dedup_merge_frames(*DataIngestion().load_tables())
+    seconds = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    df.to_pickle(out_path)
+    print(json.dumps({"seconds": seconds, "peak_mb": peak_mb, "rows_out": len(df)}))
+
+
+def benchmark_sqlite(scales=(1, 10), seed=None):
+    """
+    This function time the load of both tables + dedup_merge_frames against dedup_merge_sqlite on
+    synthetic databases of each scale, each in a fresh interpreter, and check that the merged frames match.
+    """
+    import json
+    from synthetic_data import SyntheticData
+
+    print(f"{'scale':>6} {'path':>7} {'time (s)':>9} {'peak memory (MB)':>17} {'rows':>9} {'match':>6}")
+    for scale in scales:
+        manifest = SyntheticData().generate(scale, seed=seed)
+        sources = {name: dict(source, db_path=os.path.abspath(manifest["paths"][name]))
+                   for name, source in DataTransformation().transform_config.sources.items()}
+        env = dict(os.environ, PYTHONPATH=current_dir, SOLAR_CONFIG__data_ingestion__sources=json.dumps(sources))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            frames = {}
+            for mode in ["pandas", "sqlite"]:
+                out_path = os.path.join(tmp_dir, f"{mode}.pkl")
+                result = subprocess.run([sys.executable, os.path.abspath(__file__), "sqlite-worker", mode, out_path],
+                                        cwd=tmp_dir, env=env, capture_output=True, text=True)
+                if result.returncode != 0:
+                    print(f"{scale:>5g}x {mode:>7} {'failed':>9} {result.stderr.strip().splitlines()[-1]}")
+                    continue
+                run = json.loads(result.stdout.strip().splitlines()[-1])
+                frames[mode] = pd.read_pickle(out_path)
+                match = "-"
+                if mode == "sqlite" and "pandas" in frames:
+                    match = str(frames_match(frames["pandas"], frames["sqlite"]) and frames["pandas"].dtypes.equals(frames["sqlite"].dtypes))
+                print(f"{scale:>5g}x {mode:>7} {run['seconds']:>9.2f} {run['peak_mb']:>17.0f} {run['rows_out']:>9} {match:>6}")
+
+
+def benchmark_feature_store(scale=10, lookups=1000):
+    """
+    This function compare recomputing the features of all history with the feature store on synthetic
+    databases of scale : first write, rewrite of the unchanged history, write of one new day, point in
+    time read of the whole range and single day lookups.
+    """
+    from synthetic_data import SyntheticData
+    from feature_store import FeatureStore
+
+    manifest = SyntheticData().generate(scale)
+    frames = {}
+    for name, path in manifest["paths"].items():
+        with sqlite3.connect(path) as conn:
+            frames[name] = pd.read_sql_query(f"SELECT * FROM {name}", conn)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            transformation = DataTransformation()
+            final, recompute_time = time_call(lambda: transformation.cleaning_formatting_value(
+                transformation.dedup_merge_frames(frames["weather"], frames["air_quality"])))
+            print(f"{scale:g}x : {len(final)} rows, recomputing every feature takes {recompute_time:.2f}s")
+
+            with FeatureStore(os.path.join(tmp_dir, "features.db")) as store:
+                summary, write_time = time_call(store.write, final, written_at=1.0)
+                print(f"{'first write':>22} {write_time:>9.3f}s {summary}")
+                summary, write_time = time_call(store.write, final, written_at=2.0)
+                print(f"{'unchanged history':>22} {write_time:>9.3f}s {summary}")
+                new_day = final.iloc[:1].assign(date=final['date'].max() + pd.Timedelta(days=1))
+                summary, write_time = time_call(store.write, pd.concat([final, new_day], ignore_index=True), written_at=3.0)
+                print(f"{'history + one new day':>22} {write_time:>9.3f}s {summary}")
+                summary, write_time = time_call(store.write, new_day.assign(date=new_day['date'] + pd.Timedelta(days=1)), written_at=3.0)
+                print(f"{'one new day alone':>22} {write_time:>9.3f}s {summary}")
+
+                point_in_time, read_time = time_call(store.read, as_of=2.0)
+                expected = final.sort_values('date', kind='stable').reset_index(drop=True)
+                match = frames_match(expected, point_in_time.drop(columns='site')) and expected.dtypes.equals(point_in_time.drop(columns='site').dtypes)
+                print(f"{'point in time read':>22} {read_time:>9.3f}s {len(point_in_time)} rows, match {match}")
+
+                days = np.random.default_rng(0).choice(final['date'].dropna().unique(), lookups)
+                store.get_day(days[0])
+                latencies = np.array([time_call(store.get_day, day)[1] for day in days]) * 1000
+                print(f"{'single day lookup':>22} p50 {np.percentile(latencies, 50):.3f} ms, p99 {np.percentile(latencies, 99):.3f} ms")
+        finally:
+            os.chdir(cwd)
+
+
+# A stage regresses when it is both tolerance slower / larger and over these absolute margins
+SUITE_NOISE_SECONDS = 0.05
+SUITE_NOISE_MB = 20
+
+
+def suite_worker(until):
+    """
+    This function run the pipeline stages up to until on the databases in data/ of the current
+    working directory, called in a fresh interpreter by benchmark_suite. Every stage and the steps
+    it calls are recorded by stage_metrics in metrics.jsonl_path.
+    """
+    from pipeline import Pipeline, STAGES
+    from stage_metrics import stage, stage_rows
+
+    pipeline = Pipeline(use_cache=False)
+    data = None
+    for name in STAGES[:STAGES.index(until) + 1]:
+        with stage(f"pipeline_{name}"):
+            data = pipeline.run_stage(name, data)
+            if name == "ingestion":
+                # None under sqlite_pushdown and the changed partitions with incremental set, the tables otherwise
+                frames = [df for df in (data or {}).values() if isinstance(df, pd.DataFrame)]
+                if frames:
+                    stage_rows(rows_out=sum(len(df) for df in frames))
+            elif name == "transformation":
+                # Report of cleaning_formatting_stream with streaming set
+                stage_rows(rows_out=data["rows_out"] if isinstance(data, dict) else len(data))
+            elif name == "preprocessing":
+                stage_rows(rows_out=len(data["split"][0]) + len(data["split"][1]))
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=current_dir, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def previous_results(results_path):
+    """
+    This function return the last stored result of every scale, seed, model and stage.
+    """
+    import json
+
+    last = {}
+    if not os.path.exists(results_path):
+        return last
+    with open(results_path, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result["status"] == "ok":
+                last[(result["scale"], result["seed"], result["model"], result["stage"])] = result
+    return last
+
+
+def benchmark_suite(scales, seed=None, until="training", model_name=None, results_path="benchmarks/suite.jsonl",
+                    tolerance=0.25, workdir=None):
+    """
+    This function run the pipeline on synthetic databases of every scale, each scale in a fresh interpreter,
+    and report the time, rows and peak memory of every stage and step recorded by stage_metrics.
+
+    Results are appended to results_path with the commit they ran on, and compared with the last
+    stored result of the same scale, seed, model and stage. Databases are generated once per scale
+    and seed by SyntheticData and reused by the next runs.
+
+    return
+        bool : True if no stage failed or regressed
+    """
+    import json
+    from pipeline import PipelineConfig
+    from synthetic_data import SyntheticData
+
+    generator = SyntheticData()
+    seed = generator.synthetic_config.seed if seed is None else seed
+    model_name = model_name or PipelineConfig().model_name
+    previous = previous_results(results_path)
+    suite_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    commit = git_commit()
+    ok = True
+
+    print(f"{'scale':>6} {'stage':>28} {'time (s)':>9} {'rows in':>10} {'rows out':>10} {'peak (MB)':>10} {'vs last':>16}")
+    for scale in scales:
+        start = time.perf_counter()
+        manifest = generator.generate(scale, seed=seed)
+        print(f"{scale:>5g}x {'synthetic data':>28} {time.perf_counter() - start:>9.2f} "
+              f"{manifest['settings']['days']:>10} {sum(manifest['rows'].values()):>10}")
+
+        with tempfile.TemporaryDirectory(dir=workdir) as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "data"))
+            for name, source in generator.synthetic_config.sources.items():
+                os.symlink(os.path.abspath(manifest["paths"][name]), os.path.join(tmp_dir, source["db_path"]))
+
+            env = dict(os.environ, PYTHONPATH=current_dir, MPLBACKEND="Agg",
+                       SOLAR_CONFIG__pipeline__model_name=json.dumps(model_name),
+                       SOLAR_CONFIG__metrics__enabled="true")
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "suite-worker", until],
+                                    cwd=tmp_dir, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                ok = False
+                error = (result.stderr.strip().splitlines() or ["no output"])[-1]
+                print(f"{scale:>5g}x {'failed':>28} {error}")
+
+            metrics_path = os.path.join(tmp_dir, "logs", "metrics.jsonl")
+            records = []
+            if os.path.exists(metrics_path):
+                with open(metrics_path, "r") as f:
+                    records = [json.loads(line) for line in f]
+
+        os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+        with open(results_path, "a") as f:
+            for record in records:
+                stored = {
+                    "suite_id": suite_id, "commit": commit, "finished_at": record["finished_at"],
+                    "scale": scale, "seed": seed, "model": model_name, "days": manifest["settings"]["days"],
+                    "stage": record["stage"], "status": record["status"], "wall_time_s": record["wall_time_s"],
+                    "cpu_time_s": record["cpu_time_s"], "rows_in": record["rows_in"], "rows_out": record["rows_out"],
+                    "peak_rss_mb": record["peak_rss_mb"], "cpu_count": os.cpu_count(),
+                }
+                f.write(json.dumps(stored) + "\n")
+
+                comparison = "-"
+                last = previous.get((scale, seed, model_name, record["stage"]))
+                if record["status"] != "ok":
+                    ok = False
+                    comparison = record["status"]
+                elif last:
+                    time_ratio = record["wall_time_s"] / max(last["wall_time_s"], 1e-9)
+                    peak_ratio = record["peak_rss_mb"] / max(last["peak_rss_mb"], 1e-9)
+                    comparison = f"{time_ratio:.2f}x {peak_ratio:.2f}x"
+                    slower = (time_ratio > 1 + tolerance
+                              and record["wall_time_s"] - last["wall_time_s"] > SUITE_NOISE_SECONDS)
+                    larger = (peak_ratio > 1 + tolerance
+                              and record["peak_rss_mb"] - last["peak_rss_mb"] > SUITE_NOISE_MB)
+                    if slower or larger:
+                        ok = False
+                        comparison += " REGRESSION"
+                rows_in = "-" if record["rows_in"] is None else record["rows_in"]
+                rows_out = "-" if record["rows_out"] is None else record["rows_out"]
+                print(f"{scale:>5g}x {record['stage']:>28} {record['wall_time_s']:>9.2f} {rows_in:>10} {rows_out:>10} "
+                      f"{record['peak_rss_mb']:>10.0f} {comparison:>16}")
+    print(f"Results appended to {results_path}, 'vs last' is time and peak memory against the previous run")
+    return ok
+
+
+# Cold import budgets of the entry points. Inference goes through prediction_service, which loads
+# model_bundle, and dense_runtime; utils is the config every module imports
+IMPORT_BUDGETS_MS = {
+    "data_ingestion": 1000,
+    "data_transformation": 1000,
+    "prediction_service": 500,
+    "model_bundle": 150,
+    "dense_runtime": 300,
+    "utils": 150,
+}
+
+
+def cold_import_time(module, cwd):
+    """
+    This function import module in a new interpreter with -X importtime and return the cumulative
+    import time of every top-level import in milliseconds.
+    """
+    env = dict(os.environ, PYTHONPATH=current_dir)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, they are already part of their parent's cumulative time
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1000
+
+
+def benchmark_startup(budgets, repeats=5):
+    """
+    This function measure the cold import time of each entry point (best of repeats) and check that
+    importing it writes nothing to the working directory.
+
+    return
+        bool : True if every entry point is within budget and free of import side effects
+    """
+    ok = True
+    print(f"{'module':>20} {'import (ms)':>12} {'budget (ms)':>12} {'files created':>14}")
+    for module, budget in budgets.items():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            import_ms = min(cold_import_time(module, tmp_dir) for _ in range(repeats))
+            created = os.listdir(tmp_dir)
+        within = import_ms <= budget and not created
+        ok &= within
+        print(f"{module:>20} {import_ms:>12.1f} {budget:>12} {', '.join(created) or '-':>14}{'' if within else '  FAIL'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    coalesce_parser = subparsers.add_parser("coalesce", help="coalesce_rows against the legacy merge")
+    coalesce_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    coalesce_parser.add_argument("--legacy-limit", type=int, default=10_000)
+
+    storage_parser = subparsers.add_parser("storage", help="csv against the columnar intermediate formats")
+    storage_parser.add_argument("--rows", type=int, default=1_000_000)
+
+    ingestion_parser = subparsers.add_parser("ingestion", help="sequential against concurrent source loading")
+    ingestion_parser.add_argument("--repeats", type=int, default=3)
+
+    categories_parser = subparsers.add_parser("categories", help="label normalization against Series.replace")
+    categories_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000])
+
+    startup_parser = subparsers.add_parser("startup", help="cold import time of the entry points, exit 1 over budget")
+    startup_parser.add_argument("--repeats", type=int, default=5)
+    startup_parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, for slower machines")
+
+    service_parser = subparsers.add_parser("service", help="concurrent clients against a running prediction service")
+    service_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    service_parser.add_argument("--requests", type=int, default=1000)
+    service_parser.add_argument("--clients", type=int, default=16)
+    service_parser.add_argument("--records", type=int, default=1, help="records per request")
+
+    features_parser = subparsers.add_parser("features", help="fused numeric kernel against separate pandas passes")
+    features_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 5_000_000])
+    features_parser.add_argument("--repeats", type=int, default=3)
+
+    imbalance_parser = subparsers.add_parser("imbalance", help="cost of each class imbalance strategy")
+    imbalance_parser.add_argument("--rows", type=int, default=200_000)
+    imbalance_parser.add_argument("--features", type=int, default=20)
+
+    dense_parser = subparsers.add_parser("dense", help="NumPy runtime of the dense network against Keras")
+    dense_parser.add_argument("--features", type=int, default=13)
+    dense_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 1024, 100_000])
+
+    trees_parser = subparsers.add_parser("trees", help="flattened tree evaluator against sklearn predict_proba")
+    trees_parser.add_argument("--rows", type=int, default=4000)
+    trees_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+
+    streaming_parser = subparsers.add_parser("streaming", help="chunked cleaning against the in-memory path")
+    streaming_parser.add_argument("--rows", type=int, default=1_000_000)
+    streaming_parser.add_argument("--ram-multiple", type=float, help="size the data to this multiple of the physical memory")
+    streaming_parser.add_argument("--chunk-rows", type=int, default=100_000)
+    streaming_parser.add_argument("--workdir", help="folder for the synthetic data, needs room for it")
+
+    partitioned_parser = subparsers.add_parser("partitioned", help="multi-core partitioned transformation against one process")
+    partitioned_parser.add_argument("--scale", type=float, default=10, help="multiple of synthetic_data.base_days")
+    partitioned_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    partitioned_parser.add_argument("--repeats", type=int, default=1)
+
+    sqlite_parser = subparsers.add_parser("sqlite", help="dedup, coalescing and join in SQLite against pandas")
+    sqlite_parser.add_argument("--scales", type=float, nargs="+", default=[1, 10], help="multiples of synthetic_data.base_days")
+    sqlite_parser.add_argument("--seed", type=int, help="defaults to synthetic_data.seed")
+
+    store_parser = subparsers.add_parser("feature-store", help="feature store writes, point in time reads and day lookups")
+    store_parser.add_argument("--scale", type=float, default=10, help="multiple of synthetic_data.base_days")
+    store_parser.add_argument("--lookups", type=int, default=1000)
+
+    suite_parser = subparsers.add_parser("suite", help="every pipeline stage on synthetic data of each scale, exit 1 on regression")
+    suite_parser.add_argument("--scales", type=float, nargs="+", default=[1, 10], help="multiples of synthetic_data.base_days")
+    suite_parser.add_argument("--seed", type=int, help="defaults to synthetic_data.seed")
+    suite_parser.add_argument("--until", choices=["ingestion", "transformation", "preprocessing", "training"], default="training")
+    suite_parser.add_argument("--model", help="model trained by the training stage, defaults to pipeline.model_name")
+    suite_parser.add_argument("--results", default="benchmarks/suite.jsonl", help="jsonl the results are appended to")
+    suite_parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown or memory growth flagged as a regression")
+    suite_parser.add_argument("--workdir", help="folder for the pipeline outputs of each run")
+
+    suite_worker_parser = subparsers.add_parser("suite-worker")
+    suite_worker_parser.add_argument("until")
+
+    sqlite_worker_parser = subparsers.add_parser("sqlite-worker")
+    sqlite_worker_parser.add_argument("mode", choices=["pandas", "sqlite"])
+    sqlite_worker_parser.add_argument("out_path")
+
+    worker_parser = subparsers.add_parser("streaming-worker")
+    worker_parser.add_argument("mode", choices=["stream", "exact"])
+    worker_parser.add_argument("chunk_rows", type=int)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "coalesce":
+        benchmark_coalesce(args.sizes, args.legacy_limit)
+    elif args.benchmark == "storage":
+        benchmark_storage(args.rows)
+    elif args.benchmark == "ingestion":
+        benchmark_ingestion(args.repeats)
+    elif args.benchmark == "categories":
+        benchmark_categories(args.sizes)
+    elif args.benchmark == "startup":
+        budgets = {module: budget * args.scale for module, budget in IMPORT_BUDGETS_MS.items()}
+        if not benchmark_startup(budgets, args.repeats):
+            sys.exit(1)
+    elif args.benchmark == "service":
+        benchmark_service(args.url, args.requests, args.clients, args.records)
+    elif args.benchmark == "features":
+        benchmark_features(args.sizes, args.repeats)
+    elif args.benchmark == "imbalance":
+        benchmark_imbalance(args.rows, args.features)
+    elif args.benchmark == "dense":
+        benchmark_dense(args.features, args.batch_sizes)
+    elif args.benchmark == "trees":
+        benchmark_trees(args.rows, batch_sizes=args.batch_sizes)
+    elif args.benchmark == "streaming":
+        benchmark_streaming(args.rows, args.ram_multiple, args.chunk_rows, args.workdir)
+    elif args.benchmark == "partitioned":
+        benchmark_partitioned(args.scale, args.workers, args.repeats)
+    elif args.benchmark == "sqlite":
+        benchmark_sqlite(args.scales, args.seed)
+    elif args.benchmark == "feature-store":
+        benchmark_feature_store(args.scale, args.lookups)
+    elif args.benchmark == "suite":
+        if not benchmark_suite(args.scales, args.seed, args.until, args.model, args.results, args.tolerance, args.workdir):
+            sys.exit(1)
+    elif args.benchmark == "suite-worker":
+        suite_worker(args.until)
+    elif args.benchmark == "sqlite-worker":
+        sqlite_worker(args.mode, args.out_path)
+    elif args.benchmark == "streaming-worker":
+        streaming_worker(args.mode, args.chunk_rows)
@@ -1,27 +1,40 @@
 import os
 import sys
+import json
+import time
+import shutil
+import hashlib
 import pandas as pd
-import requests
 import sqlite3
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from utils import load_config
+from utils import config_field, write_frame, month_partitions, partition_dir
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 from logger import logging
 from customexcept import CustomException
+from stage_metrics import track_stage, stage_rows
 
 @dataclass
 class DataIngestionConfig:
-    config = load_config('data_ingestion')
-    db_path: str = os.path.join(config['db_path'])
-    raw_weather_data_path: str = os.path.join(config["raw_weather_data_csv"])
-    raw_air_quality_data_path: str = os.path.join(config["raw_air_quality_data_csv"])
-    weather_url = config["weather_url"]
-    air_quality_url = config["air_quality_url"]
-    weather_db_path: str = os.path.join(config["weather_db_path"])
-    air_quality_db_path: str = os.path.join(config["air_quality_db_path"])
+    db_path: str = config_field('data_ingestion', 'db_path')
+    sources: dict = config_field('data_ingestion', 'sources')
+    weather_db_path: str = config_field('data_ingestion', 'sources', 'weather', 'db_path')
+    air_quality_db_path: str = config_field('data_ingestion', 'sources', 'air_quality', 'db_path')
+    max_workers: int = config_field('data_ingestion', 'max_workers')
+    source_timeout: float = config_field('data_ingestion', 'source_timeout')
+    retry_backoff: float = config_field('data_ingestion', 'retry_backoff')
+    download_chunk_size: int = config_field('data_ingestion', 'download_chunk_size')
+    download_retries: int = config_field('data_ingestion', 'download_retries')
+    download_timeout: int = config_field('data_ingestion', 'download_timeout')
+    raw_partition_path: str = config_field('data_ingestion', 'raw_partition_path')
+    watermark_path: str = config_field('data_ingestion', 'watermark_path')
+    incremental: bool = config_field('data_ingestion', 'incremental')
+    intermediate_format: str = config_field('storage', 'intermediate_format')
+    export_csv: bool = config_field('storage', 'export_csv')
 
 
 
@@ -29,62 +42,360 @@ class DataIngestion:
     def __init__(self):
         self.ingestion_config = DataIngestionConfig()
     
-    def reading_from_db(self):
+    @staticmethod
+    def _read_download_meta(meta_path):
+        if not os.path.exists(meta_path):
+            return {}
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_download_meta(meta_path, meta):
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=4)
+        os.replace(tmp_path, meta_path)
+
+    @staticmethod
+    def _file_sha256(path, chunk_size):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        return sha
+
+    def download_file(self, url, path, deadline=None):
         """
-        This function read sent requests to database url with the path stated in DataIngestionConfig.
+        This function stream url into path in chunks.
+
+        The response is written to path.part and renamed into place once complete, so path is never
+        left half written. Validators (ETag / Last-Modified) and the sha256 of the file are kept in
+        path.meta.json to skip unchanged files on the next run, and an interrupted path.part is resumed
+        with a Range request when the server still holds the same version.
 
-        Saving the response content into data folder.
+        Failed attempts are retried with exponential backoff until download_retries or the deadline is reached.
+
+        Args:
+        url (str): url of the file
+        path (str): destination path
+        deadline (float): time.monotonic() after which the download is abandoned
+
+        return
+            bool : True if path was updated, False if it was already up to date
         """
-        logging.info("Reading from database ....")
-        try: 
+        import requests
+
+        chunk_size = self.ingestion_config.download_chunk_size
+        if deadline is None:
+            deadline = time.monotonic() + self.ingestion_config.source_timeout
+        part_path = path + ".part"
+        meta_path = path + ".meta.json"
+        meta = self._read_download_meta(meta_path)
+
+        for attempt in range(1, self.ingestion_config.download_retries + 1):
+            if attempt > 1:
+                time.sleep(min(self.ingestion_config.retry_backoff * 2 ** (attempt - 2),
+                               max(deadline - time.monotonic(), 0)))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Download of {url} did not finish within {self.ingestion_config.source_timeout}s")
+
+            headers = {}
+            partial = meta.get("partial", {})
+            validator = partial.get("etag") or partial.get("last_modified")
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+            if offset and validator:
+                # Resume the interrupted transfer only if the server still has the same version
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator
+            elif os.path.exists(path):
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+
+            try:
+                with requests.get(url, headers=headers, stream=True,
+                                  timeout=min(self.ingestion_config.download_timeout, remaining)) as response:
+                    if response.status_code == 304:
+                        logging.info(f"{path} not modified, skipping download")
+                        return False
+
+                    if response.status_code == 416:
+                        # Stale partial file, start over
+                        os.remove(part_path)
+                        meta.pop("partial", None)
+                        continue
+
+                    if response.status_code >= 500:
+                        logging.warning(f"Download of {url} failed with {response.status_code} (attempt {attempt})")
+                        continue
+
+                    response.raise_for_status()
+
+                    if response.status_code == 206:
+                        logging.info(f"Resuming {path} from byte {offset}")
+                        sha = self._file_sha256(part_path, chunk_size)
+                        mode = 'ab'
+                    else:
+                        sha = hashlib.sha256()
+                        mode = 'wb'
+                        meta["partial"] = {
+                            "etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified"),
+                        }
+                        self._write_download_meta(meta_path, meta)
+
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            sha.update(chunk)
+                            if time.monotonic() > deadline:
+                                # Keep the .part file, the next run resumes from it
+                                raise TimeoutError(f"Download of {url} did not finish within "
+                                                   f"{self.ingestion_config.source_timeout}s")
 
-            # Request
-            weather_response = requests.get(self.ingestion_config.weather_url)
-            air_quality_response = requests.get(self.ingestion_config.air_quality_url)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                logging.warning(f"Download of {url} interrupted (attempt {attempt}) : {e}")
+                continue
 
+            digest = sha.hexdigest()
+            partial = meta.pop("partial", {})
+            meta.update(partial)
 
+            if digest == meta.get("sha256") and os.path.exists(path):
+                # Server sent the same content again, keep the existing file
+                os.remove(part_path)
+                self._write_download_meta(meta_path, meta)
+                logging.info(f"{path} content unchanged, skipping rewrite")
+                return False
+
+            os.replace(part_path, path)
+            meta["sha256"] = digest
+            self._write_download_meta(meta_path, meta)
+            logging.info(f"{path} downloaded")
+            return True
+
+        raise ConnectionError(f"Unable to download {url} after {self.ingestion_config.download_retries} attempts")
+
+    def run_sources(self, func, label):
+        """
+        This function call func(name, source) for every source in config.json on a thread pool.
+
+        Sources are independent so downloads and SQLite reads overlap, the latency of every source
+        and the speedup over running them one after the other are logged.
+
+        Args:
+        func (callable): function taking the source name and its config
+        label (str): name of the step for logging
+
+        return
+            dict : result of func per source
+        """
+        sources = self.ingestion_config.sources
+        workers = max(1, min(self.ingestion_config.max_workers, len(sources)))
+
+        def timed(name, source):
+            start = time.perf_counter()
+            result = func(name, source)
+            return result, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(timed, name, source) for name, source in sources.items()}
+            results = {name: future.result() for name, future in futures.items()}
+        wall = time.perf_counter() - start
+
+        latencies = {name: latency for name, (_, latency) in results.items()}
+        for name, latency in latencies.items():
+            logging.info(f"{label} {name} took {latency:.3f}s")
+        logging.info(f"{label} of {len(sources)} sources took {wall:.3f}s, "
+                     f"speedup {sum(latencies.values()) / max(wall, 1e-9):.2f}x over sequential")
+        self.latencies = {"step": label, "sources": latencies, "wall": wall}
+
+        return {name: result for name, (result, _) in results.items()}
+
+    def download_source(self, name, source):
+        return self.download_file(source["url"], source["db_path"],
+                                  deadline=time.monotonic() + self.ingestion_config.source_timeout)
+
+    @track_stage("reading_from_db")
+    def reading_from_db(self):
+        """
+        This function download the databases stated in DataIngestionConfig into data folder.
+
+        Sources are downloaded concurrently, streamed to disk and skipped when unchanged upstream, see download_file.
+
+        return
+            dict : True per source if its file was updated
+        """
+        logging.info("Reading from database ....")
+        try: 
             logging.info("Saving db into data path...")
             db_path= os.path.dirname(self.ingestion_config.db_path)
             os.makedirs(db_path, exist_ok=True)
 
-            # Save db
-            with open(self.ingestion_config.weather_db_path, 'wb') as f:
-                f.write(weather_response.content)
-
-            with open(self.ingestion_config.air_quality_db_path, 'wb') as f:
-                f.write(air_quality_response.content)
+            # Download db
+            updated = self.run_sources(self.download_source, "Download")
 
             logging.info("Data is saved")
 
-            return 
+            return updated
         
         except Exception as e:
             raise CustomException(e, sys)
-        
+
+    def load_watermarks(self):
+        path = self.ingestion_config.watermark_path
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save_watermarks(self, watermarks):
+        path = self.ingestion_config.watermark_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(watermarks, f, indent=4)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def is_appended(conn, table, watermark):
+        """
+        This function check that the rows behind a watermark are still in table, so the file only had rows appended.
+
+        The row at the watermark rowid has to keep its date and data_ref, and the rows up to it their count.
+        """
+        row = conn.execute(f"SELECT date, data_ref FROM {table} WHERE rowid = ?", (watermark["rowid"],)).fetchone()
+        if row is None or list(row) != [watermark.get("date"), watermark.get("data_ref")]:
+            return False
+        count = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid <= ?", (watermark["rowid"],)).fetchone()[0]
+        return count == watermark.get("rows")
+
+    def ingest_table(self, name, source, watermarks):
+        """
+        This function read the rows of table added since the last run and append them to the
+        date-partitioned raw store.
+
+        SQLite rowid is used as the high-water mark, the date column is stored as dd/mm/yyyy text
+        and data_ref is a random uuid so neither of them is ordered. The last date and data_ref
+        are kept in the watermark with the size, mtime and sha256 of the source file. The file is only
+        hashed when its size or mtime changed, and an unchanged file is not read,
+        and a file that was replaced rather than appended to, see is_appended, resets the watermark
+        and its raw partitions, so the table is ingested again from the start.
+
+        Args:
+        name (str): source name in config.json
+        source (dict): source config with db_path and table
+        watermarks (dict): watermarks per source, updated in place
+
+        return
+            list : partitions that received new rows
+        """
+        table = source["table"]
+        watermark = watermarks.get(name, {})
+        stat = os.stat(source["db_path"])
+        file_stat = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if all(watermark.get(key) == value for key, value in file_stat.items()):
+            logging.info(f"{source['db_path']} unchanged since the last run")
+            return []
+
+        sha256 = self._file_sha256(source["db_path"], self.ingestion_config.download_chunk_size).hexdigest()
+        if watermark.get("sha256") == sha256:
+            # Touched or downloaded again with the same content
+            logging.info(f"{source['db_path']} unchanged since the last run")
+            watermarks[name] = {**watermark, **file_stat}
+            return []
+
+        with closing(sqlite3.connect(source["db_path"])) as conn:
+            if watermark.get("rowid") and not self.is_appended(conn, table, watermark):
+                logging.warning(f"{source['db_path']} was replaced since the last run, ingesting {table} again")
+                shutil.rmtree(os.path.join(self.ingestion_config.raw_partition_path, name), ignore_errors=True)
+                watermark = {}
+            df = pd.read_sql_query(f"SELECT rowid AS _rowid, * FROM {table} WHERE rowid > ? ORDER BY rowid",
+                                   conn, params=(watermark.get("rowid", 0),))
+
+        if df.empty:
+            logging.info(f"No new rows in {table}")
+            watermarks[name] = {**watermark, **file_stat, "sha256": sha256}
+            return []
+
+        months = month_partitions(df['date'])
+        for month, part in df.groupby(months):
+            # Part files are named after their rowid range, re-running after a crash overwrites them
+            file_name = f"part-{part['_rowid'].iloc[0]:012d}-{part['_rowid'].iloc[-1]:012d}.csv"
+            path = os.path.join(partition_dir(self.ingestion_config.raw_partition_path, name, month), file_name)
+            write_frame(part.drop(columns='_rowid'), path,
+                        self.ingestion_config.intermediate_format, self.ingestion_config.export_csv)
+
+        watermarks[name] = {
+            "rowid": int(df['_rowid'].iloc[-1]),
+            "date": df['date'].iloc[-1],
+            "data_ref": df['data_ref'].iloc[-1],
+            "rows": watermark.get("rows", 0) + len(df),
+            "sha256": sha256,
+            **file_stat,
+        }
+        logging.info(f"{len(df)} new rows in {table} written to {months.nunique()} partitions")
+        return sorted(months.unique())
+
+    @staticmethod
+    def read_table(name, source):
+        with closing(sqlite3.connect(source["db_path"])) as conn:
+            return pd.read_sql_query(f"SELECT * FROM {source['table']}", conn)
+
+    def load_sources(self):
+        """
+        This function read the full table of every source concurrently.
+
+        return
+            dict : dataframe per source
+        """
+        return self.run_sources(self.read_table, "Load")
+
+    def load_tables(self):
+        """
+        This function read the full weather and air_quality tables.
+
+        return
+            weather_df, air_df
+        """
+        frames = self.load_sources()
+        return frames["weather"], frames["air_quality"]
+
+    @track_stage("reading_dataframe_from_path")
     def reading_dataframe_from_path(self):
+        """
+        This function read the table of every source into the raw store, sources are read concurrently.
+
+        With incremental set in config.json only rows added since the last run are read and
+        appended to the date-partitioned store, otherwise the tables are read in full.
+
+        return
+            dict : partitions that received new rows per source, or the dataframe per source for a full read
+        """
         logging.info("Reading dataframe....")
         try: 
-            # Connect to the weather database
-            weather_conn = sqlite3.connect(self.ingestion_config.weather_db_path)
-            air_quality_conn = sqlite3.connect(self.ingestion_config.air_quality_db_path)
-
-            # Define a query
-            weather_query = "SELECT * FROM weather" 
-            air_quality_query = "SELECT * FROM air_quality" 
-
-            # Execute the query and load the results into a Pandas DataFrame
-            weather_df = pd.read_sql_query(weather_query, weather_conn)
-            air_df = pd.read_sql_query(air_quality_query, air_quality_conn)
-
-            # Close the connection
-            weather_conn.close()
-            air_quality_conn.close()
-
-            os.makedirs(self.ingestion_config.db_path+"/raw",exist_ok=True)
-            # Saving dataframe into csv
-            weather_df.to_csv(self.ingestion_config.raw_weather_data_path,index=False)
-            air_df.to_csv(self.ingestion_config.raw_air_quality_data_path,index=False)
-            logging.info("Data retrieved and saved into csv")
+            if self.ingestion_config.incremental:
+                watermarks = self.load_watermarks()
+                changed = self.run_sources(
+                    lambda name, source: self.ingest_table(name, source, watermarks), "Ingest")
+                # Only move the watermarks once the partitions are on disk
+                self.save_watermarks(watermarks)
+                logging.info("New data retrieved and saved")
+                return changed
+
+            frames = self.load_sources()
+            stage_rows(rows_out=sum(len(df) for df in frames.values()))
+
+            # Saving dataframe into the intermediate store
+            for name, df in frames.items():
+                write_frame(df, self.ingestion_config.sources[name]["raw_path"],
+                            self.ingestion_config.intermediate_format, self.ingestion_config.export_csv)
+            logging.info("Data retrieved and saved")
+            return frames
 
         except Exception as e:
             raise CustomException(e, sys)
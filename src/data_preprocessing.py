@@ -4,30 +4,64 @@ from logger import logging
 from customexcept import CustomException
 from dataclasses import dataclass
 import pandas as pd
-from utils import load_config
-
-from sklearn.preprocessing import OrdinalEncoder, OneHotEncoder, StandardScaler, MinMaxScaler, LabelEncoder
-from sklearn.impute import SimpleImputer
-from sklearn.pipeline import Pipeline
-from sklearn.compose import ColumnTransformer
-from sklearn.model_selection import train_test_split
-from imblearn.over_sampling import SMOTE
+from utils import config_field, read_frame
+from model_bundle import feature_schema, frame_hash
+from stage_metrics import track_stage, stage_rows
 
 @dataclass
 class DataPreprocessingConfig:
-    config = load_config('data_preprocessing')
-    clean_data_path: str = os.path.join(config['clean_data.csv'])
+    clean_data_path: str = config_field('data_preprocessing', 'clean_data.csv')
+    intermediate_format: str = config_field('storage', 'intermediate_format')
+    memory_map: bool = config_field('storage', 'memory_map')
+    feature_store: bool = config_field('feature_store', 'enabled')
 
 class DataPreprocessing:
+    TARGET = 'Daily Solar Panel Efficiency'
+
     def __init__(self):
         self.preprocess_config = DataPreprocessingConfig()
+
+    def features_target(self, pipeline, df=None):
+        """
+        This function select the columns consumed by the pipeline and the target
+
+        Args:
+        pipeline (Pipeline): pipeline returned by preprocessing_pipeline
+        df (pd.DataFrame): clean dataframe, read from the feature store when enabled or clean_data_path when not given
+
+        return
+            X, y
+        """
+        # Read data frame
+        if df is None and self.preprocess_config.feature_store:
+            df = self.read_feature_store()
+        elif df is None:
+            df = read_frame(self.preprocess_config.clean_data_path, self.preprocess_config.intermediate_format,
+                            memory_map=self.preprocess_config.memory_map)
+        features = [column for _, _, columns in pipeline.named_steps['preprocessing'].transformers for column in columns]
+        return df[features], df[self.TARGET]
     
+    def read_feature_store(self):
+        """
+        This function read the training rows from the feature store, the days from feature_store.training_start
+        to training_end as they were at feature_store.as_of. Empty settings leave the range open and read the latest features.
+        """
+        from feature_store import FeatureStore
+
+        with FeatureStore() as store:
+            config = store.store_config
+            return store.read(config.training_start, config.training_end, config.as_of)
+
     def preprocessing_pipeline(self):
         """
         This function create and return pipeline for preprocessing
         """
         logging.info("Creating preprocessing pipeline")
         try:
+            from sklearn.preprocessing import OrdinalEncoder, OneHotEncoder, StandardScaler, MinMaxScaler
+            from sklearn.impute import SimpleImputer
+            from sklearn.pipeline import Pipeline
+            from sklearn.compose import ColumnTransformer
 
             # Categorical feature
             ohe_feature = ['Wind Direction']
@@ -80,38 +114,48 @@ class DataPreprocessing:
             logging.error(f"Fail to create pipeline : {e}")
             raise CustomException(e, sys)
     
-    def scale_data(self):
+    @track_stage("scale_data")
+    def scale_data(self, df=None, resample=True):
         """
         This function scale the data and split the data
 
+        Args:
+        df (pd.DataFrame): clean dataframe, read from clean_data_path when not given
+        resample (bool): oversample the training rows, False to split a validation set off them first
+
         return
             X_train, X_test, y_train, y_test
 
         """
         logging.info("Scaling data.....")
         try: 
+            from sklearn.model_selection import train_test_split
+            from imbalance import ImbalanceHandler
 
-            # Read data frame
-            df = pd.read_csv(self.preprocess_config.clean_data_path)
-            classifier = 'Daily Solar Panel Efficiency'
-            
-            X = df.drop(columns=classifier)
-            y = df[classifier]
 
             # Pipeline
             pipeline = self.preprocessing_pipeline()
+            X, y = self.features_target(pipeline, df)
+            stage_rows(rows_in=len(X))
+
+            # Schema and hash of the training data, saved with the model bundle
+            self.schema = feature_schema(X, self.TARGET)
+            self.data_hash = frame_hash(X, y)
 
             # # Data preprocessing
             X = pipeline.fit_transform(X)
+            self.pipeline = pipeline
 
             # Spliting dataframe with train test split
             X_train, X_test, y_train, y_test = train_test_split(X,y,test_size=0.2,random_state=42)
 
-            # Oversample in training data
-            smote = SMOTE(random_state=22)
-            X_train, y_train = smote.fit_resample(X_train,y_train)
+            # Oversample in training data, or leave it to the model, depending on imbalance.strategy
+            self.imbalance = ImbalanceHandler()
+            if resample:
+                X_train, y_train = self.imbalance.resample(X_train, y_train)
 
             logging.info("Data have been scaled")
+            stage_rows(rows_out=len(X_train) + len(X_test))
             return X_train, X_test, y_train, y_test
         
         except Exception as e:
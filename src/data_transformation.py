@@ -1,75 +1,472 @@
 import os
+import re
 import json
 import sys
+import shutil
+import tempfile
+import sqlite3
+import multiprocessing
+from contextlib import closing
 from dataclasses import dataclass
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 from logger import logging
 from customexcept import CustomException
-from utils import load_config
+from stage_metrics import track_stage, stage_rows
+from utils import config_field, read_frame, write_frame, iter_frame, FrameWriter, intermediate_path, list_partition_files, normalize_mixed_columns
 
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from scipy import stats
+
+# Label aliases, compiled by compile_aliases into lookup tables keyed on label_key
+DEW_POINT_ALIASES = {
+    'High': 'High',
+    'Very High': 'Very High',
+    'Very Low': 'Very Low',
+    'Moderate': 'Moderate',
+    'Low': 'Low',
+    'High Level': 'High',
+    'H': 'High',
+    'HIGH': 'High',
+    'high': 'High',
+    'very high': 'Very High',
+    'Extreme': 'Extreme',
+    'VERY HIGH': 'Very High',
+    'VH': 'Very High',
+    'M': 'Moderate',
+    'MODERATE': 'Moderate',
+    'LOW': 'Low',
+    'Normal': 'Moderate',  # Assuming 'Normal' is akin to 'Moderate'
+    'Minimal': 'Very Low',  # Assuming 'Minimal' is akin to 'Very Low'
+    'VL': 'Very Low',
+    'very low': 'Very Low',
+    'low': 'Low',
+    'moderate': 'Moderate',
+    'Below Average': 'Low',  # Assuming 'Below Average' is akin to 'Low'
+    'L': 'Low',
+    'VERY LOW': 'Very Low'
+}
+
+WIND_DIRECTION_ALIASES = {
+    'SW': 'Southwest',
+    'SW.': 'Southwest',
+    'southwest': 'Southwest',
+    'SOUTHEAST': 'Southeast',
+    'southeast': 'Southeast',
+    'SE': 'Southeast',
+    'SE.': 'Southeast',
+    'NORTHEAST': 'Northeast',
+    'northeast': 'Northeast',
+    'NE': 'Northeast',
+    'NE.': 'Northeast',
+    'NORTHWEST': 'Northwest',
+    'northwest': 'Northwest',
+    'NW': 'Northwest',
+    'NW.': 'Northwest',
+    'Northward': 'North',
+    'NORTH': 'North',
+    'north': 'North',
+    'N': 'North',
+    'N.': 'North',
+    'Southward': 'South',
+    'SOUTH': 'South',
+    'south': 'South',
+    'S': 'South',
+    'S.': 'South',
+    'WEST': 'West',
+    'west': 'West',
+    'W': 'West',
+    'W.': 'West',
+    'EAST': 'East',
+    'east': 'East',
+    'E': 'East',
+    'E.': 'East'
+}
+
+
+def label_key(label):
+    """
+    Case-fold a label and strip whitespace and punctuation, 'SW.' and ' sw' give the same key.
+    """
+    return re.sub(r'[\W_]+', '', str(label).casefold())
+
+def compile_aliases(aliases):
+    """
+    Build a lookup table from label_key of every alias and canonical label to the canonical label.
+    """
+    table = {label_key(canonical): canonical for canonical in aliases.values()}
+    for alias, canonical in aliases.items():
+        table[label_key(alias)] = canonical
+    return table
+
+DEW_POINT_TABLE = compile_aliases(DEW_POINT_ALIASES)
+WIND_DIRECTION_TABLE = compile_aliases(WIND_DIRECTION_ALIASES)
+
+# Significant digits of a decimal that float32 always reads back, 7 do not always fit in its 24 bits
+FLOAT32_DIGITS = 6
+FLOAT32_TINY = np.finfo(np.float32).tiny
+
+def float32_lossless(values):
+    """
+    True when every value of a float64 array is a decimal of at most FLOAT32_DIGITS significant
+    digits inside the normal float32 range, so rounding its float32 cast to that many digits gives
+    the value back exactly. NaN passes, infinities do not.
+
+    Values parsed from text like 23.4 or 1013.25 pass, computed values like 1 / 3 do not.
+    """
+    values = values[~np.isnan(values)]
+    nonzero = values[values != 0]
+    magnitude = np.abs(nonzero)
+    if not np.all(np.isfinite(nonzero)) or np.any(magnitude < FLOAT32_TINY) or np.any(magnitude > np.finfo(np.float32).max):
+        return False
+    downcast = nonzero.astype(np.float32).astype(np.float64)
+    # Decimal places kept, division and multiplication by an exact power of ten are correctly rounded
+    places = FLOAT32_DIGITS - 1 - np.floor(np.log10(np.abs(downcast))).astype(np.int64)
+    scale = 10.0 ** np.abs(places)
+    decimal = np.where(places >= 0, np.round(downcast * scale) / scale, np.round(downcast / scale) * scale)
+    return bool(np.array_equal(decimal, nonzero))
+
+# Input of the running transform_partitioned, inherited by its forked workers
+_shared_frames = None
+
+def partition_rows(keys):
+    """
+    Row numbers of every partition key, in row order.
+    """
+    order = np.argsort(keys, kind='stable')
+    bounds = np.flatnonzero(np.diff(keys[order])) + 1
+    return dict(zip(keys[order[np.r_[0, bounds]]].tolist(), np.split(order, bounds))) if len(keys) else {}
+
+def _transform_shared_partition(transformation, weather_rows, air_rows):
+    weather_df, air_df = _shared_frames
+    return transformation.transform_partition(weather_df.take(weather_rows), air_df.take(air_rows))
+
 
 @dataclass
 class DataTransformationConfig:
-    config = load_config("data_transformation")
-    raw_weather_data_path: str = os.path.join(config['raw_weather_data_path'])
-    raw_air_quality_data_path: str = os.path.join(config['raw_air_quality_data_path'])
-    merged_data_path: str = os.path.join(config['merged_data_path'])
-    final_data_path: str = os.path.join(config['final_data_path'])
-    clean_data_path: str = os.path.join(config['clean_data_path'])
+    raw_weather_data_path: str = config_field('data_transformation', 'raw_weather_data_path')
+    raw_air_quality_data_path: str = config_field('data_transformation', 'raw_air_quality_data_path')
+    merged_data_path: str = config_field('data_transformation', 'merged_data_path')
+    final_data_path: str = config_field('data_transformation', 'final_data_path')
+    clean_data_path: str = config_field('data_transformation', 'clean_data_path')
+    raw_partition_path: str = config_field('data_ingestion', 'raw_partition_path')
+    merged_partition_path: str = config_field('data_transformation', 'merged_partition_path')
+    incremental: bool = config_field('data_ingestion', 'incremental')
+    downcast_floats: bool = config_field('data_transformation', 'downcast_floats')
+    streaming: bool = config_field('data_transformation', 'streaming')
+    chunk_rows: int = config_field('data_transformation', 'chunk_rows')
+    sketch_capacity: int = config_field('data_transformation', 'sketch_capacity')
+    partitioned: bool = config_field('data_transformation', 'partitioned')
+    max_workers: int = config_field('data_transformation', 'max_workers')
+    partitions_per_worker: int = config_field('data_transformation', 'partitions_per_worker')
+    sqlite_pushdown: bool = config_field('data_transformation', 'sqlite_pushdown')
+    feature_store: bool = config_field('feature_store', 'enabled')
+    sources: dict = config_field('data_ingestion', 'sources')
+    intermediate_format: str = config_field('storage', 'intermediate_format')
+    export_csv: bool = config_field('storage', 'export_csv')
+    memory_map: bool = config_field('storage', 'memory_map')
 
 
 class DataTransformation:
+    # Columns stored as text in the source tables
+    NUMERIC_COLUMNS = ['Daily Rainfall Total (mm)','Highest 30 Min Rainfall (mm)','Highest 60 Min Rainfall (mm)','Highest 120 Min Rainfall (mm)','Min Temperature (deg C)','Maximum Temperature (deg C)','Min Wind Speed (km/h)',
+                       'Max Wind Speed (km/h)','pm25_north','pm25_south','pm25_east','pm25_west','pm25_central','psi_north','psi_south','psi_east','psi_west','psi_central']
+    CATEGORY_COLUMNS = ['Wind Direction', 'Dew Point Category']
+    DATE_FORMAT = '%d/%m/%Y'
+
+    # Derived features, the mean of their columns
+    AVERAGE_FEATURES = {
+        'average_wind_speed': ['Min Wind Speed (km/h)', 'Max Wind Speed (km/h)'],
+        'average_temperature': ['Min Temperature (deg C)', 'Maximum Temperature (deg C)'],
+        'psi_average': ['psi_north', 'psi_central', 'psi_east', 'psi_south', 'psi_west'],
+        'pm25_average': ['pm25_central', 'pm25_north', 'pm25_south', 'pm25_east', 'pm25_west'],
+    }
+    # Columns replaced by the averages, dropped to prevent noise
+    DROP_COLUMNS = ['pm25_north','pm25_south','pm25_east','pm25_west','pm25_central','psi_central',
+                    'psi_north','psi_south','psi_east','psi_west',
+                    'Highest 30 Min Rainfall (mm)', 'Highest 60 Min Rainfall (mm)','Highest 120 Min Rainfall (mm)',
+                    'Min Wind Speed (km/h)', 'Max Wind Speed (km/h)',
+                    'Min Temperature (deg C)', 'Maximum Temperature (deg C)']
+    # Log transformed, then filtered on their z-score
+    LOG_FEATURES = ['Air Pressure (hPa)','Wet Bulb Temperature (deg F)','average_wind_speed','Daily Rainfall Total (mm)',
+                    'Sunshine Duration (hrs)','Cloud Cover (%)','Relative Humidity (%)','average_temperature','psi_average','pm25_average']
+    ZSCORE_THRESHOLD = 3
+
     def __init__(self):
         self.transform_config = DataTransformationConfig()
 
-    def merge_rows(group):
-        merged = group.iloc[0].copy()
-        for i in range(1, len(group)):
-            for col in group.columns:
-                if pd.isna(merged[col]) or merged[col] in [None, '-', '--']:
-                    merged[col] = group.iloc[i][col] if not pd.isna(group.iloc[i][col]) and group.iloc[i][col] not in [None, '-', '--'] else merged[col]
-        return merged
+    def read_intermediate(self, path, columns=None):
+        return read_frame(path, self.transform_config.intermediate_format, columns=columns,
+                          memory_map=self.transform_config.memory_map)
 
+    def write_intermediate(self, df, path):
+        return write_frame(df, path, self.transform_config.intermediate_format, self.transform_config.export_csv)
 
-    def drop_duplicates_merge(self):
+    @staticmethod
+    def coalesce_rows(df, key, missing_values=('-', '--')):
         """
-        This function drop duplicates for weather.csv and air_quality.csv
+        This function collapse rows sharing the same key into a single row,
+        taking the first valid value of every column.
+
+        None, NaN and the placeholders in missing_values are treated as missing.
+        When a column has no valid value in a group, the value of the first row is kept.
+
+        Args:
+        df (pd.DataFrame): dataframe with duplicated keys
+        key (str): column to group on
+        missing_values (tuple): placeholder strings treated as missing
+
+        return
+            pd.DataFrame indexed by key and sorted by key
+        """
+        keys = df[key]
+        values = df.drop(columns=key)
+
+        # Hide missing values so groupby first() skips over them
+        valid = values.mask(values.isna() | values.isin(list(missing_values)))
+        coalesced = valid.groupby(keys, sort=True).first()
+
+        # Fall back to the first row of each group where no valid value exists
+        first_mask = ~keys.duplicated() & keys.notna()
+        first_rows = values[first_mask].set_index(keys[first_mask]).sort_index()
+        first_rows = first_rows.reindex(coalesced.index)
+
+        return coalesced.where(coalesced.notna(), first_rows).infer_objects()
+
+
+    @staticmethod
+    def dedup_merge_frames(weather_df, air_df, position_column=None):
+        """
+        This function drop duplicates of both dataframes, coalesce duplicated air_quality rows
+        and join them on date.
+
+        Args:
+        weather_df (pd.DataFrame): weather rows
+        air_df (pd.DataFrame): air_quality rows
+        position_column (str): when given, the index label of the weather row of every merged row is kept in this column
 
         return 
             pd.DataFrame
         """
-        try:
-            logging.info("Reading csv files....")
-            weather_df = pd.read_csv(self.transform_config.raw_weather_data_path)
-            air_df = pd.read_csv(self.transform_config.raw_air_quality_data_path)
+        # Drop duplicate data
+        weather_df = weather_df.drop_duplicates()
+        if position_column:
+            weather_df = weather_df.assign(**{position_column: weather_df.index})
+        air_df = air_df.drop_duplicates()
+        logging.info("Drop duplicates for both dataframe.")
 
-            # Drop duplicate data
-            weather_df = weather_df.drop_duplicates()
-            air_df = air_df.drop_duplicates()
-            logging.info("Drop duplicates for both dataframe.")
+        # Getting dataframe for duplicated row for air_quality data
+        duplicates = air_df[air_df.duplicated('data_ref',keep=False)]
 
-            # Getting dataframe for duplicated row for air_quality data
-            duplicates = air_df[air_df.duplicated('data_ref',keep=False)]
+        # Merging row
+        merged_rows = DataTransformation.coalesce_rows(duplicates, 'data_ref').reset_index(drop=True)
+        logging.info("Merge air duplicated rows.")
 
-            # Merging row
-            merged_rows = duplicates.groupby('data_ref').apply(DataTransformation.merge_rows,include_groups=False).reset_index(drop=True)
-            logging.info("Merge air duplicated rows.")
+        # Merging psi and pm25 into same data frame
+        non_duplicates = air_df[~air_df['data_ref'].isin(duplicates['data_ref'])]
+        final_air_df = pd.concat([non_duplicates, merged_rows], ignore_index=True)  
 
-            # Merging psi and pm25 into same data frame
-            non_duplicates = air_df[~air_df['data_ref'].isin(duplicates['data_ref'])]
-            final_air_df = pd.concat([non_duplicates, merged_rows], ignore_index=True)  
+        df = pd.merge(weather_df, final_air_df, on='date', how='inner')
+        return df.drop(columns=['data_ref_x'])
 
-            os.makedirs(self.transform_config.clean_data_path,exist_ok=True)
-            df = pd.merge(weather_df, final_air_df, on='date', how='inner')
-            df = df.iloc[:,2:]
+    def iter_merged_sqlite(self, chunk_rows=None):
+        """
+        This function run dedup_merge_frames inside SQLite on the source databases and yield the
+        joined rows in chunks of chunk_rows rows.
+
+        Both databases are attached read only to a temporary database, where :
+            1. exact duplicate rows are dropped, keeping the first by rowid
+            2. air_quality rows sharing a data_ref are coalesced with GROUP BY, every column taking
+               the value of the first row where it is neither NULL nor a '-' / '--' placeholder
+            3. the weather rows are joined on date through an index on the air_quality rows
+
+        Rows come out in the order of the pandas merge, with the same columns and values.
+
+        Args:
+        chunk_rows (int): rows per chunk, data_transformation.chunk_rows when not given
+
+        return
+            iterator of pd.DataFrame
+        """
+        from urllib.parse import quote
+
+        def name(column):
+            return '"' + column.replace('"', '""') + '"'
+
+        chunk_rows = chunk_rows or self.transform_config.chunk_rows
+        sources = self.transform_config.sources
+        weather, air = sources["weather"], sources["air_quality"]
+        placeholders = "('-', '--')"
+
+        # Temporary on-disk database, removed on close
+        with closing(sqlite3.connect("", uri=True)) as conn:
+            for alias, source in [("weather_src", weather), ("air_src", air)]:
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (f"file:{quote(os.path.abspath(source['db_path']))}?mode=ro",))
+            weather_info = conn.execute(f"PRAGMA weather_src.table_info({name(weather['table'])})").fetchall()
+            air_info = conn.execute(f"PRAGMA air_src.table_info({name(air['table'])})").fetchall()
+            weather_columns, air_columns = [row[1] for row in weather_info], [row[1] for row in air_info]
+
+            # 1. drop_duplicates, first row of every group of identical rows
+            for table, alias, source, columns in [("weather_rows", "weather_src", weather, weather_columns),
+                                                  ("air_rows", "air_src", air, air_columns)]:
+                source_table = f"{alias}.{name(source['table'])}"
+                conn.execute(f"CREATE TABLE {table} AS SELECT * FROM {source_table} WHERE rowid IN "
+                             f"(SELECT MIN(rowid) FROM {source_table} GROUP BY {', '.join(map(name, columns))}) ORDER BY rowid")
+            conn.execute("CREATE INDEX air_rows_data_ref ON air_rows(data_ref)")
+
+            # 2. coalesce the air_quality rows sharing a data_ref, NULL data_refs are not a group
+            conn.execute("CREATE TABLE shared_refs AS SELECT data_ref FROM air_rows GROUP BY data_ref HAVING COUNT(*) > 1")
+            conn.execute("CREATE INDEX shared_refs_data_ref ON shared_refs(data_ref)")
+            values = [column for column in air_columns if column != "data_ref"]
+            first_valid = ", ".join(f"MIN(CASE WHEN {name(column)} IS NOT NULL AND {name(column)} NOT IN {placeholders} "
+                                    f"THEN rowid END) AS valid_{index}" for index, column in enumerate(values))
+            conn.execute(f"CREATE TABLE coalesced AS SELECT data_ref, MIN(rowid) AS first_row, {first_valid} FROM air_rows "
+                         f"WHERE data_ref IN (SELECT data_ref FROM shared_refs WHERE data_ref IS NOT NULL) GROUP BY data_ref")
+
+            # Rows that were not shared in their order, then the coalesced rows by data_ref, which loses its value like in pandas
+            coalesced_values = {column: f"(SELECT {name(column)} FROM air_rows r WHERE r.rowid = COALESCE(g.valid_{index}, g.first_row))"
+                                for index, column in enumerate(values)}
+            conn.execute(
+                f"CREATE TABLE air_final AS "
+                f"SELECT 0 AS part, rowid AS seq, {', '.join(map(name, air_columns))} FROM air_rows a "
+                f"WHERE NOT EXISTS (SELECT 1 FROM shared_refs s WHERE s.data_ref IS a.data_ref) "
+                f"UNION ALL "
+                f"SELECT 1, ROW_NUMBER() OVER (ORDER BY g.data_ref), "
+                f"{', '.join('NULL' if column == 'data_ref' else coalesced_values[column] for column in air_columns)} "
+                f"FROM coalesced g")
+            conn.execute("CREATE INDEX air_final_date ON air_final(date, part, seq)")
+
+            # 3. inner join on date, in weather order then air_quality order like pd.merge, NULL dates match each other
+            shared = (set(weather_columns) & set(air_columns)) - {"date"}
+            # Dtypes from the declared column types, so a chunk of NULLs has the dtype of the others
+            declared = {"REAL": "float64", "FLOAT": "float64", "DOUBLE": "float64", "TEXT": "str"}
+            select, dtypes = [], {}
+            for alias, info, suffix, dropped in [("w", weather_info, "_x", "data_ref"), ("a", air_info, "_y", "date")]:
+                for _, column, column_type, *_ in info:
+                    if column == dropped:
+                        continue
+                    output = column + suffix if column in shared else column
+                    select.append(f"{alias}.{name(column)} AS {name(output)}")
+                    if column_type.upper() in declared:
+                        dtypes[output] = declared[column_type.upper()]
+            query = (f"SELECT {', '.join(select)} FROM weather_rows w JOIN air_final a ON a.date IS w.date "
+                     f"ORDER BY w.rowid, a.part, a.seq")
+            yield from pd.read_sql_query(query, conn, chunksize=chunk_rows, dtype=dtypes)
+
+    def dedup_merge_sqlite(self, chunk_rows=None):
+        """
+        This function return the rows of iter_merged_sqlite, the same dataframe as dedup_merge_frames
+        on the full tables.
+
+        return
+            pd.DataFrame
+        """
+        return pd.concat(self.iter_merged_sqlite(chunk_rows), ignore_index=True)
+
+    def read_partition(self, files):
+        frames = [read_frame(path, self.transform_config.intermediate_format,
+                             memory_map=self.transform_config.memory_map) for path in files]
+        # Parts written on different runs can type the same column differently
+        return normalize_mixed_columns(pd.concat(frames, ignore_index=True))
+
+    def changed_partitions(self):
+        """
+        This function list the months whose raw partitions were written after their merged partition,
+        and the merged months left without raw partitions by a source ingested again.
+
+        return 
+            list
+        """
+        fmt = self.transform_config.intermediate_format
+        root = self.transform_config.raw_partition_path
+        weather_parts = list_partition_files(root, "weather", fmt)
+        air_parts = list_partition_files(root, "air_quality", fmt)
+        merged_parts = list_partition_files(self.transform_config.merged_partition_path, "merged", fmt)
+
+        changed = []
+        for month in sorted(set(weather_parts) | set(air_parts)):
+            raw_mtime = max(os.path.getmtime(path) for path in weather_parts.get(month, []) + air_parts.get(month, []))
+            if month not in merged_parts or os.path.getmtime(merged_parts[month][0]) < raw_mtime:
+                changed.append(month)
+        return changed + sorted(set(merged_parts) - set(weather_parts) - set(air_parts))
 
-            df.to_csv(self.transform_config.merged_data_path)
+    def merge_partitions(self):
+        """
+        This function rebuild the merged partitions of the months that received new raw rows,
+        and concatenate every merged partition.
+
+        return 
+            pd.DataFrame
+        """
+        fmt = self.transform_config.intermediate_format
+        root = self.transform_config.raw_partition_path
+        weather_parts = list_partition_files(root, "weather", fmt)
+        air_parts = list_partition_files(root, "air_quality", fmt)
+
+        changed = self.changed_partitions()
+        logging.info(f"Merging {len(changed)} changed partitions : {changed}")
+        for month in changed:
+            merged_path = os.path.join(self.transform_config.merged_partition_path, "merged", f"month={month}", "part.csv")
+            if month not in weather_parts or month not in air_parts:
+                # Nothing to join yet, drop any stale merged partition
+                stale_path = intermediate_path(merged_path, fmt)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+                continue
+
+            df = self.dedup_merge_frames(self.read_partition(weather_parts[month]),
+                                         self.read_partition(air_parts[month]))
+            self.write_intermediate(df, merged_path)
+
+        merged_parts = list_partition_files(self.transform_config.merged_partition_path, "merged", fmt)
+        if not merged_parts:
+            raise ValueError("No merged partitions found, run data ingestion first")
+        return pd.concat([self.read_partition(files) for files in merged_parts.values()], ignore_index=True)
+
+    @track_stage("drop_duplicates_merge")
+    def drop_duplicates_merge(self, weather_df=None, air_df=None):
+        """
+        This function drop duplicates for the raw weather and air_quality data and merge them.
+
+        With sqlite_pushdown the source databases are merged by iter_merged_sqlite instead of the raw store,
+        and with streaming also set the rows are written chunk by chunk and None is returned.
+        Otherwise with incremental set in config.json only the months with new raw partitions are merged again.
+
+        Args:
+        weather_df (pd.DataFrame): weather rows, read from the raw store when not given
+        air_df (pd.DataFrame): air_quality rows, read from the raw store when not given
+
+        return 
+            pd.DataFrame
+        """
+        try:
+            if self.transform_config.sqlite_pushdown and self.transform_config.streaming:
+                # Joined rows go from SQLite to merged_data chunk by chunk, cleaning_formatting_stream reads them back
+                logging.info("Merging raw data in SQLite....")
+                with FrameWriter(self.transform_config.merged_data_path, self.transform_config.intermediate_format,
+                                 self.transform_config.export_csv) as writer:
+                    for chunk in self.iter_merged_sqlite():
+                        writer.write(chunk)
+                stage_rows(rows_out=writer.rows)
+                logging.info("Dataframe merged saved successfully.")
+                return None
+            elif self.transform_config.sqlite_pushdown:
+                logging.info("Merging raw data in SQLite....")
+                df = self.dedup_merge_sqlite()
+            elif self.transform_config.incremental and weather_df is None:
+                df = self.merge_partitions()
+            else:
+                logging.info("Reading raw data....")
+                if weather_df is None:
+                    weather_df = self.read_intermediate(self.transform_config.raw_weather_data_path)
+                if air_df is None:
+                    air_df = self.read_intermediate(self.transform_config.raw_air_quality_data_path)
+                stage_rows(rows_in=len(weather_df) + len(air_df))
+                df = self.dedup_merge_frames(weather_df, air_df)
+
+            os.makedirs(self.transform_config.clean_data_path,exist_ok=True)
+            self.write_intermediate(df, self.transform_config.merged_data_path)
             logging.info("Dataframe merged saved successfully.")
 
             return df
@@ -78,31 +475,110 @@ class DataTransformation:
             logging.error(f"Unable to drop duplicates and merged data : {e}")
             raise CustomException(e,sys)
         
-    def transforming_dtype(self):
+    @staticmethod
+    def normalize_categories(series, table):
+        """
+        This function map every label of series to its canonical label through a compiled alias table.
+
+        Labels are looked up once per category and the rows are remapped through the category codes,
+        so the cost depends on the number of distinct labels rather than the number of rows.
+        Labels missing from the table are kept as they are and counted.
+
+        Args:
+        series (pd.Series): labels, converted to category dtype if needed
+        table (dict): lookup table from compile_aliases
+
+        return 
+            pd.Series of category dtype, int number of rows with an unmapped label
+        """
+        series = series.astype('category')
+        categories = series.cat.categories
+        codes = series.cat.codes.to_numpy()
+
+        mapped = [table.get(label_key(label)) for label in categories]
+        unmapped = [label for label, canonical in zip(categories, mapped) if canonical is None]
+        labels = [canonical if canonical is not None else label for label, canonical in zip(categories, mapped)]
+
+        new_categories = pd.Index(sorted(set(labels)))
+        code_map = new_categories.get_indexer(labels)
+        new_codes = np.where(codes >= 0, code_map[codes], -1) if len(categories) else codes
+
+        counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+        unmapped_count = int(sum(counts[categories.get_loc(label)] for label in unmapped))
+        if unmapped:
+            logging.warning(f"{unmapped_count} rows of {series.name} have unmapped labels : {unmapped}")
+
+        normalized = pd.Categorical.from_codes(new_codes, categories=new_categories)
+        return pd.Series(normalized, index=series.index, name=series.name), unmapped_count
+
+    def downcast_float_columns(self, df):
+        """
+        This function downcast float64 columns to float32 when float32_lossless, every value a decimal
+        of at most FLOAT32_DIGITS significant digits. Columns with longer or computed values, or out of
+        the float32 range, stay float64.
+
+        return 
+            pd.DataFrame
+        """
+        for column in df.columns[df.dtypes == np.float64]:
+            values = df[column].to_numpy()
+            if float32_lossless(values):
+                df[column] = values.astype(np.float32)
+        return df
+
+    def coerce_dtypes(self, df, downcast=True):
+        """
+        This function parse date, coerce NUMERIC_COLUMNS with one to_numeric call per column,
+        downcast floats when downcast and downcast_floats are set and make CATEGORY_COLUMNS category dtype.
+
+        return 
+            pd.DataFrame, modified in place
+        """
+        # Convert date to datetime format
+        df['date'] = pd.to_datetime(df['date'], format=self.DATE_FORMAT)
+
+        # Transforming object to numeric
+        for column in self.NUMERIC_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+
+        if downcast and self.transform_config.downcast_floats:
+            df = self.downcast_float_columns(df)
+
+        for column in self.CATEGORY_COLUMNS:
+            df[column] = df[column].astype('category')
+        return df
+
+    @track_stage("transforming_dtype")
+    def transforming_dtype(self, df=None):
         """
         This function transformed dataframe dtype 
 
+        Text columns in NUMERIC_COLUMNS are coerced with one to_numeric call per column, floats are
+        downcast to float32 where precision allows and CATEGORY_COLUMNS become category dtype.
+        The memory usage before and after is logged and kept in memory_report.
+
+        Args:
+        df (pd.DataFrame): merged dataframe, read from merged_data_path when not given
+
         return 
             pd.DataFrame
         """
         logging.info("Transforming data type.....")
         try:
             # Read dataframe
-            df = pd.read_csv(self.transform_config.merged_data_path)
+            if df is None:
+                df = self.read_intermediate(self.transform_config.merged_data_path)
+            else:
+                df = df.copy()
+            stage_rows(rows_in=len(df))
+            memory_before = df.memory_usage(deep=True).sum()
 
-            # Convert date to datetime format
-            df['date'] = pd.to_datetime(df['date'], format='%d/%m/%Y')
-            logging.info("date dtype was transformed")
+            df = self.coerce_dtypes(df)
+            logging.info("date and numeric dtypes were transformed")
 
-            columns = ['Daily Rainfall Total (mm)','Highest 30 Min Rainfall (mm)','Highest 60 Min Rainfall (mm)','Highest 120 Min Rainfall (mm)','Min Temperature (deg C)','Maximum Temperature (deg C)','Min Wind Speed (km/h)',
-           'Max Wind Speed (km/h)','pm25_north','pm25_south','pm25_east','pm25_west','pm25_central','psi_north','psi_south','psi_east','psi_west','psi_central']
-            
-            # Transforming object to numeric
-            for column in columns:
-                df[column] = df[column].apply(pd.to_numeric, errors='coerce')
-
-            df = df.iloc[:,1:]
-            logging.info("Dtype was successfully transformed.")
+            memory_after = df.memory_usage(deep=True).sum()
+            self.memory_report = {"before": int(memory_before), "after": int(memory_after)}
+            logging.info(f"Dtype was successfully transformed, memory {memory_before / 1e6:.2f} MB -> {memory_after / 1e6:.2f} MB")
             return df
         
 
@@ -110,157 +586,500 @@ class DataTransformation:
             logging.error(f"Unable to transform dtype of dataframe : {e}")
             raise CustomException(e, sys)
 
-    def cleaning_formatting_value(self):
+    def numeric_block(self, df):
+        """
+        This function gather LOG_FEATURES into one contiguous (features, rows) float array, the
+        AVERAGE_FEATURES are summed in place from their columns in the listed order.
+        The array is float32 when every source column is float32, float64 otherwise.
+
+        return 
+            np.ndarray
+        """
+        sources = {feature: self.AVERAGE_FEATURES.get(feature, [feature]) for feature in self.LOG_FEATURES}
+        dtype = np.result_type(np.float32, *(df[column].dtype for columns in sources.values() for column in columns))
+        block = np.empty((len(self.LOG_FEATURES), len(df)), dtype=dtype)
+        for row, columns in zip(block, sources.values()):
+            np.copyto(row, df[columns[0]].to_numpy())
+            for column in columns[1:]:
+                np.add(row, df[column].to_numpy(), out=row)
+            if len(columns) > 1:
+                row /= len(columns)
+        return block
+
+    def log_transform(self, block, use_log=None):
+        """
+        This function take the log of the rows of block in place.
+
+        Args:
+        block (np.ndarray): array from numeric_block
+        use_log (np.ndarray): rows to transform, by default the rows whose values are all positive,
+            the log of zero or a negative value is not defined
+
+        return 
+            np.ndarray : bool per row, True where the log was taken
+        """
+        if use_log is None:
+            use_log = np.array([bool((row > 0).all()) for row in block], dtype=bool)
+        for index in np.flatnonzero(use_log):
+            np.log(block[index], out=block[index])
+        return use_log
+
+    def zscore_mask(self, block, mean=None, std=None):
+        """
+        This function flag the rows whose z-score is below ZSCORE_THRESHOLD on every feature.
+
+        |x - mean| / std < threshold is checked as mean - threshold * std < x < mean + threshold * std,
+        two comparisons per value instead of a subtraction, an absolute value and a division.
+
+        Args:
+        block (np.ndarray): array from numeric_block
+        mean (np.ndarray): mean per feature, of block when not given
+        std (np.ndarray): population standard deviation per feature, of block when not given
+
+        return 
+            np.ndarray : bool per row of df, like combining scipy.stats.zscore per feature
+        """
+        if mean is None:
+            mean = block.mean(axis=1, dtype=np.float64)
+            std = block.std(axis=1, dtype=np.float64)
+
+        n_rows = block.shape[1]
+        mask = np.ones(n_rows, dtype=bool)
+        inside = np.empty(n_rows, dtype=bool)
+        # NaN bounds compare as False, a feature with NaN drops every row like zscore
+        for row, low, high in zip(block, mean - self.ZSCORE_THRESHOLD * std, mean + self.ZSCORE_THRESHOLD * std):
+            np.greater(row, low, out=inside)
+            np.logical_and(mask, inside, out=mask)
+            np.less(row, high, out=inside)
+            np.logical_and(mask, inside, out=mask)
+        return mask
+
+    def store_block(self, df, block, mask):
+        """
+        This function drop the DROP_COLUMNS and the rows outside mask, then write the rows of block
+        back as the LOG_FEATURES columns.
+
+        return 
+            pd.DataFrame
+        """
+        df = df.drop(columns=self.DROP_COLUMNS)[mask]
+        for row, feature in zip(block, self.LOG_FEATURES):
+            df[feature] = row[mask]
+        return df
+
+    def fill_missing(self, df):
+        """
+        This function replace the missing values of every column by the median of the column.
+
+        return 
+            pd.DataFrame, modified in place
+        """
+        # Assigning feature with na value 
+        missing_value_features = [feature for feature in df if df[feature].isna().sum() > 0]
+
+        # Replace missing values with median value
+        for feature in missing_value_features:
+          df[feature] = df[feature].fillna(df[feature].median())
+        logging.info("missing values was replaced.")
+        return df
+
+    def filter_outliers(self, df):
+        """
+        This function derive the AVERAGE_FEATURES, take the log of LOG_FEATURES, drop the rows outside
+        ZSCORE_THRESHOLD and the DROP_COLUMNS.
+
+        return 
+            pd.DataFrame
+        """
+        # Averages, log transform and outlier mask in one pass over a contiguous float array
+        block = self.numeric_block(df)
+        use_log = self.log_transform(block)
+        mask = self.zscore_mask(block)
+        logging.info(f"Average feature was created, log taken of {dict(zip(self.LOG_FEATURES, use_log.tolist()))}")
+
+        # Drop similar features to prevent noise and remove outliers
+        return self.store_block(df, block, mask)
+
+    def publish_features(self, df):
+        """
+        This function write the new and changed days of the final data to the feature store, when feature_store.enabled is set.
+        """
+        if self.transform_config.feature_store:
+            from feature_store import FeatureStore
+            with FeatureStore() as store:
+                store.write(df)
+
+    @track_stage("cleaning_formatting_value")
+    def cleaning_formatting_value(self, df=None):
         """
             This function will replace missing values in data and saved the data
 
+            Args:
+            df (pd.DataFrame): merged dataframe, read from merged_data_path when not given
+
+            return 
+                pd.DataFrame without outliers, as saved to final_data_path
         """
         logging.info("Replacing missing values")
         try:
+
             # Read dataframe
-            df = self.transforming_dtype()
+            df = self.transforming_dtype(df)
+            stage_rows(rows_in=len(df))
 
             df = df.drop(columns=['data_ref_y'])
-            # Assigning feature with na value 
-            missing_value_features = [feature for feature in df if df[feature].isna().sum() > 0]
-
-            # Replace missing values with median value
-            for feature in missing_value_features:
-              df[feature] = df[feature].fillna(df[feature].median())
-            logging.info("missing values was replaced.")
-
-            # Mapping dictionary
-            dew_mapping = {
-                'High': 'High',
-                'Very High': 'Very High',
-                'Very Low': 'Very Low',
-                'Moderate': 'Moderate',
-                'Low': 'Low',
-                'High Level': 'High',
-                'H': 'High',
-                'HIGH': 'High',
-                'high': 'High',
-                'very high': 'Very High',
-                'Extreme': 'Extreme',
-                'VERY HIGH': 'Very High',
-                'VH': 'Very High',
-                'M': 'Moderate',
-                'MODERATE': 'Moderate',
-                'LOW': 'Low',
-                'Normal': 'Moderate',  # Assuming 'Normal' is akin to 'Moderate'
-                'Minimal': 'Very Low',  # Assuming 'Minimal' is akin to 'Very Low'
-                'VL': 'Very Low',
-                'very low': 'Very Low',
-                'low': 'Low',
-                'moderate': 'Moderate',
-                'Below Average': 'Low',  # Assuming 'Below Average' is akin to 'Low'
-                'L': 'Low',
-                'VERY LOW': 'Very Low'
-            }
+            df = self.fill_missing(df)
 
-            # Mapping dictionary for wind direction
-            wind_direction_mapping = {
-                'SW': 'Southwest',
-                'SW.': 'Southwest',
-                'southwest': 'Southwest',
-                'SOUTHEAST': 'Southeast',
-                'southeast': 'Southeast',
-                'SE': 'Southeast',
-                'SE.': 'Southeast',
-                'NORTHEAST': 'Northeast',
-                'northeast': 'Northeast',
-                'NE': 'Northeast',
-                'NE.': 'Northeast',
-                'NORTHWEST': 'Northwest',
-                'northwest': 'Northwest',
-                'NW': 'Northwest',
-                'NW.': 'Northwest',
-                'Northward': 'North',
-                'NORTH': 'North',
-                'north': 'North',
-                'N': 'North',
-                'N.': 'North',
-                'Southward': 'South',
-                'SOUTH': 'South',
-                'south': 'South',
-                'S': 'South',
-                'S.': 'South',
-                'WEST': 'West',
-                'west': 'West',
-                'W': 'West',
-                'W.': 'West',
-                'EAST': 'East',
-                'east': 'East',
-                'E': 'East',
-                'E.': 'East'
-            }
+            # Mapping wind direction and dew point data
+            self.unmapped_report = {}
+            for column, table in [('Wind Direction', WIND_DIRECTION_TABLE), ('Dew Point Category', DEW_POINT_TABLE)]:
+                df[column], self.unmapped_report[column] = self.normalize_categories(df[column], table)
+            logging.info("Data in wind direction and dew point catergory was formatted.")
 
-            # Mapping wind directioin
-            df['Wind Direction'] = df['Wind Direction'].replace(wind_direction_mapping)
+            df_filtered = self.filter_outliers(df)
 
-            # Mapping dew point data
-            df['Dew Point Category'] = df['Dew Point Category'].replace(dew_mapping)
-            logging.info("Data in wind direction and dew point catergory was formatted.")
+            self.write_intermediate(df_filtered, self.transform_config.final_data_path)
+            self.publish_features(df_filtered)
 
-            # Average wind speed 
-            df['average_wind_speed'] = (df['Min Wind Speed (km/h)'] + df['Max Wind Speed (km/h)']) /2
+            logging.info("Cleaning and formatting completed.")
+            return df_filtered
 
-            # Average temperature
-            df['average_temperature'] = (df['Min Temperature (deg C)']+ df['Maximum Temperature (deg C)']) /2
+        except Exception as e:
+            logging.error(f"Unable to clean missing value : {e}")
+            raise CustomException(e, sys)
 
-            # Average psi
-            df['psi_average'] = (df['psi_north'] + df['psi_central'] + df['psi_east'] + df['psi_south'] + df['psi_west']) /5
+    def partition_keys(self, weather_df, air_df, n_partitions):
+        """
+        This function assign every weather and air_quality row to one of n_partitions ranges of months,
+        balanced on row count.
 
-            # Average pm25
-            df['pm25_average'] = (df['pm25_central'] + df['pm25_north'] + df['pm25_south'] + df['pm25_east'] + df['pm25_west']) / 5
+        Rows that dedup_merge_frames compares or joins always land in the same partition : rows of
+        the same date, and air_quality rows sharing a data_ref, which follow the first of them with a date.
 
-            logging.info("Average feature was created for psi, pm25, wind speed and temperature")
+        return
+            np.ndarray, np.ndarray : partition of every weather row and every air_quality row
+        """
+        def month(dates):
+            # yyyymm straight from the dd/mm/yyyy text, placeholders and missing dates share the key ''
+            return (dates.str.slice(6) + dates.str.slice(3, 5)).fillna('')
 
-            # Assign columns to drop
-            columns_to_drop = ['pm25_north','pm25_south','pm25_east','pm25_west','pm25_central','psi_central',
-                            'psi_north','psi_south','psi_east','psi_west',
-                            'Highest 30 Min Rainfall (mm)', 'Highest 60 Min Rainfall (mm)','Highest 120 Min Rainfall (mm)',
-                            'Min Wind Speed (km/h)', 'Max Wind Speed (km/h)',
-                            'Min Temperature (deg C)', 'Maximum Temperature (deg C)']
-            
-            logging.info("Similar feature is dropped to prevent noise")
+        weather_month = month(weather_df['date'])
+        air_month = month(air_df['date'])
+        shared = air_df['data_ref'].duplicated(keep=False).to_numpy()
+        first_month = air_month[shared].replace('', np.nan).groupby(air_df['data_ref'][shared]).transform('first')
+        air_month[shared] = first_month.fillna(air_month[shared])
 
-            # normalize the data
-            num_feature = ['Air Pressure (hPa)','Wet Bulb Temperature (deg F)','average_wind_speed','Daily Rainfall Total (mm)',
-                              'Sunshine Duration (hrs)','Cloud Cover (%)','Relative Humidity (%)','average_temperature','psi_average','pm25_average']
+        counts = pd.concat([weather_month, air_month]).value_counts().sort_index()
+        first_row = counts.cumsum() - counts
+        month_partition = (first_row * n_partitions // max(len(weather_month) + len(air_month), 1)).astype(int)
+        return weather_month.map(month_partition).to_numpy(), air_month.map(month_partition).to_numpy()
 
-            for feature in num_feature:
-                if 0 in df[feature]:
-                    pass
-                else:
-                    df[feature] = np.log(df[feature])
+    def transform_partition(self, weather_df, air_df):
+        """
+        This function run the row by row steps of the transformation on one partition : dedup and merge,
+        dtype coercion without downcast and category normalization. Called in the worker processes
+        of transform_partitioned.
 
-            # Drop Columns
-            df = df.drop(columns=columns_to_drop)
+        return
+            pd.DataFrame with the index of the weather row in _position, dict number of rows with an unmapped label per column
+        """
+        df = self.dedup_merge_frames(weather_df, air_df, position_column='_position')
+        df = self.coerce_dtypes(df, downcast=False).drop(columns=['data_ref_y'])
+        unmapped = {}
+        for column, table in [('Wind Direction', WIND_DIRECTION_TABLE), ('Dew Point Category', DEW_POINT_TABLE)]:
+            df[column], unmapped[column] = self.normalize_categories(df[column], table)
+        return df, unmapped
 
-            # Removing Outliers
-            mask = np.ones(len(df), dtype=bool)
+    def read_raw_frame(self, table, path):
+        """
+        This function read the raw rows of table, from the date-partitioned store with incremental set, from path otherwise.
+        """
+        if not self.transform_config.incremental:
+            return self.read_intermediate(path)
+        parts = list_partition_files(self.transform_config.raw_partition_path, table, self.transform_config.intermediate_format)
+        return self.read_partition([path for files in parts.values() for path in files])
 
-            for feature in num_feature:
-                z_scores = np.abs(stats.zscore(df[feature]))
-                feature_mask = z_scores < 3
-                mask &= feature_mask
+    @track_stage("transform_partitioned")
+    def transform_partitioned(self, weather_df=None, air_df=None, max_workers=None):
+        """
+        This function is the multi-core version of dedup_merge_frames followed by cleaning_formatting_value,
+        with the same output.
 
-            df_filtered = df[mask]
+        Rows are split into ranges of months by partition_keys, partitions_per_worker per worker,
+        and transform_partition runs on each of them in a process pool. The reduce step concatenates
+        the partitions back in the order of the single process merge, settles the dtypes and the
+        categories over the whole columns, then takes the medians, the log guard and the z-score
+        mean / std on the whole frame, so they are exactly the single process statistics. Those
+        steps are vectorized passes over numeric arrays, the text parsing, dedup and label mapping
+        happen in the workers.
 
-            df_filtered.to_csv(self.transform_config.final_data_path)
+        Args:
+        weather_df (pd.DataFrame): weather rows, read from the raw store when not given
+        air_df (pd.DataFrame): air_quality rows, read from the raw store when not given
+        max_workers (int): processes, data_transformation.max_workers or every core when not given
 
-            logging.info("Cleaning and formatting completed.")
-            return df 
+        return
+            pd.DataFrame without outliers, as saved to final_data_path
+        """
+        global _shared_frames
+        logging.info("Transforming data in partitions.....")
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+
+            config = self.transform_config
+            if weather_df is None:
+                weather_df = self.read_raw_frame("weather", config.raw_weather_data_path)
+            if air_df is None:
+                air_df = self.read_raw_frame("air_quality", config.raw_air_quality_data_path)
+            stage_rows(rows_in=len(weather_df) + len(air_df))
+
+            workers = max_workers or config.max_workers or os.cpu_count() or 1
+            weather_df = weather_df.reset_index(drop=True)
+            air_df = air_df.reset_index(drop=True)
+            weather_keys, air_keys = self.partition_keys(weather_df, air_df, workers * config.partitions_per_worker)
+            air_rows = partition_rows(air_keys)
+            # A partition without rows on one side has nothing to join
+            parts = [(rows, air_rows[key]) for key, rows in partition_rows(weather_keys).items() if key in air_rows]
+            if not parts:
+                return self.cleaning_formatting_value(self.dedup_merge_frames(weather_df, air_df))
+
+            workers = min(workers, len(parts))
+            if "fork" in multiprocessing.get_all_start_methods():
+                # Forked workers read their rows from the parent's frames, only row numbers are pickled
+                _shared_frames = (weather_df, air_df)
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+                    results = list(executor.map(_transform_shared_partition, [self] * len(parts), *zip(*parts)))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(self.transform_partition, *zip(*[
+                        (weather_df.take(weather_rows), air_df.take(air_rows)) for weather_rows, air_rows in parts])))
+            logging.info(f"{len(parts)} partitions transformed by {workers} processes")
+
+            # Reduce : rows back in the order of the single process merge
+            df = pd.concat([part for part, _ in results], ignore_index=True)
+            order = np.argsort(df['_position'].to_numpy(), kind='stable')
+            df = df.take(order).reset_index(drop=True).drop(columns=['_position'])
+
+            # Dtypes and categories of the whole columns, as coerce_dtypes and normalize_categories give
+            if config.downcast_floats:
+                df = self.downcast_float_columns(df)
+            for column in self.CATEGORY_COLUMNS:
+                # Partitions with different labels concatenate to object
+                df[column] = df[column].astype('category')
+            self.unmapped_report = {column: sum(unmapped[column] for _, unmapped in results)
+                                    for column in self.CATEGORY_COLUMNS}
+
+            df = self.fill_missing(df)
+            df_filtered = self.filter_outliers(df)
+
+            self.write_intermediate(df_filtered, config.final_data_path)
+            self.publish_features(df_filtered)
+            stage_rows(rows_out=len(df_filtered))
+            logging.info("Partitioned transformation completed.")
+            return df_filtered
 
         except Exception as e:
-            logging.error(f"Unable to clean missing value : {e}")
+            logging.error(f"Unable to transform data in partitions : {e}")
+            raise CustomException(e, sys)
+
+        finally:
+            _shared_frames = None
+
+    def stream_plan(self, chunk_rows, spool_path):
+        """
+        This function make the first pass of cleaning_formatting_stream over merged_data.
+
+        It settles what the in-memory path derives from the whole frame : the dtype of every numeric
+        column, the median of the columns with missing values and the categories after normalization.
+        Parsed chunks are spooled to a parquet file so the next passes skip the text parsing.
+
+        return 
+            dict
+        """
+        from online_stats import QuantileSketch
+
+        capacity = self.transform_config.sketch_capacity
+        is_float, lossless, has_na, sketches = {}, {}, set(), {}
+        labels = {column: set() for column in self.CATEGORY_COLUMNS}
+        n_rows = 0
+
+        with FrameWriter(spool_path, "parquet") as spool:
+            for chunk in iter_frame(self.transform_config.merged_data_path, self.transform_config.intermediate_format, chunk_rows):
+                chunk = self.coerce_dtypes(chunk, downcast=False)
+                n_rows += len(chunk)
+                for column in chunk.columns:
+                    if column in labels:
+                        labels[column].update(chunk[column].cat.categories)
+                        chunk[column] = chunk[column].astype(object)
+                        continue
+                    if not pd.api.types.is_numeric_dtype(chunk[column]) or pd.api.types.is_bool_dtype(chunk[column]):
+                        continue
+                    values = chunk[column].to_numpy(dtype=np.float64, na_value=np.nan)
+                    is_float[column] = is_float.get(column, False) or pd.api.types.is_float_dtype(chunk[column])
+                    lossless[column] = lossless.get(column, True) and float32_lossless(values)
+                    if np.isnan(values).any():
+                        has_na.add(column)
+                    sketches.setdefault(column, QuantileSketch(capacity)).update(values)
+                    # Chunks can differ in int / float, the spool keeps one dtype
+                    chunk[column] = values
+                spool.write(chunk)
+
+        # Same dtypes as a whole column coerced and downcast at once
+        dtypes = {}
+        for column, float_column in is_float.items():
+            if not float_column:
+                dtypes[column] = np.int64
+            elif self.transform_config.downcast_floats and lossless[column]:
+                dtypes[column] = np.float32
+            else:
+                dtypes[column] = np.float64
+
+        tables = {'Wind Direction': WIND_DIRECTION_TABLE, 'Dew Point Category': DEW_POINT_TABLE}
+        categories = {column: sorted({tables[column].get(label_key(label), label) for label in found})
+                      for column, found in labels.items()}
+
+        medians = {column: sketches[column].median() for column in sorted(has_na) if column != 'data_ref_y'}
+        return {
+            "rows": n_rows,
+            "dtypes": dtypes,
+            "medians": medians,
+            "median_exact": {column: sketches[column].exact for column in medians},
+            "categories": categories,
+        }
+
+    def prepare_chunk(self, chunk, plan):
+        """
+        This function apply the steps of cleaning_formatting_value before the log transform to one
+        spooled chunk, with the dtypes, medians and categories of the plan.
+
+        return 
+            pd.DataFrame, dict number of rows with an unmapped label per column
+        """
+        for column, dtype in plan["dtypes"].items():
+            chunk[column] = chunk[column].astype(dtype)
+        chunk = chunk.drop(columns=['data_ref_y'])
+
+        for column, median in plan["medians"].items():
+            chunk[column] = chunk[column].fillna(median)
+
+        unmapped = {}
+        for column, table in [('Wind Direction', WIND_DIRECTION_TABLE), ('Dew Point Category', DEW_POINT_TABLE)]:
+            normalized, unmapped[column] = self.normalize_categories(chunk[column], table)
+            chunk[column] = normalized.cat.set_categories(plan["categories"][column])
+
+        return chunk, unmapped
+
+    @track_stage("cleaning_formatting_stream")
+    def cleaning_formatting_stream(self, chunk_rows=None):
+        """
+        This function is the out-of-core version of cleaning_formatting_value, merged_data is read
+        in chunks of chunk_rows rows and final_data is written chunk by chunk, so memory is bounded
+        by the chunk size whatever the length of the history.
+
+        It makes three passes :
+            1. over merged_data, parse every chunk into a spool file and collect dtypes, categories
+               and a QuantileSketch per column for the median imputation
+            2. over the spool, RunningMoments of the log features for the z-score filter
+            3. over the spool, fill, transform and filter every chunk and append it to final_data
+
+        Tolerance against cleaning_formatting_value :
+            - a median is exact while its column has at most sketch_capacity values, beyond that
+              its rank is within log2(n / sketch_capacity) / sketch_capacity of the middle
+            - means and standard deviations are accumulated in float64 and match to about 1e-12
+              relative, so only rows whose z-score is within that of the threshold can flip
+            - with exact medians the rows kept and their values are the same
+
+        Args:
+        chunk_rows (int): rows per chunk, data_transformation.chunk_rows when not given
+
+        return 
+            dict : rows in and out, medians and z-score statistics, also kept in stream_report
+        """
+        logging.info("Cleaning merged data in chunks.....")
+        spool_dir = None
+        try:
+            from online_stats import RunningMoments
+
+            chunk_rows = chunk_rows or self.transform_config.chunk_rows
+            fmt = self.transform_config.intermediate_format
+            features = self.LOG_FEATURES
+            final_dir = os.path.dirname(self.transform_config.final_data_path) or "."
+            os.makedirs(final_dir, exist_ok=True)
+            spool_dir = tempfile.mkdtemp(prefix="spool-", dir=final_dir)
+            spool_path = os.path.join(spool_dir, "merged.parquet")
+
+            # Pass 1 : parse, dtypes, medians and categories
+            plan = self.stream_plan(chunk_rows, spool_path)
+            logging.info(f"Medians of {len(plan['medians'])} columns with missing values from {plan['rows']} rows")
+
+            # Pass 2 : z-score statistics, of the raw and of the log values until the log guard is settled
+            raw_moments, log_moments = RunningMoments(len(features)), RunningMoments(len(features))
+            positive = np.ones(len(features), dtype=bool)
+            unmapped = dict.fromkeys(self.CATEGORY_COLUMNS, 0)
+            for chunk in iter_frame(spool_path, "parquet", chunk_rows):
+                chunk, chunk_unmapped = self.prepare_chunk(chunk, plan)
+                for column, count in chunk_unmapped.items():
+                    unmapped[column] += count
+
+                block = self.numeric_block(chunk)
+                positive &= [bool((row > 0).all()) for row in block]
+                raw_moments.update(block.T)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    log_moments.update(np.log(block).T)
+
+            # Same guard as log_transform, on every row of every chunk
+            use_log = positive
+            mean = np.where(use_log, log_moments.mean, raw_moments.mean)
+            std = np.where(use_log, log_moments.std, raw_moments.std)
+            has_nan = np.where(use_log, log_moments.has_nan, raw_moments.has_nan)
+
+            # Pass 3 : transform, filter and write
+            rows_out = 0
+            with FrameWriter(self.transform_config.final_data_path, fmt, self.transform_config.export_csv) as writer:
+                for chunk in iter_frame(spool_path, "parquet", chunk_rows):
+                    chunk, _ = self.prepare_chunk(chunk, plan)
+                    block = self.numeric_block(chunk)
+                    self.log_transform(block, use_log)
+                    mask = self.zscore_mask(block, mean, std)
+                    # A feature holding NaN makes scipy.stats.zscore NaN everywhere, which drops every row
+                    if has_nan.any():
+                        mask[:] = False
+                    writer.write(self.store_block(chunk, block, mask))
+                    rows_out += int(mask.sum())
+
+            self.unmapped_report = unmapped
+            self.stream_report = {
+                "rows_in": plan["rows"],
+                "rows_out": rows_out,
+                "chunk_rows": chunk_rows,
+                "medians": plan["medians"],
+                "median_exact": plan["median_exact"],
+                "log": dict(zip(features, use_log.tolist())),
+                "mean": dict(zip(features, mean.tolist())),
+                "std": dict(zip(features, std.tolist())),
+            }
+            logging.info(f"Cleaning and formatting completed, {rows_out} of {plan['rows']} rows kept.")
+            stage_rows(rows_in=plan["rows"], rows_out=rows_out)
+            return self.stream_report
+
+        except Exception as e:
+            logging.error(f"Unable to clean merged data in chunks : {e}")
             raise CustomException(e, sys)
 
+        finally:
+            if spool_dir:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+
 
 if __name__ == "__main__" :
     # Create data transformation object
     obj = DataTransformation()
-    obj.drop_duplicates_merge()
-    obj.transforming_dtype()
-    obj.cleaning_formatting_value()
+    if obj.transform_config.partitioned:
+        obj.transform_partitioned()
+    else:
+        obj.drop_duplicates_merge()
+        if obj.transform_config.streaming:
+            obj.cleaning_formatting_stream()
+        else:
+            obj.transforming_dtype()
+            obj.cleaning_formatting_value()
@@ -0,0 +1,144 @@
+import os
+import json
+import numpy as np
+
+# Bumped whenever the layout of the exported file changes
+DENSE_FORMAT_VERSION = 1
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+def _softmax(x):
+    # Shifted by the row max so exp cannot overflow, as Keras does
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+def _sigmoid(x):
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    return np.reciprocal(x, out=x)
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": _relu,
+    "softmax": _softmax,
+    "sigmoid": _sigmoid,
+    "tanh": lambda x: np.tanh(x, out=x),
+}
+
+
+def export_dense(model, path, classes=None):
+    """
+    Write the weights of a Keras model made of Dense layers to a .npz file readable without TensorFlow.
+
+    Args:
+    model (tf.keras.Model): trained model, every layer must be Dense
+    path (str): file to write
+    classes (array like): labels of the output units, in order
+
+    Returns:
+    DenseNetwork : the exported network
+
+    Example:
+    >>> export_dense(model, "models/dense_network.npz", encoder.classes_)
+    """
+    kernels, biases, activations = [], [], []
+    for layer in model.layers:
+        config = layer.get_config()
+        if type(layer).__name__ != "Dense":
+            raise ValueError(f"Layer {config['name']} is a {type(layer).__name__}, only Dense layers can be exported")
+
+        weights = layer.get_weights()
+        kernels.append(weights[0])
+        biases.append(weights[1] if config["use_bias"] else np.zeros(weights[0].shape[1]))
+        activations.append(config["activation"])
+
+    network = DenseNetwork(kernels, biases, activations, classes)
+    network.save(path)
+    return network
+
+
+class DenseNetwork:
+    """
+    Forward pass of an exported stack of Dense layers in NumPy, float32 like Keras.
+
+    Rows are processed in batches of batch_size so the activations of a large input stay small.
+    predict / predict_proba / classes_ follow sklearn, so a network can be the model of a ModelBundle.
+    """
+    def __init__(self, kernels, biases, activations, classes=None, batch_size=4096):
+        self.kernels = [np.ascontiguousarray(kernel, dtype=np.float32) for kernel in kernels]
+        self.biases = [np.asarray(bias, dtype=np.float32) for bias in biases]
+        for name in activations:
+            if name not in ACTIVATIONS:
+                raise ValueError(f"Activation {name} is not supported, expected one of {list(ACTIVATIONS)}")
+        # Names rather than functions so the network can be pickled
+        self.activations = list(activations)
+        self.classes_ = np.arange(len(self.biases[-1])) if classes is None else np.asarray(classes)
+        self.batch_size = batch_size
+
+    def save(self, path):
+        """
+        Write the network to a .npz file, float32 weights and a json spec of the layers.
+        """
+        spec = {"format_version": DENSE_FORMAT_VERSION, "layers": [
+            {"units": len(bias), "activation": activation} for bias, activation in zip(self.biases, self.activations)]}
+        arrays = {f"kernel_{i}": kernel for i, kernel in enumerate(self.kernels)}
+        arrays.update({f"bias_{i}": bias for i, bias in enumerate(self.biases)})
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, spec=np.array(json.dumps(spec)), classes=self.classes_, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Read a network written by export_dense.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            spec = json.loads(str(data["spec"]))
+            if spec["format_version"] != DENSE_FORMAT_VERSION:
+                raise ValueError(f"Dense format {spec['format_version']} is not supported, expected {DENSE_FORMAT_VERSION}")
+            n_layers = len(spec["layers"])
+            return cls([data[f"kernel_{i}"] for i in range(n_layers)],
+                       [data[f"bias_{i}"] for i in range(n_layers)],
+                       [layer["activation"] for layer in spec["layers"]],
+                       data["classes"], **kwargs)
+
+    def forward(self, X):
+        x = X
+        for kernel, bias, activation in zip(self.kernels, self.biases, self.activations):
+            # matmul allocates a new array, bias and activation then work in place on it
+            x = x @ kernel
+            x += bias
+            x = ACTIVATIONS[activation](x)
+        return x
+
+    def predict_proba(self, X):
+        """
+        This function return the output of the last layer for every row.
+
+        Args:
+        X (np.ndarray): scaled features, (rows, features)
+
+        return
+            np.ndarray : (rows, units of the last layer), float32
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if len(X) <= self.batch_size:
+            return self.forward(X)
+        out = np.empty((len(X), self.kernels[-1].shape[1]), dtype=np.float32)
+        for start in range(0, len(X), self.batch_size):
+            out[start:start + self.batch_size] = self.forward(X[start:start + self.batch_size])
+        return out
+
+    def predict(self, X):
+        """
+        This function return the class of every row, the index of the output unit when no classes were exported.
+        """
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
@@ -1,19 +1,27 @@
 import os
 import sys
 import json
+import time
 from logger import logging
 from customexcept import CustomException
-import tensorflow as tf
 from dataclasses import dataclass
-from utils import load_config
-from sklearn.preprocessing import LabelEncoder
-from data_preprocessing import DataPreprocessing
-import matplotlib.pyplot as plt
+from utils import config_field
 
 @dataclass
 class DeepLearningModelConfig:
-    config = load_config("deep_learning_model")
-    model_path:str = os.path.join(config['models_path'])
+    model_path:str = config_field("deep_learning_model", "models_path")
+    epochs: int = config_field("deep_learning_model", "epochs")
+    batch_size: int = config_field("deep_learning_model", "batch_size")
+    learning_rate: float = config_field("deep_learning_model", "learning_rate")
+    validation_split: float = config_field("deep_learning_model", "validation_split")
+    patience: int = config_field("deep_learning_model", "patience")
+    shuffle_buffer: int = config_field("deep_learning_model", "shuffle_buffer")
+    intra_op_threads: int = config_field("deep_learning_model", "intra_op_threads")
+    inter_op_threads: int = config_field("deep_learning_model", "inter_op_threads")
+    random_state: int = config_field("deep_learning_model", "random_state")
+    history_path: str = config_field("deep_learning_model", "history_path")
+    export_path: str = config_field("deep_learning_model", "export_path")
+    bundle_name: str = config_field("deep_learning_model", "bundle_name")
 
 
 class DeepLearningModel:
@@ -21,6 +29,8 @@ class DeepLearningModel:
         self.dl_config = DeepLearningModelConfig()
 
     def model_architect(self, X_train):
+        import tensorflow as tf
+
         nn_model = tf.keras.Sequential([
         tf.keras.layers.Dense(32, activation='relu', input_shape=(len(X_train[0]),)),
         tf.keras.layers.Dense(32,activation='relu'),
@@ -29,38 +39,186 @@ class DeepLearningModel:
 
         return nn_model
 
+    def configure_threads(self):
+        """
+        This function set the CPU threads of TensorFlow, 0 keeps the TensorFlow default.
+        It has to run before the first op, TensorFlow cannot change them afterwards.
+        """
+        import tensorflow as tf
+
+        config = self.dl_config
+        if config.intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(config.intra_op_threads)
+        if config.inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(config.inter_op_threads)
+        tf.keras.utils.set_random_seed(config.random_state)
+
+    def make_dataset(self, X, y, training=False):
+        """
+        This function build the tf.data input of fit / evaluate.
+
+        The float32 tensors are cached in memory after the first epoch. Training batches are
+        reshuffled every epoch, and batches are prefetched while the previous one trains.
+
+        Args:
+        X (np.ndarray): scaled features
+        y (np.ndarray): one hot labels
+        training (bool): shuffle the rows every epoch
+
+        return
+            tf.data.Dataset
+        """
+        import numpy as np
+        import tensorflow as tf
+
+        config = self.dl_config
+        dataset = tf.data.Dataset.from_tensor_slices((np.asarray(X, dtype=np.float32), np.asarray(y, dtype=np.float32)))
+        dataset = dataset.cache()
+        if training:
+            dataset = dataset.shuffle(min(config.shuffle_buffer, len(X)), seed=config.random_state,
+                                      reshuffle_each_iteration=True)
+        return dataset.batch(config.batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def save_history(self, history, epoch_times, summary):
+        """
+        This function write the training curves of a run to history_path/<run>, so runs can be compared
+        : history.csv (metrics and seconds per epoch), loss.png and summary.json.
+
+        return
+            str : directory of the run
+        """
+        import pandas as pd
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        run_dir = os.path.join(self.dl_config.history_path, time.strftime('%Y%m%d_%H%M%S'))
+        os.makedirs(run_dir, exist_ok=True)
+
+        # Metrics of every epoch
+        curves = pd.DataFrame(history.history)
+        curves.insert(0, 'epoch', range(1, len(curves) + 1))
+        curves['seconds'] = epoch_times[:len(curves)]
+        curves.to_csv(os.path.join(run_dir, 'history.csv'), index=False)
+
+        fig, ax = plt.subplots()
+        ax.plot(curves['epoch'], curves['loss'], label='Training Loss')
+        ax.plot(curves['epoch'], curves['val_loss'], label='Validation Loss')
+        ax.set_title('Training and Validation Loss')
+        ax.set_xlabel('Epochs')
+        ax.set_ylabel('Loss')
+        ax.legend()
+        fig.savefig(os.path.join(run_dir, 'loss.png'))
+        plt.close(fig)
+
+        with open(os.path.join(run_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=4)
+        return run_dir
+
+    def export_model(self, model, dataprocessing, encoder):
+        """
+        This function write the trained weights to export_path with dense_runtime.export_dense, and a
+        model bundle named bundle_name holding the NumPy network with the preprocessing pipeline,
+        so the prediction service can serve it without TensorFlow.
+
+        return
+            DenseNetwork
+        """
+        from dense_runtime import export_dense
+        from model_bundle import ModelBundle, save_bundle
+
+        config = self.dl_config
+        network = export_dense(model, config.export_path, encoder.classes_)
+        metadata = {"model_name": "Dense Network", "data_sha256": dataprocessing.data_hash}
+        save_bundle(ModelBundle(network, dataprocessing.pipeline, encoder, dataprocessing.schema, metadata), config.bundle_name)
+        logging.info(f"Dense network exported to {config.export_path}")
+        return network
+
     def train_model(self):
+        """
+        This function train the neural network on a tf.data pipeline.
+
+        The validation set is split from the training set, the test set is only used for the final
+        evaluation. Training stops when the validation loss has not improved for patience epochs and
+        keeps the weights of the best epoch. Curves and epoch timings are written by save_history.
+
+        return
+            history
+        """
         try:
-            # Scaling and splitting data
+            import tensorflow as tf
+            from sklearn.model_selection import train_test_split
+            from sklearn.preprocessing import LabelEncoder
+            from data_preprocessing import DataPreprocessing
+
+            config = self.dl_config
+            self.configure_threads()
+
+            # Scaling and splitting data, resampled once the validation rows are out
             dataprocessing = DataPreprocessing()
-            X_train, X_test, y_train, y_test = dataprocessing.scale_data()
-           
+            X_train, X_test, y_train, y_test = dataprocessing.scale_data(resample=False)
+
+            # Validation rows come out of the training set before oversampling, so none of them is synthetic
+            X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=config.validation_split,
+                                                              stratify=y_train, random_state=config.random_state)
+            X_train, y_train = dataprocessing.imbalance.resample(X_train, y_train)
+
             encoder = LabelEncoder()
             y_train = encoder.fit_transform(y_train)
+            y_val = encoder.transform(y_val)
             y_test = encoder.transform(y_test)
+
+            # Weights classes when the imbalance strategy does not resample
+            class_weight = dataprocessing.imbalance.class_weight(y_train)
+
             y_train = tf.keras.utils.to_categorical(y_train)
+            y_val = tf.keras.utils.to_categorical(y_val)
             y_test = tf.keras.utils.to_categorical(y_test)
 
+            train_data = self.make_dataset(X_train, y_train, training=True)
+            val_data = self.make_dataset(X_val, y_val)
+            test_data = self.make_dataset(X_test, y_test)
+
             model = self.model_architect(X_train)
-            model.compile(optimizer=tf.keras.optimizers.Adam(0.001),loss='categorical_crossentropy', metrics=['accuracy'])
+            model.compile(optimizer=tf.keras.optimizers.Adam(config.learning_rate),loss='categorical_crossentropy', metrics=['accuracy'])
+
+            # Seconds of every epoch
+            epoch_times, epoch_start = [], []
+            timer = tf.keras.callbacks.LambdaCallback(
+                on_epoch_begin=lambda epoch, logs: epoch_start.append(time.perf_counter()),
+                on_epoch_end=lambda epoch, logs: epoch_times.append(time.perf_counter() - epoch_start[-1]))
+            early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=config.patience,
+                                                              restore_best_weights=True)
 
-            history = model.fit(X_train,y_train,validation_data=(X_test,y_test), epochs=100, batch_size = 32, validation_split=0.2)
+            start = time.perf_counter()
+            history = model.fit(train_data, validation_data=val_data, epochs=config.epochs,
+                                class_weight=class_weight, callbacks=[early_stopping, timer], verbose=2)
+            train_time = time.perf_counter() - start
 
             # Evaluate the model
-            test_loss, test_acc = model.evaluate(X_test, y_test)
+            test_loss, test_acc = model.evaluate(test_data, verbose=0)
             print(f'Test accuracy: {test_acc} , Test loss : {test_loss}')
 
-            # Plot the training and validation loss
-            plt.plot(history.history['loss'], label='Training Loss')
-            plt.plot(history.history['val_loss'], label='Validation Loss')
-            plt.title('Training and Validation Loss')
-            plt.xlabel('Epochs')
-            plt.ylabel('Loss')
-            plt.legend()
-            plt.show()
+            val_loss = history.history['val_loss']
+            summary = {
+                "epochs_run": len(val_loss),
+                "best_epoch": int(min(range(len(val_loss)), key=val_loss.__getitem__)) + 1,
+                "best_val_loss": float(min(val_loss)),
+                "test_loss": float(test_loss),
+                "test_accuracy": float(test_acc),
+                "train_time_s": train_time,
+                "mean_epoch_s": sum(epoch_times) / len(epoch_times),
+                "intra_op_threads": tf.config.threading.get_intra_op_parallelism_threads(),
+                "inter_op_threads": tf.config.threading.get_inter_op_parallelism_threads(),
+                "batch_size": config.batch_size,
+                "rows": {"train": len(X_train), "validation": len(X_val), "test": len(X_test)},
+            }
+            run_dir = self.save_history(history, epoch_times, summary)
+            self.export_model(model, dataprocessing, encoder)
+            logging.info(f"Trained for {summary['epochs_run']} epochs in {train_time:.1f}s, curves in {run_dir}")
 
             return history
-        
+
         except Exception as e :
             logging.error(f"Fail to train model : {e}")
             raise CustomException(e, sys)
@@ -69,4 +227,4 @@ class DeepLearningModel:
 
 if __name__ == "__main__":
     obj = DeepLearningModel()
-    history = obj.train_model()
\ No newline at end of file
+    history = obj.train_model()
@@ -0,0 +1,283 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from customexcept import CustomException
+from utils import config_field
+
+import numpy as np
+import pandas as pd
+
+DATE_COLUMN = 'date'
+SITE_COLUMN = 'site'
+# Dates are stored as ISO text, which sorts in date order
+DATE_FORMAT = '%Y-%m-%d'
+# Odd multipliers of the row hashes, so the digest of a day changes when its rows are reordered
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+@dataclass
+class FeatureStoreConfig:
+    enabled: bool = config_field('feature_store', 'enabled')
+    db_path: str = config_field('feature_store', 'db_path')
+    site: str = config_field('feature_store', 'site')
+    training_start: str = config_field('feature_store', 'training_start')
+    training_end: str = config_field('feature_store', 'training_end')
+    as_of: str = config_field('feature_store', 'as_of')
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+def as_timestamp(value):
+    """
+    Seconds since the epoch of a time, date string or number, naive times are UTC. None and '' give now.
+    """
+    if value is None or value == '':
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return pd.Timestamp(value).timestamp()
+
+def as_day(value):
+    """
+    ISO text of a day, as stored in the date key.
+    """
+    return pd.Timestamp(value).strftime(DATE_FORMAT)
+
+
+class FeatureStore:
+    """
+    Versioned store of the rows of cleaning_formatting_value, keyed by site and date, in one indexed
+    SQLite database.
+
+    Every write of a day adds a version holding all the rows of that day and the time it was written.
+    Days whose rows did not change since their last version are skipped, so writing the whole history
+    again only stores the new and changed days. Reads are point in time : for each day they return the
+    last version written at or before as_of, the features a model would have seen at that time.
+
+    Example:
+    >>> with FeatureStore() as store:
+    ...     store.write(final_df)
+    ...     train_df = store.read("2021-01-01", "2022-12-31", as_of="2023-01-01")
+    ...     day_df = store.get_day("2023-01-02")
+    """
+    def __init__(self, db_path=None):
+        self.store_config = FeatureStoreConfig()
+        self.db_path = db_path or self.store_config.db_path
+        self.conn = None
+        self.columns = None
+        # The connection is shared by the threads of the prediction service
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # Readers are not blocked while a write is in progress
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS feature_columns (position INTEGER PRIMARY KEY, name TEXT, dtype TEXT);
+                CREATE TABLE IF NOT EXISTS feature_versions (
+                    site TEXT, date TEXT, version INTEGER, written_at REAL, n_rows INTEGER, digest INTEGER,
+                    PRIMARY KEY (site, date, version)) WITHOUT ROWID;
+            """)
+            self.columns = dict(self.conn.execute("SELECT name, dtype FROM feature_columns ORDER BY position").fetchall())
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def create_features_table(self, df):
+        """
+        This function create the features table with one column per feature of df, the dtypes are kept
+        in feature_columns to be restored on read.
+        """
+        columns = {column: str(dtype) for column, dtype in df.dtypes.items() if column not in (DATE_COLUMN, SITE_COLUMN)}
+        definitions = ", ".join(f"{quote(column)} {'REAL' if pd.api.types.is_numeric_dtype(dtype) else 'TEXT'}"
+                                for column, dtype in df.dtypes.items() if column in columns)
+        self.conn.execute(f"CREATE TABLE features (site TEXT, date TEXT, version INTEGER, row INTEGER, {definitions}, "
+                          f"PRIMARY KEY (site, date, version, row)) WITHOUT ROWID")
+        self.conn.executemany("INSERT INTO feature_columns VALUES (?, ?, ?)",
+                              [(position, column, dtype) for position, (column, dtype) in enumerate(columns.items())])
+        self.columns = columns
+
+    @staticmethod
+    def day_digests(values, starts):
+        """
+        This function hash the rows of every day, rows sorted by day and starts the first row of each day.
+
+        return
+            np.ndarray : int64 digest per day
+        """
+        row_hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        position = np.arange(len(values), dtype=np.uint64) - np.repeat(starts, np.diff(np.r_[starts, len(values)])).astype(np.uint64)
+        mixed = row_hashes * (HASH_MULTIPLIER + np.uint64(2) * position)
+        return np.add.reduceat(mixed, starts).view(np.int64) if len(values) else np.array([], dtype=np.int64)
+
+    def write(self, df, site=None, written_at=None):
+        """
+        This function store a new version of every day of df whose rows changed since its last version.
+
+        Days missing from df are left as they are, so df can hold only the new days. Rows without a date are not stored.
+
+        Args:
+        df (pd.DataFrame): rows of cleaning_formatting_value, with a date column and a site column when there are several sites
+        site (str): site of the rows when df has no site column, feature_store.site when not given
+        written_at (float): time of the version, now when not given
+
+        return
+            dict : days and rows written, days unchanged
+        """
+        try:
+            with self.lock:
+                conn = self.connect()
+                written_at = as_timestamp(written_at)
+                site = site or self.store_config.site
+
+                df = df[df[DATE_COLUMN].notna()]
+                if len(df) == 0:
+                    return {"days_written": 0, "rows_written": 0, "days_unchanged": 0}
+                sites = df[SITE_COLUMN].astype(str).to_numpy() if SITE_COLUMN in df.columns else np.full(len(df), site, dtype=object)
+                days = pd.to_datetime(df[DATE_COLUMN]).dt.strftime(DATE_FORMAT).to_numpy(dtype=object)
+
+                if not self.columns:
+                    self.create_features_table(df)
+                columns = list(self.columns)
+                if sorted(columns) != sorted(column for column in df.columns if column not in (DATE_COLUMN, SITE_COLUMN)):
+                    raise ValueError(f"Columns {sorted(df.columns)} do not match the feature store columns {columns}")
+
+                # Rows of each day together, in their order
+                site_codes, site_names = pd.factorize(sites, sort=True)
+                day_codes, day_names = pd.factorize(days, sort=True)
+                order = np.lexsort((day_codes, site_codes))
+                site_codes, day_codes = site_codes[order], day_codes[order]
+                starts = np.flatnonzero(np.r_[True, (site_codes[1:] != site_codes[:-1]) | (day_codes[1:] != day_codes[:-1])])
+                n_rows = np.diff(np.r_[starts, len(order)])
+                values = df[columns].iloc[order].reset_index(drop=True)
+                digests = self.day_digests(values, starts)
+                day_sites, day_keys = site_names[site_codes[starts]], day_names[day_codes[starts]]
+
+                # Last version and digest of every stored day of these sites, version 0 for new days
+                stored = pd.DataFrame(conn.execute(
+                    f"SELECT site, date, MAX(version), digest FROM feature_versions WHERE site IN ({', '.join('?' * len(site_names))}) "
+                    f"AND date >= ? AND date <= ? GROUP BY site, date", [*site_names.tolist(), day_names[0], day_names[-1]]).fetchall(),
+                    columns=[SITE_COLUMN, DATE_COLUMN, 'version', 'digest'])
+                stored = stored.set_index([SITE_COLUMN, DATE_COLUMN]).reindex(pd.MultiIndex.from_arrays([day_sites, day_keys]))
+                next_versions = stored['version'].fillna(0).to_numpy(dtype=np.int64) + 1
+                changed = stored['digest'].isna().to_numpy() | (stored['digest'].to_numpy() != digests)
+                versions = [(day_site, day, int(version), written_at, int(rows), int(digest)) for day_site, day, version, rows, digest
+                            in zip(day_sites[changed], day_keys[changed], next_versions[changed], n_rows[changed], digests[changed])]
+
+                # One tuple per row of the changed days, NULL for missing values
+                kept = np.repeat(changed, n_rows)
+                row_starts = np.repeat(starts, n_rows)
+                values = values[kept]
+                columns_out = [
+                    np.repeat(day_sites, n_rows)[kept].tolist(),
+                    np.repeat(day_keys, n_rows)[kept].tolist(),
+                    np.repeat(next_versions, n_rows)[kept].tolist(),
+                    (np.arange(len(order)) - row_starts)[kept].tolist(),
+                ]
+                columns_out += [values[column].astype(object).where(values[column].notna(), None).tolist() for column in columns]
+                rows = list(zip(*columns_out))
+
+                with conn:
+                    conn.executemany("INSERT INTO feature_versions VALUES (?, ?, ?, ?, ?, ?)", versions)
+                    conn.executemany(f"INSERT INTO features VALUES ({', '.join('?' * (len(columns) + 4))})", rows)
+
+                summary = {"days_written": len(versions), "rows_written": len(rows), "days_unchanged": len(starts) - len(versions)}
+                logging.info(f"Feature store {self.db_path} : {summary}")
+                return summary
+
+        except Exception as e:
+            logging.error(f"Fail to write the feature store : {e}")
+            raise CustomException(e, sys)
+
+    def frame(self, rows):
+        """
+        This function build a dataframe from rows of site, date, features with the dtypes they were written with.
+
+        Columns are built one at a time from the rows, a frame of a few rows takes well under a millisecond
+        where DataFrame.astype takes several.
+        """
+        names = [SITE_COLUMN, DATE_COLUMN, *self.columns]
+        dtypes = {SITE_COLUMN: 'str', **self.columns}
+        columns = zip(*rows) if rows else [()] * len(names)
+        data = {}
+        for name, values in zip(names, columns):
+            if name == DATE_COLUMN:
+                data[name] = np.array(values, dtype='datetime64[us]')
+            elif dtypes[name] == 'category':
+                data[name] = pd.Categorical(values)
+            elif dtypes[name].startswith(('float', 'int')):
+                data[name] = np.array([np.nan if value is None else value for value in values], dtype=dtypes[name])
+            else:
+                data[name] = pd.array(values, dtype=dtypes[name])
+        return pd.DataFrame(data, copy=False)
+
+    def query(self, where, params, as_of):
+        """
+        This function return the rows of the last version at or before as_of of every day matching where.
+        """
+        columns = ", ".join(f"f.{quote(column)}" for column in self.columns)
+        return self.conn.execute(
+            f"SELECT f.site, f.date, {columns} FROM "
+            f"(SELECT site, date, MAX(version) AS version FROM feature_versions "
+            f"WHERE {where} AND written_at <= ? GROUP BY site, date) v "
+            f"JOIN features f ON f.site = v.site AND f.date = v.date AND f.version = v.version "
+            f"ORDER BY f.site, f.date, f.row", (*params, as_timestamp(as_of))).fetchall()
+
+    def read(self, start=None, end=None, as_of=None, site=None):
+        """
+        This function return the features of the days from start to end as they were at as_of, for training.
+
+        Args:
+        start (str): first day, the first stored day when not given
+        end (str): last day, the last stored day when not given
+        as_of (str): time the features are read at, now when not given
+        site (str): feature_store.site when not given
+
+        return
+            pd.DataFrame : columns of the written rows with a site column, sorted by day
+        """
+        try:
+            with self.lock:
+                self.connect()
+                if not self.columns:
+                    raise ValueError(f"Feature store {self.db_path} is empty")
+                rows = self.query("site = ? AND date >= ? AND date <= ?",
+                                  (site or self.store_config.site, as_day(start) if start else '', as_day(end) if end else '~'), as_of)
+                logging.info(f"Read {len(rows)} rows from the feature store, {start or 'first'} to {end or 'last'} as of {as_of or 'now'}")
+                return self.frame(rows)
+
+        except Exception as e:
+            logging.error(f"Fail to read the feature store : {e}")
+            raise CustomException(e, sys)
+
+    def get_day(self, day, as_of=None, site=None):
+        """
+        This function return the features of one day at as_of for inference, one indexed lookup.
+
+        return
+            pd.DataFrame : rows of the day, empty when the day is not stored
+        """
+        with self.lock:
+            self.connect()
+            if not self.columns:
+                raise ValueError(f"Feature store {self.db_path} is empty")
+            return self.frame(self.query("site = ? AND date = ?", (site or self.store_config.site, as_day(day)), as_of))
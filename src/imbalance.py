@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from customexcept import CustomException
+from utils import config_field
+
+STRATEGIES = ["smote", "class_weight", "balanced_bagging", "none"]
+
+@dataclass
+class ImbalanceConfig:
+    strategy: str = config_field('imbalance', 'strategy')
+    k_neighbors: int = config_field('imbalance', 'k_neighbors')
+    n_estimators: int = config_field('imbalance', 'n_estimators')
+    n_jobs: int = config_field('imbalance', 'n_jobs')
+    random_state: int = config_field('imbalance', 'random_state')
+    cache_path: str = config_field('imbalance', 'cache_path')
+
+
+class ImbalanceHandler:
+    """
+    Class imbalance stage between preprocessing and training.
+
+    Strategies:
+        smote : oversample the training set, neighbours are searched on n_jobs cores
+        class_weight : keep the training set, weight classes inversely to their frequency
+        balanced_bagging : keep the training set, train the model on balanced bootstrap samples
+        none : keep the training set and the model as they are
+    """
+    def __init__(self, strategy=None):
+        self.imbalance_config = ImbalanceConfig()
+        if strategy:
+            self.imbalance_config.strategy = strategy
+        if self.imbalance_config.strategy not in STRATEGIES:
+            raise ValueError(f"Unknown imbalance strategy {self.imbalance_config.strategy}, expected one of {STRATEGIES}")
+        self.report = {}
+
+    def settings(self):
+        """
+        Settings that change the resampled training set, part of its cache key.
+        """
+        config = self.imbalance_config
+        if config.strategy != "smote":
+            return {"strategy": config.strategy}
+        return {"strategy": "smote", "k_neighbors": config.k_neighbors, "random_state": config.random_state}
+
+    def cache_file(self, X, y):
+        import joblib
+        import imblearn
+
+        key = joblib.hash((X, y, self.settings(), imblearn.__version__))
+        return os.path.join(self.imbalance_config.cache_path, f"{key}.joblib")
+
+    def _resample(self, X, y):
+        if self.imbalance_config.strategy != "smote":
+            return X, y
+
+        from imblearn.over_sampling import SMOTE
+        from sklearn.neighbors import NearestNeighbors
+
+        config = self.imbalance_config
+        # Same search as k_neighbors=k, each sample is its own first neighbour
+        neighbours = NearestNeighbors(n_neighbors=config.k_neighbors + 1, n_jobs=config.n_jobs)
+        return SMOTE(k_neighbors=neighbours, random_state=config.random_state).fit_resample(X, y)
+
+    @staticmethod
+    def _as_labels(y_res, y_train):
+        """
+        Labels loaded from the cache in the container fit_resample returns for y_train, a Series for a Series.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if isinstance(y_train, pd.Series):
+            return pd.Series(np.asarray(y_res), name=y_train.name, dtype=y_train.dtype)
+        return np.array(y_res)
+
+    def resample(self, X_train, y_train, use_cache=True, trace_memory=False):
+        """
+        This function return the training set of the strategy, only smote changes it.
+
+        The smote result is cached under a hash of the data and the settings, so repeated training runs
+        and the deep learning trainer load it instead of resampling. X_train comes back memory mapped
+        and read-only from the cache, y_train in the same container as a fresh resample. Time, and peak
+        memory with trace_memory set, of the resampling are kept in report.
+
+        Args:
+        X_train (np.ndarray): preprocessed training features
+        y_train (array like): training labels
+        use_cache (bool): read and write the cache
+        trace_memory (bool): trace allocations with tracemalloc to report the peak, slows resampling down
+
+        return
+            X_train, y_train
+        """
+        logging.info(f"Applying imbalance strategy {self.imbalance_config.strategy}")
+        try:
+            import joblib
+            import tracemalloc
+            import numpy as np
+
+            smote = self.imbalance_config.strategy == "smote"
+            path = self.cache_file(X_train, y_train) if use_cache and smote else None
+            if path and os.path.exists(path):
+                start = time.perf_counter()
+                X_res, y_res = joblib.load(path, mmap_mode='r')
+                y_res = self._as_labels(y_res, y_train)
+                self.report = {"strategy": self.imbalance_config.strategy, "cached": True,
+                               "seconds": time.perf_counter() - start, "peak_mb": 0.0 if trace_memory else None,
+                               "rows_before": len(y_train), "rows_after": len(y_res)}
+                logging.info(f"Resampled training set loaded from {path}")
+                return X_res, y_res
+
+            peak_mb = None
+            if trace_memory:
+                tracemalloc.start()
+            try:
+                start = time.perf_counter()
+                X_res, y_res = self._resample(X_train, y_train)
+                seconds = time.perf_counter() - start
+                if trace_memory:
+                    peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            finally:
+                if trace_memory:
+                    tracemalloc.stop()
+
+            self.report = {"strategy": self.imbalance_config.strategy, "cached": False, "seconds": seconds,
+                           "peak_mb": peak_mb, "rows_before": len(y_train), "rows_after": len(y_res)}
+            logging.info(f"Imbalance strategy {self.imbalance_config.strategy} took {seconds:.3f}s"
+                         f"{f', peak {peak_mb:.1f} MB' if trace_memory else ''}, {len(y_train)} -> {len(y_res)} rows")
+
+            if path:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                joblib.dump((X_res, np.asarray(y_res)), path + ".tmp")
+                os.replace(path + ".tmp", path)
+            return X_res, y_res
+
+        except Exception as e:
+            logging.error(f"Fail to apply imbalance strategy : {e}")
+            raise CustomException(e, sys)
+
+    def wrap_model(self, model):
+        """
+        This function adapt an untrained sklearn model to the strategy.
+
+        class_weight sets class_weight='balanced' on models that support it, balanced_bagging wraps the
+        model in a BalancedBaggingClassifier.
+
+        return
+            model
+        """
+        config = self.imbalance_config
+        if config.strategy == "class_weight":
+            if "class_weight" in model.get_params():
+                return model.set_params(class_weight="balanced")
+            logging.warning(f"{type(model).__name__} does not support class weights, trained unweighted")
+            return model
+
+        if config.strategy == "balanced_bagging":
+            from imblearn.ensemble import BalancedBaggingClassifier
+            return BalancedBaggingClassifier(estimator=model, n_estimators=config.n_estimators,
+                                             n_jobs=config.n_jobs, random_state=config.random_state)
+        return model
+
+    def class_weight(self, y_encoded):
+        """
+        This function return the keras class_weight of the strategy, None when the classes are not weighted.
+
+        Bagging does not apply to a single network, balanced_bagging falls back to class weights.
+
+        Args:
+        y_encoded (np.ndarray): integer encoded training labels
+        """
+        import numpy as np
+
+        if self.imbalance_config.strategy not in ("class_weight", "balanced_bagging"):
+            return None
+        counts = np.bincount(y_encoded)
+        return {label: len(y_encoded) / (len(counts) * count) for label, count in enumerate(counts) if count}
@@ -1,16 +1,110 @@
 import logging
+import logging.handlers
 import os
+import sys
+import queue
+import atexit
+import threading
 from datetime import datetime
 
 LOG_FILE=f"{datetime.now().strftime('%m_%d_%Y')}.log"
-logs_path=os.path.join(os.getcwd(),"logs",LOG_FILE)
-os.makedirs(logs_path,exist_ok=True)
+logs_path=os.path.join(os.getcwd(),"logs")
 
 LOG_FILE_PATH=os.path.join(logs_path, LOG_FILE)
 
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format="[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    filemode='a'
-)
+LOG_FORMAT = "[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s"
+
+
+class LazyFileHandler(logging.FileHandler):
+    """
+    File handler that creates the log folder and opens the file on the first record,
+    so importing a module that logs has no side effect on disk.
+    """
+    def __init__(self, filename, mode='a'):
+        super().__init__(filename, mode=mode, delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+_listener = None
+_queue_handler = None
+_hooks_registered = False
+_lock = threading.Lock()
+
+
+class StartOnFirstRecord(logging.Handler):
+    """
+    Root handler set at import, the first record starts the listener thread and is handed over to it,
+    so importing a module that logs starts no thread and registers no exit or fork hook.
+    """
+    def emit(self, record):
+        start_logging().handle(record)
+
+
+def start_logging():
+    """
+    Route the root logger through a QueueHandler, records are formatted and written to
+    LOG_FILE_PATH by a QueueListener thread so logging calls never wait on the disk.
+
+    Called by the first record, does nothing once logging runs. Forked children start their own
+    listener, they do not inherit the thread.
+
+    return
+        logging.handlers.QueueHandler : handler of the root logger
+    """
+    global _listener, _queue_handler, _hooks_registered
+
+    with _lock:
+        if _listener is not None:
+            return _queue_handler
+
+        log_queue = queue.SimpleQueue()
+        file_handler = LazyFileHandler(LOG_FILE_PATH)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            if isinstance(handler, (logging.handlers.QueueHandler, StartOnFirstRecord)):
+                root.removeHandler(handler)
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        root.addHandler(_queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, file_handler)
+        _listener.start()
+
+        if not _hooks_registered:
+            atexit.register(stop_logging)
+            os.register_at_fork(after_in_child=_after_fork)
+            _hooks_registered = True
+        return _queue_handler
+
+def stop_logging():
+    """
+    Write the queued records and close the log file.
+    """
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def _after_fork():
+    global _listener, _lock
+
+    # The listener thread of the parent does not exist in the child, nor does the owner of its lock
+    _listener = None
+    _lock = threading.Lock()
+    start_logging()
+    # multiprocessing children leave through os._exit, which skips atexit
+    if "multiprocessing.util" in sys.modules:
+        sys.modules["multiprocessing.util"].Finalize(None, stop_logging, exitpriority=0)
+
+
+logging.getLogger().addHandler(StartOnFirstRecord())
+logging.getLogger().setLevel(logging.INFO)
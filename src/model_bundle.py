@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import hashlib
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from customexcept import CustomException
+from utils import load_config
+
+# Bumped whenever the layout of ModelBundle changes
+BUNDLE_FORMAT_VERSION = 1
+
+def feature_schema(X, target=None):
+    """
+    Describe the input columns of the preprocessing pipeline.
+
+    Args:
+    X (pd.DataFrame): features before preprocessing
+    target (str): name of the label column
+
+    Returns:
+    dict : columns with their dtypes and the target name
+    """
+    return {
+        "columns": [{"name": column, "dtype": str(dtype)} for column, dtype in X.dtypes.items()],
+        "target": target,
+    }
+
+def frame_hash(*frames):
+    """
+    sha256 of the content of dataframes / series, used to tie a bundle to its training data.
+    """
+    import pandas as pd
+
+    sha = hashlib.sha256()
+    for frame in frames:
+        sha.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return sha.hexdigest()
+
+def _bundle_paths(name):
+    dir_path = os.path.dirname(load_config("models")["model_path"])
+    return os.path.join(dir_path, f"{name}.joblib"), os.path.join(dir_path, f"{name}.json")
+
+def _file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@dataclass
+class ModelBundle:
+    """
+    Fitted preprocessing pipeline, label encoder, feature schema and estimator saved as one artifact.
+    """
+    model: object
+    preprocessing: object
+    label_encoder: object
+    schema: dict
+    metadata: dict = field(default_factory=dict)
+
+    @property
+    def feature_names(self):
+        return [column["name"] for column in self.schema["columns"]]
+
+    def transform(self, X):
+        """
+        This function apply the fitted preprocessing to new rows, without refitting.
+
+        Args:
+        X (pd.DataFrame): rows with the columns of the feature schema, extra columns are ignored
+
+        return
+            np.ndarray
+        """
+        missing = [name for name in self.feature_names if name not in X.columns]
+        if missing:
+            raise ValueError(f"Missing feature columns : {missing}")
+        return self.preprocessing.transform(X[self.feature_names])
+
+    def predict(self, X):
+        """
+        This function transform and predict new rows in one call.
+
+        return
+            np.ndarray : class labels
+        """
+        return self.model.predict(self.transform(X))
+
+    def predict_proba(self, X):
+        """
+        This function return class probabilities, columns ordered as label_encoder.classes_.
+        """
+        import numpy as np
+
+        proba = self.model.predict_proba(self.transform(X))
+        order = [list(self.model.classes_).index(label) for label in self.label_encoder.classes_]
+        return np.asarray(proba)[:, order]
+
+
+def save_bundle(bundle, name):
+    """
+    Write a bundle to models/<name>.joblib with its metadata in models/<name>.json.
+
+    The joblib file is not compressed so that its arrays can be memory-mapped on load.
+    Metadata holds the bundle format version, library versions, creation time and the sha256 of the artifact.
+
+    Args:
+    bundle (ModelBundle): bundle to save
+    name (str): name of the bundle
+
+    Returns:
+    dict : metadata written
+
+    Example:
+    >>> save_bundle(ModelBundle(model, pipeline, encoder, schema), "random_forest")
+    """
+    import joblib
+    import sklearn
+
+    try:
+        bundle_path, meta_path = _bundle_paths(name)
+        os.makedirs(os.path.dirname(bundle_path) or ".", exist_ok=True)
+        logging.info(f"Saving bundle {name}...")
+
+        bundle.metadata = dict(bundle.metadata, **{
+            "name": name,
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "model_class": type(bundle.model).__name__,
+            "sklearn_version": sklearn.__version__,
+            "joblib_version": joblib.__version__,
+        })
+
+        tmp_path = bundle_path + ".tmp"
+        joblib.dump(bundle, tmp_path)
+        os.replace(tmp_path, bundle_path)
+
+        metadata = dict(bundle.metadata, sha256=_file_sha256(bundle_path), schema=bundle.schema)
+        with open(meta_path, 'w') as f:
+            json.dump(metadata, f, indent=4)
+
+        logging.info(f"Bundle {name} saved in models")
+        return metadata
+
+    except Exception as e:
+        logging.error(f"Fail to save bundle : {e}")
+        raise CustomException(e, sys)
+
+def load_bundle(name, mmap_mode='r', verify=True):
+    """
+    Load a bundle written by save_bundle.
+
+    Args:
+    name (str): name of the bundle
+    mmap_mode (str): joblib mmap_mode, None reads the arrays into memory
+    verify (bool): check the artifact against the sha256 and format version in its metadata
+
+    Returns:
+    ModelBundle
+    """
+    import joblib
+
+    try:
+        bundle_path, meta_path = _bundle_paths(name)
+        logging.info(f"Loading bundle {name}...")
+
+        if verify:
+            with open(meta_path, 'r') as f:
+                metadata = json.load(f)
+            if metadata["format_version"] != BUNDLE_FORMAT_VERSION:
+                raise ValueError(f"Bundle format {metadata['format_version']} is not supported, expected {BUNDLE_FORMAT_VERSION}")
+            if _file_sha256(bundle_path) != metadata["sha256"]:
+                raise ValueError(f"{bundle_path} does not match the sha256 in {meta_path}")
+
+        return joblib.load(bundle_path, mmap_mode=mmap_mode)
+
+    except Exception as e:
+        logging.error(f"Fail to load bundle : {e}")
+        raise CustomException(e, sys)
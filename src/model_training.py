@@ -1,27 +1,150 @@
 import os
 import sys
+import time
+import pickle
+import argparse
 from dataclasses import dataclass
-from utils import load_config, save_model
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.naive_bayes import GaussianNB
-from sklearn.svm import SVC
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report, confusion_matrix, ConfusionMatrixDisplay 
-from data_preprocessing import DataPreprocessing
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from utils import config_field
+from model_bundle import ModelBundle, save_bundle
+from imbalance import ImbalanceHandler
+from stage_metrics import track_stage, stage_rows
 
 from logger import logging
 from customexcept import CustomException
 
 @dataclass
 class ModelTrainerConfig:
-    config = load_config('model_training')
+    config: dict = config_field('model_training')
+    leaderboard_path: str = config_field('leaderboard', 'output_path')
+    max_workers: int = config_field('leaderboard', 'max_workers')
 
 class ModelTrainer:
     def __init__(self):
         self.modeltrainer_config = ModelTrainerConfig()
 
+    def get_model(self, model_name):
+        """
+        This function return an untrained model by its name in config.json
+        """
+        from sklearn.neighbors import KNeighborsClassifier
+        from sklearn.svm import SVC
+        from sklearn.tree import DecisionTreeClassifier
+        from sklearn.ensemble import RandomForestClassifier
+
+        models = {
+            "KNeighbors Classifer": KNeighborsClassifier,
+            "SVM": SVC,
+            "Decision Tree": DecisionTreeClassifier,
+            "Random Forest": RandomForestClassifier,
+        }
+        if model_name not in models:
+            raise ValueError(f"Unknown model {model_name}, expected one of {list(models)}")
+        return models[model_name]()
+
+    def evaluate_model(self, model_name, data, n_jobs=1):
+        """
+        This function train one model with its config.json params and measure it, without plotting.
+
+        Args:
+        model_name (str): model from config.json
+        data (tuple): X_train, X_test, y_train, y_test
+        n_jobs (int): cores given to models that can use several, unless set in config.json
+
+        return
+            dict : one leaderboard row
+        """
+        import numpy as np
+        from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+
+        X_train, X_test, y_train, y_test = data
+        params = self.modeltrainer_config.config[model_name]['params']
+        model = ImbalanceHandler().wrap_model(self.get_model(model_name).set_params(**params))
+        # A balanced bagging wrapper takes the cores itself, over its estimators
+        configured_jobs = model.get_params(deep=False).get('n_jobs')
+        use_jobs = 'n_jobs' in model.get_params(deep=False) and 'n_jobs' not in params
+        if use_jobs:
+            model.set_params(n_jobs=n_jobs)
+
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_time = time.perf_counter() - start
+
+        # Extra cores are for fitting, predictions are timed as served
+        if use_jobs:
+            model.set_params(n_jobs=configured_jobs)
+
+        start = time.perf_counter()
+        y_test_pred = model.predict(X_test)
+        predict_time = time.perf_counter() - start
+
+        # Latency of a single record, as served one request at a time
+        single = []
+        for row in X_test[:20]:
+            start = time.perf_counter()
+            model.predict(row.reshape(1, -1))
+            single.append(time.perf_counter() - start)
+
+        labels = sorted(np.unique(y_test))
+        precision, recall, f1, _ = precision_recall_fscore_support(y_test, y_test_pred, labels=labels, zero_division=0)
+        row = {
+            "model": model_name,
+            "accuracy": accuracy_score(y_test, y_test_pred),
+            "f1_macro": float(np.mean(f1)),
+            "fit_time_s": fit_time,
+            "predict_time_s": predict_time,
+            "predict_us_per_record": predict_time / len(y_test) * 1e6,
+            "single_record_latency_ms": float(np.median(single)) * 1000,
+            "model_size_mb": len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 1e6,
+        }
+        for label, p, r in zip(labels, precision, recall):
+            row[f"precision_{label}"] = p
+            row[f"recall_{label}"] = r
+        logging.info(f"Evaluated {model_name} : accuracy {row['accuracy']:.3f}, fit {fit_time:.2f}s")
+        return row
+
+    def leaderboard(self, model_names=None, data=None, out_path=None):
+        """
+        This function train and evaluate models in parallel in a process pool and write a leaderboard.
+
+        Cores left over when there are fewer models than cores are given to the models that accept n_jobs.
+
+        Args:
+        model_names (list): models from config.json, all of them when not given
+        data (tuple): X_train, X_test, y_train, y_test, scaled by DataPreprocessing when not given
+        out_path (str): csv file, leaderboard.output_path when not given
+
+        return
+            pd.DataFrame : one row per model, best f1_macro first
+        """
+        logging.info("Building leaderboard.....")
+        try:
+            import pandas as pd
+
+            model_names = list(model_names or self.modeltrainer_config.config)
+            out_path = out_path or self.modeltrainer_config.leaderboard_path
+            if data is None:
+                from data_preprocessing import DataPreprocessing
+                data = DataPreprocessing().scale_data()
+
+            cores = os.cpu_count() or 1
+            workers = min(len(model_names), self.modeltrainer_config.max_workers or cores)
+            n_jobs = max(1, cores // workers)
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self.evaluate_model, name, data, n_jobs) for name in model_names]
+                rows = [future.result() for future in futures]
+
+            board = pd.DataFrame(rows).sort_values("f1_macro", ascending=False).reset_index(drop=True)
+            os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+            board.to_csv(out_path, index=False)
+            logging.info(f"Leaderboard written to {out_path}")
+            return board
+
+        except Exception as e:
+            logging.error(f"Unable to build leaderboard : {e}")
+            raise CustomException(e, sys)
+
     def model_selection(self):
         """
         This function display a selection menu of models
@@ -38,51 +161,80 @@ class ModelTrainer:
 
             if model_num == "1":
                 model_name = "KNeighbors Classifer"
-                model = KNeighborsClassifier()
+                model = self.get_model(model_name)
                 return model, model_name
             
             elif model_num == "2":
                 model_name = "SVM"
-                model = SVC()
+                model = self.get_model(model_name)
                 return model, model_name
             
             elif model_num == "3":
                 model_name = "Decision Tree"
-                model = DecisionTreeClassifier()
+                model = self.get_model(model_name)
                 return model, model_name
                 
             
             elif model_num == "" or model_num == "4":
                 model_name = "Random Forest"
-                model = RandomForestClassifier()
+                model = self.get_model(model_name)
                 return model, model_name
             
             else:
                 print("Invalid selection. Please try again.")
 
-    def train_model(self):
+    @track_stage("train_model")
+    def train_model(self, model_name=None, data=None, headless=False):
         """
         This function is reponsible for training the model
+
+        Args:
+        model_name (str): model from config.json, asked through the selection menu when not given
+        data (tuple): X_train, X_test, y_train, y_test, scaled by DataPreprocessing when not given
+        headless (bool): log the test accuracy instead of printing the report and plotting the confusion matrix
         """
         logging.info("Training Model.....")
         try:
+            from sklearn.metrics import classification_report, confusion_matrix, ConfusionMatrixDisplay
+
             # Model selection
-            model, model_name = self.model_selection()
+            if model_name is None:
+                model, model_name = self.model_selection()
+            else:
+                model = self.get_model(model_name)
             
             # Parameter settings in config.json
             model.set_params(**self.modeltrainer_config.config[model_name]['params'])   
-            print("Using model : ", model_name , model)
+            model = ImbalanceHandler().wrap_model(model)
+            logging.info(f"Using model : {model_name} {model}")
+            if not headless:
+                print("Using model : ", model_name , model)
             
             # Scaling and splitting data
-            dataprocessing = DataPreprocessing()
-            X_train, X_test, y_train, y_test = dataprocessing.scale_data()
+            if data is None:
+                from data_preprocessing import DataPreprocessing
+                dataprocessing = DataPreprocessing()
+                data = dataprocessing.scale_data()
+                self.preprocessing = dataprocessing.pipeline
+                self.schema = dataprocessing.schema
+                self.data_hash = dataprocessing.data_hash
+            X_train, X_test, y_train, y_test = data
 
             # Train model
             model.fit(X_train, y_train) 
 
             # Make predictions
             y_test_pred = model.predict(X_test)
+            stage_rows(rows_in=len(X_train), rows_out=len(y_test_pred))
            
+            self.model_name = model_name
+            if headless:
+                from sklearn.metrics import accuracy_score
+                logging.info(f"{model_name} test accuracy : {accuracy_score(y_test, y_test_pred):.4f}")
+                return model
+
+            import matplotlib.pyplot as plt
+
             # Evaluate Train and Test dataset
             report = classification_report(y_test,y_test_pred)
             # Generate the confusion matrix
@@ -107,10 +259,52 @@ class ModelTrainer:
             logging.error(f"Unable to train model : {e}")
             raise CustomException(e, sys)
 
+    def make_bundle(self, model, preprocessing=None, schema=None, data_hash=None):
+        """
+        This function package a trained model with the preprocessing pipeline, label encoder and
+        feature schema of the data it was trained on.
+
+        Args:
+        model: estimator returned by train_model
+        preprocessing: fitted DataPreprocessing.pipeline, the one of train_model when it scaled the data itself
+        schema (dict): DataPreprocessing.schema of the training data, same default
+        data_hash (str): DataPreprocessing.data_hash of the training data, same default
+
+        return
+            ModelBundle
+        """
+        from sklearn.preprocessing import LabelEncoder
+
+        preprocessing = preprocessing if preprocessing is not None else getattr(self, "preprocessing", None)
+        schema = schema if schema is not None else getattr(self, "schema", None)
+        data_hash = data_hash if data_hash is not None else getattr(self, "data_hash", None)
+        if preprocessing is None or schema is None:
+            raise ValueError("No preprocessing pipeline and schema, pass the ones of the DataPreprocessing that scaled the data")
+
+        label_encoder = LabelEncoder().fit(model.classes_)
+        metadata = {
+            "model_name": self.model_name,
+            "params": self.modeltrainer_config.config[self.model_name]['params'],
+            "data_sha256": data_hash,
+        }
+        return ModelBundle(model, preprocessing, label_encoder, schema, metadata)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a model interactively, or compare all models with --leaderboard")
+    parser.add_argument("--leaderboard", action="store_true", help="train every model in parallel and write leaderboard.output_path")
+    parser.add_argument("--models", nargs="+", help="models from config.json to put on the leaderboard")
+    parser.add_argument("--output", help="leaderboard csv, defaults to leaderboard.output_path")
+    args = parser.parse_args()
+
     # Create a model trainer object
     obj = ModelTrainer()
-    
+
+    if args.leaderboard:
+        import pandas as pd
+        with pd.option_context("display.max_columns", None, "display.width", 200):
+            print(obj.leaderboard(args.models, out_path=args.output))
+        sys.exit(0)
+
     while True:
         model = obj.train_model()
 
@@ -118,7 +312,8 @@ if __name__ == "__main__":
         response = input("Do you wish to save the model? Enter y to save : ")
         if response.lower() == "y" or response.lower() == "yes" :
             name = input("Enter your model name")
-            save_model(model,name)
+            save_bundle(obj.make_bundle(model), name)
+            print("Bundle have been saved in models")
         
         # Await input from user
         response = input("Do you wish to make changes? : (y/N)")
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from customexcept import CustomException
+from utils import config_field
+from imbalance import ImbalanceHandler
+
+@dataclass
+class ModelTuningConfig:
+    model_name: str = config_field('model_tuning', 'model_name')
+    search: str = config_field('model_tuning', 'search')
+    n_candidates: int = config_field('model_tuning', 'n_candidates')
+    cv: int = config_field('model_tuning', 'cv')
+    factor: int = config_field('model_tuning', 'factor')
+    min_samples: int = config_field('model_tuning', 'min_samples')
+    scoring: str = config_field('model_tuning', 'scoring')
+    early_stop_margin: float = config_field('model_tuning', 'early_stop_margin')
+    random_state: int = config_field('model_tuning', 'random_state')
+    max_workers: int = config_field('model_tuning', 'max_workers')
+    cache_path: str = config_field('model_tuning', 'cache_path')
+    checkpoint_path: str = config_field('model_tuning', 'checkpoint_path')
+    output_path: str = config_field('model_tuning', 'output_path')
+    search_spaces: dict = config_field('model_tuning', 'search_spaces')
+
+
+def evaluate_candidate(model_name, params, fold_paths, n_samples, scoring, cutoff=None):
+    """
+    This function fit one candidate on the first n_samples rows of every cached fold and score it.
+
+    Folds are evaluated one after the other, the candidate is stopped as soon as its mean score
+    falls below cutoff.
+
+    return
+        dict : scores per fold evaluated and whether the candidate was stopped early
+    """
+    import joblib
+    from sklearn.metrics import get_scorer
+    from model_training import ModelTrainer
+
+    scorer = get_scorer(scoring)
+    scores = []
+    start = time.perf_counter()
+    for path in fold_paths:
+        X_train, y_train, X_val, y_val = joblib.load(path, mmap_mode='r')
+        model = ImbalanceHandler().wrap_model(ModelTrainer().get_model(model_name).set_params(**params))
+        model.fit(X_train[:n_samples], y_train[:n_samples])
+        scores.append(float(scorer(model, X_val, y_val)))
+        if cutoff is not None and sum(scores) / len(scores) < cutoff:
+            break
+    return {
+        "scores": scores,
+        "mean": sum(scores) / len(scores),
+        "pruned": len(scores) < len(fold_paths),
+        "fit_time_s": time.perf_counter() - start,
+    }
+
+
+class ModelTuning:
+    def __init__(self):
+        self.tuning_config = ModelTuningConfig()
+
+    def candidates(self, model_name):
+        """
+        This function sample the candidates of a search space of config.json, the same ones on every run.
+        """
+        from sklearn.model_selection import ParameterSampler
+
+        space = {key: list(values) for key, values in self.tuning_config.search_spaces[model_name].items()}
+        n_grid = 1
+        for values in space.values():
+            n_grid *= len(values)
+        n_candidates = min(self.tuning_config.n_candidates, n_grid)
+        return [dict(params) for params in ParameterSampler(space, n_candidates, random_state=self.tuning_config.random_state)]
+
+    def cache_folds(self, df=None):
+        """
+        This function fit the preprocessing pipeline and the imbalance resampling once per cross
+        validation fold and cache the transformed arrays, so candidates only load them.
+
+        The held out split of DataPreprocessing.scale_data is left out of the folds. Rows of each
+        training fold are shuffled once, so the first n rows are a random subsample for successive halving.
+
+        Args:
+        df (pd.DataFrame): clean dataframe, read from clean_data_path when not given
+
+        return
+            list : path of every fold, n training rows of the smallest fold
+        """
+        import joblib
+        import numpy as np
+        from sklearn.model_selection import train_test_split, StratifiedKFold
+        from data_preprocessing import DataPreprocessing
+        from model_bundle import frame_hash
+
+        config = self.tuning_config
+        imbalance = ImbalanceHandler()
+        preprocessing = DataPreprocessing()
+        X, y = preprocessing.features_target(preprocessing.preprocessing_pipeline(), df)
+        X, _, y, _ = train_test_split(X, y, test_size=0.2, random_state=42)
+
+        # Folds are reused while the data, the pipeline and the split are unchanged
+        key = hashlib.sha256(json.dumps({
+            "data": frame_hash(X, y),
+            "pipeline": joblib.hash(preprocessing.preprocessing_pipeline()),
+            "cv": config.cv,
+            "random_state": config.random_state,
+            "imbalance": imbalance.settings(),
+        }, sort_keys=True).encode()).hexdigest()
+        fold_dir = os.path.join(config.cache_path, "folds", key)
+        fold_paths = [os.path.join(fold_dir, f"fold{i}.joblib") for i in range(config.cv)]
+        sizes_path = os.path.join(fold_dir, "sizes.json")
+
+        if os.path.exists(sizes_path):
+            logging.info(f"Using cached folds {key[:12]}")
+            with open(sizes_path, 'r') as f:
+                return fold_paths, min(json.load(f))
+
+        os.makedirs(fold_dir, exist_ok=True)
+        sizes = []
+        rng = np.random.default_rng(config.random_state)
+        folds = StratifiedKFold(config.cv, shuffle=True, random_state=config.random_state).split(X, y)
+        for path, (train_index, val_index) in zip(fold_paths, folds):
+            pipeline = preprocessing.preprocessing_pipeline()
+            X_train = pipeline.fit_transform(X.iloc[train_index])
+            X_val = pipeline.transform(X.iloc[val_index])
+            # The folds are cached already, no need for the resampled set cache
+            X_train, y_train = imbalance.resample(X_train, y.iloc[train_index], use_cache=False)
+
+            order = rng.permutation(len(y_train))
+            X_train, y_train = np.asarray(X_train)[order], np.asarray(y_train)[order]
+            joblib.dump((X_train, y_train, np.asarray(X_val), np.asarray(y.iloc[val_index])), path)
+            sizes.append(len(y_train))
+
+        with open(sizes_path, 'w') as f:
+            json.dump(sizes, f)
+        logging.info(f"Cached {config.cv} folds in {fold_dir}")
+        return fold_paths, min(sizes)
+
+    def search_key(self, model_name, fold_paths):
+        config = self.tuning_config
+        return hashlib.sha256(json.dumps({
+            "model": model_name,
+            "space": config.search_spaces[model_name],
+            "folds": fold_paths,
+            "settings": [config.search, config.n_candidates, config.factor, config.min_samples,
+                         config.scoring, config.early_stop_margin],
+            "imbalance": ImbalanceHandler().settings(),
+        }, sort_keys=True).encode()).hexdigest()
+
+    def load_checkpoint(self, key):
+        """
+        This function return the evaluations already done by a search with the same key.
+        """
+        done = {}
+        if not os.path.exists(self.tuning_config.checkpoint_path):
+            return done
+        with open(self.tuning_config.checkpoint_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut short by an interrupted run
+                    continue
+                if entry["key"] == key:
+                    done[(entry["round"], json.dumps(entry["params"], sort_keys=True))] = entry
+        return done
+
+    def run_round(self, round_index, candidates, n_samples, n_keep, fold_paths, key, done):
+        """
+        This function evaluate the candidates of one round in parallel, skipping the ones in the checkpoint.
+
+        A candidate is stopped early when its mean score falls below the n_keep-th best mean score
+        of the round so far, minus early_stop_margin.
+
+        return
+            list : checkpoint entries of the round
+        """
+        config = self.tuning_config
+        model_name = config.model_name
+        results = []
+
+        def cutoff():
+            means = sorted((entry["mean"] for entry in results if not entry["pruned"]), reverse=True)
+            return means[n_keep - 1] - config.early_stop_margin if len(means) >= n_keep else None
+
+        pending = []
+        for params in candidates:
+            entry = done.get((round_index, json.dumps(params, sort_keys=True)))
+            if entry is not None:
+                results.append(entry)
+            else:
+                pending.append(params)
+        if len(pending) < len(candidates):
+            logging.info(f"Round {round_index} : {len(candidates) - len(pending)} candidates resumed from checkpoint")
+
+        os.makedirs(os.path.dirname(config.checkpoint_path) or ".", exist_ok=True)
+        workers = config.max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor, open(config.checkpoint_path, 'a') as checkpoint:
+            running = {}
+            while pending or running:
+                # Submit as workers free up so later candidates see the scores of earlier ones
+                while pending and len(running) < workers:
+                    params = pending.pop(0)
+                    future = executor.submit(evaluate_candidate, model_name, params, fold_paths, n_samples,
+                                             config.scoring, cutoff())
+                    running[future] = params
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    entry = dict(future.result(), key=key, round=round_index, params=running.pop(future),
+                                 n_samples=n_samples)
+                    results.append(entry)
+                    checkpoint.write(json.dumps(entry) + "\n")
+                    checkpoint.flush()
+
+        return results
+
+    def tune(self, model_name=None, df=None, resume=True):
+        """
+        This function search the hyperparameters of a model from its search space in config.json.
+
+        With search "halving", every round trains the remaining candidates on factor times more rows
+        and keeps the best 1/factor of them, until one candidate is left or the folds are used whole.
+        With search "random", every candidate is trained once on the whole folds.
+        Every evaluation is appended to checkpoint_path, an interrupted search resumes from it.
+
+        Args:
+        model_name (str): model from config.json, model_tuning.model_name when not given
+        df (pd.DataFrame): clean dataframe, read from clean_data_path when not given
+        resume (bool): reuse the evaluations in checkpoint_path
+
+        return
+            dict : best params, their cross validation score and the last round
+        """
+        logging.info("Tuning model.....")
+        try:
+            config = self.tuning_config
+            if model_name:
+                config.model_name = model_name
+            model_name = config.model_name
+
+            fold_paths, n_rows = self.cache_folds(df)
+            candidates = self.candidates(model_name)
+            key = self.search_key(model_name, fold_paths)
+            done = self.load_checkpoint(key) if resume else {}
+
+            # Number of rows per round, the last round uses the whole folds
+            if config.search == "halving":
+                budgets, n_left, n_samples = [], len(candidates), config.min_samples
+                while n_left > 1 and n_samples * config.factor < n_rows:
+                    budgets.append(n_samples)
+                    n_left, n_samples = max(1, n_left // config.factor), n_samples * config.factor
+                budgets.append(n_rows)
+            elif config.search == "random":
+                budgets = [n_rows]
+            else:
+                raise ValueError(f"Unknown search {config.search}, expected halving or random")
+
+            start = time.perf_counter()
+            for round_index, n_samples in enumerate(budgets):
+                last = round_index == len(budgets) - 1
+                n_keep = 1 if last else max(1, len(candidates) // config.factor)
+                results = self.run_round(round_index, candidates, n_samples, n_keep, fold_paths, key, done)
+
+                ranked = sorted(results, key=lambda entry: (entry["pruned"], -entry["mean"]))
+                pruned = sum(entry["pruned"] for entry in results)
+                print(f"Round {round_index} : {len(candidates)} candidates on {n_samples} rows, "
+                      f"{pruned} stopped early, best {config.scoring} {ranked[0]['mean']:.4f}")
+                logging.info(f"Round {round_index} : {len(candidates)} candidates, {n_samples} rows, {pruned} stopped early")
+                candidates = [entry["params"] for entry in ranked[:n_keep]]
+
+            best = {
+                "model": model_name,
+                "params": ranked[0]["params"],
+                "scoring": config.scoring,
+                "cv_score": ranked[0]["mean"],
+                "search_time_s": time.perf_counter() - start,
+                "last_round": ranked,
+            }
+            os.makedirs(os.path.dirname(config.output_path) or ".", exist_ok=True)
+            with open(config.output_path, 'w') as f:
+                json.dump(best, f, indent=4)
+            logging.info(f"Best params for {model_name} : {best['params']}")
+            return best
+
+        except Exception as e:
+            logging.error(f"Unable to tune model : {e}")
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the hyperparameters of a model with the search spaces in config.json")
+    parser.add_argument("--model", help="model from config.json, defaults to model_tuning.model_name")
+    parser.add_argument("--fresh", action="store_true", help="ignore the evaluations in model_tuning.checkpoint_path")
+    args = parser.parse_args()
+
+    best = ModelTuning().tune(args.model, resume=not args.fresh)
+    print(f"Best params for {best['model']} ({best['scoring']} {best['cv_score']:.4f}) : {best['params']}")
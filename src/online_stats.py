@@ -0,0 +1,114 @@
+import numpy as np
+
+class RunningMoments:
+    """
+    Count, mean and sum of squared deviations of every column of a stream of 2-D chunks.
+
+    Chunks are folded in with the parallel form of Welford's update (Chan et al.), which keeps
+    the variance accurate where the naive sum of squares cancels. NaN are skipped and flagged.
+    """
+    def __init__(self, n_columns):
+        self.count = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.has_nan = np.zeros(n_columns, dtype=bool)
+
+    def update(self, values):
+        """
+        Fold a (rows, columns) array into the moments.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        nan = np.isnan(values)
+        self.has_nan |= nan.any(axis=0)
+
+        count = (~nan).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(values, axis=0) / count, 0.0)
+            m2 = np.nansum((values - mean) ** 2, axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(total > 0, count / total, 0.0)
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * ratio
+        self.count = total
+
+    @property
+    def std(self):
+        """
+        Population standard deviation (ddof=0), as scipy.stats.zscore uses.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self.m2 / self.count)
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with bounded memory, a simplified KLL sketch.
+
+    Values are buffered at level 0. When a level holds more than capacity values it is sorted and
+    every other value is promoted to the next level, where each value stands for twice as many.
+    At most capacity values are kept per level, about log2(n / capacity) levels.
+
+    Until the first compaction the sketch holds every value and quantiles are exact. After it, the
+    rank of a returned quantile is within log2(n / capacity) / capacity * n of the requested rank,
+    and usually much closer since the random offsets of successive compactions cancel out.
+    """
+    def __init__(self, capacity=4096, seed=0):
+        self.capacity = capacity
+        self.levels = [[]]
+        self.sizes = [0]
+        self.rng = np.random.default_rng(seed)
+
+    @property
+    def exact(self):
+        return len(self.levels) == 1
+
+    def update(self, values):
+        """
+        Add a 1-D array of values, NaN are ignored.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.levels[0].append(values)
+        self.sizes[0] += len(values)
+
+        level = 0
+        while level < len(self.levels) and self.sizes[level] > self.capacity:
+            self.compact(level)
+            level += 1
+
+    def compact(self, level):
+        values = np.sort(np.concatenate(self.levels[level]))
+        # An odd value out stays at its level so no weight is lost
+        keep = values[:len(values) % 2]
+        promoted = values[len(keep):][self.rng.integers(2)::2]
+
+        self.levels[level] = [keep]
+        self.sizes[level] = len(keep)
+        if level + 1 == len(self.levels):
+            self.levels.append([])
+            self.sizes.append(0)
+        self.levels[level + 1].append(promoted)
+        self.sizes[level + 1] += len(promoted)
+
+    def quantile(self, q):
+        """
+        Value at quantile q, NaN when nothing was added. Exact before the first compaction,
+        where the median of an even count is the mean of the two middle values like pandas.
+        """
+        if self.exact:
+            values = np.concatenate(self.levels[0]) if self.levels[0] else np.empty(0)
+            return float(np.quantile(values, q)) if len(values) else float('nan')
+
+        values = np.concatenate([np.concatenate(level) for level in self.levels if level])
+        weights = np.concatenate([np.full(self.sizes[h], 2.0 ** h) for h, level in enumerate(self.levels) if level])
+        order = np.argsort(values, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        return float(values[order][np.searchsorted(cumulative, q * cumulative[-1])])
+
+    def median(self):
+        return self.quantile(0.5)
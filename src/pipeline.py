@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import pickle
+import hashlib
+import argparse
+from dataclasses import dataclass
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from customexcept import CustomException
+from utils import load_config, config_field
+from stage_metrics import stage as stage_metrics, set_profiling
+
+STAGES = ["ingestion", "transformation", "preprocessing", "training"]
+
+# Config sections and source files each stage output depends on
+STAGE_CONFIG = {
+    "ingestion": ["data_ingestion", "data_transformation"],
+    "transformation": ["data_ingestion", "data_transformation", "feature_store"],
+    "preprocessing": ["data_preprocessing", "imbalance", "feature_store"],
+    "training": ["model_training", "imbalance", "pipeline"],
+}
+
+STAGE_SOURCES = {
+    "ingestion": ["data_ingestion.py", "utils.py", "stage_metrics.py"],
+    "transformation": ["data_transformation.py", "online_stats.py", "feature_store.py", "utils.py", "stage_metrics.py"],
+    "preprocessing": ["data_preprocessing.py", "imbalance.py", "model_bundle.py", "feature_store.py", "utils.py", "stage_metrics.py"],
+    "training": ["model_training.py", "data_preprocessing.py", "imbalance.py", "model_bundle.py", "utils.py", "stage_metrics.py"],
+}
+
+@dataclass
+class PipelineConfig:
+    cache_path: str = config_field('pipeline', 'cache_path')
+    model_name: str = config_field('pipeline', 'model_name')
+    bundle_name: str = config_field('pipeline', 'bundle_name')
+
+
+class Pipeline:
+    def __init__(self, use_cache=True):
+        self.pipeline_config = PipelineConfig()
+        self.use_cache = use_cache
+
+    @staticmethod
+    def code_version(stage):
+        """
+        This function hash the source files of a stage, editing them invalidates its cache.
+        """
+        sha = hashlib.sha256()
+        for name in STAGE_SOURCES[stage]:
+            with open(os.path.join(current_dir, name), 'rb') as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    def stage_key(self, stage, input_key):
+        """
+        This function compute the cache key of a stage from the key of its input,
+        its config sections and its code version.
+
+        Args:
+        stage (str): stage name
+        input_key (str): key of the upstream stage, or hash of the source files for ingestion
+
+        return
+            str
+        """
+        config = {section: load_config(section) for section in STAGE_CONFIG[stage]}
+        payload = json.dumps({
+            "stage": stage,
+            "input": input_key,
+            "config": config,
+            "code": self.code_version(stage),
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def cache_file(self, stage, key):
+        return os.path.join(self.pipeline_config.cache_path, stage, f"{key}.pkl")
+
+    def load_cached(self, stage, key):
+        path = self.cache_file(stage, key)
+        if not os.path.exists(path):
+            return None
+        logging.info(f"Loading {stage} output from cache {key[:12]}")
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def save_cached(self, stage, key, output):
+        path = self.cache_file(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def source_key(self, download):
+        """
+        This function hash the source databases, downloading them first when asked to.
+        """
+        from data_ingestion import DataIngestion
+
+        ingestion = DataIngestion()
+        if download:
+            ingestion.reading_from_db()
+
+        config = ingestion.ingestion_config
+        sha = hashlib.sha256()
+        for path in [config.weather_db_path, config.air_quality_db_path]:
+            sha.update(DataIngestion._file_sha256(path, config.download_chunk_size).digest())
+        return sha.hexdigest()
+
+    def run_stage(self, stage, data):
+        """
+        This function run one stage on the output of the previous one, through the same methods as the stage scripts.
+
+        Ingestion hands the tables over in memory on a full read, with incremental set the transformation
+        reads the raw partitions it wrote instead. With streaming set, final_data is written chunk by chunk
+        and preprocessing reads it back from disk.
+        """
+        if stage == "ingestion":
+            from data_ingestion import DataIngestion
+            from data_transformation import DataTransformationConfig
+            # Transformation reads the source databases itself
+            if DataTransformationConfig().sqlite_pushdown:
+                return None
+            return DataIngestion().reading_dataframe_from_path()
+
+        if stage == "transformation":
+            from data_transformation import DataTransformation
+            transformation = DataTransformation()
+            config = transformation.transform_config
+            # Tables read in full by ingestion, None when they are in the raw store or the databases
+            frames = data if isinstance(data, dict) and not config.incremental else {}
+            if config.partitioned and not config.sqlite_pushdown:
+                return transformation.transform_partitioned(frames.get("weather"), frames.get("air_quality"))
+            df = transformation.drop_duplicates_merge(frames.get("weather"), frames.get("air_quality"))
+            if config.streaming:
+                return transformation.cleaning_formatting_stream()
+            return transformation.cleaning_formatting_value(df)
+
+        if stage == "preprocessing":
+            from data_preprocessing import DataPreprocessing
+            preprocessing = DataPreprocessing()
+            # Training rows are read point in time from the feature store the transformation wrote to,
+            # and from final_data when the streaming transformation returned its report
+            if preprocessing.preprocess_config.feature_store or isinstance(data, dict):
+                split = preprocessing.scale_data()
+            else:
+                split = preprocessing.scale_data(data)
+            # The fitted pipeline goes with the split, training bundles it with the model
+            return {"split": split, "preprocessing": preprocessing.pipeline,
+                    "schema": preprocessing.schema, "data_hash": preprocessing.data_hash}
+
+        from model_training import ModelTrainer
+        from model_bundle import save_bundle
+        trainer = ModelTrainer()
+        model = trainer.train_model(self.pipeline_config.model_name, data["split"], headless=True)
+        bundle = trainer.make_bundle(model, data["preprocessing"], data["schema"], data["data_hash"])
+        save_bundle(bundle, self.pipeline_config.bundle_name)
+        return bundle
+
+    def run(self, start=STAGES[0], until=STAGES[-1]):
+        """
+        This function run the stages from start to until in one process, handing each output to the next stage in memory.
+
+        A stage is only computed when no cached output exists for its key. Stages before start are
+        never computed, their output has to be in the cache already.
+
+        Args:
+        start (str): first stage to run
+        until (str): last stage to run
+
+        return
+            dict : output of every stage that was run or loaded
+        """
+        try:
+            first, last = STAGES.index(start), STAGES.index(until)
+            if first > last:
+                raise ValueError(f"--from {start} comes after --until {until}")
+
+            key = self.source_key(download=first == 0)
+            data = None
+            outputs = {}
+
+            for index, stage in enumerate(STAGES[:last + 1]):
+                key = self.stage_key(stage, key)
+                # A stage can output None, so the cache file tells a hit from a miss
+                if (self.use_cache or index < first) and os.path.exists(self.cache_file(stage, key)):
+                    data = self.load_cached(stage, key)
+                elif index < first:
+                    raise ValueError(f"No cached output for {stage}, run the pipeline from {stage} first")
+                else:
+                    logging.info(f"Running {stage} ({key[:12]})")
+                    print(f"Running {stage} .....")
+                    with stage_metrics(f"pipeline_{stage}"):
+                        data = self.run_stage(stage, data)
+                    self.save_cached(stage, key, data)
+
+                outputs[stage] = data
+
+            return outputs
+
+        except Exception as e:
+            logging.error(f"Pipeline failed : {e}")
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline stages in one process")
+    parser.add_argument("--from", dest="start", choices=STAGES, default=STAGES[0])
+    parser.add_argument("--until", choices=STAGES, default=STAGES[-1])
+    parser.add_argument("--no-cache", action="store_true", help="recompute every selected stage")
+    parser.add_argument("--profile", action="store_true", help="run every stage under cProfile, stats in metrics.profile_path")
+    args = parser.parse_args()
+
+    if args.profile:
+        set_profiling(True)
+
+    Pipeline(use_cache=not args.no_cache).run(args.start, args.until)
@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import argparse
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from customexcept import CustomException
+from utils import config_field
+from model_bundle import load_bundle
+from tree_runtime import TreeEnsemble, is_tree_model
+
+@dataclass
+class PredictionServiceConfig:
+    host: str = config_field('prediction_service', 'host')
+    port: int = config_field('prediction_service', 'port')
+    model_name: str = config_field('prediction_service', 'model_name')
+    max_batch_size: int = config_field('prediction_service', 'max_batch_size')
+    max_wait_ms: float = config_field('prediction_service', 'max_wait_ms')
+    flatten_trees: bool = config_field('prediction_service', 'flatten_trees')
+
+
+class PredictionServer(ThreadingHTTPServer):
+    # Concurrent clients queue up on the listen backlog, the default of 5 resets connections
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class PendingRequest:
+    def __init__(self, records):
+        self.records = records
+        self.start = time.perf_counter()
+        self.done = threading.Event()
+        self.predictions = None
+        self.error = None
+
+
+class ServiceMetrics:
+    """
+    Latency of the last requests and throughput since startup.
+    """
+    def __init__(self, window=10_000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.records = 0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def record_batch(self, pending, n_records):
+        now = time.perf_counter()
+        with self.lock:
+            self.batch_sizes.append(n_records)
+            self.records += n_records
+            self.requests += len(pending)
+            self.latencies.extend(now - request.start for request in pending)
+
+    def snapshot(self):
+        import numpy as np
+
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            uptime = time.perf_counter() - self.started
+            return {
+                "requests": self.requests,
+                "records": self.records,
+                "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+                "requests_per_s": self.requests / uptime,
+                "records_per_s": self.records / uptime,
+                "mean_batch_records": float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+                "uptime_s": uptime,
+            }
+
+
+class PredictionService:
+    def __init__(self, model_name=None):
+        self.service_config = PredictionServiceConfig()
+        self.model_name = model_name or self.service_config.model_name
+        self.metrics = ServiceMetrics()
+        self.requests = queue.Queue()
+        self.bundle = None
+        self.feature_store = None
+        # Handler threads open the feature store once between them
+        self.store_lock = threading.Lock()
+
+    def load(self):
+        """
+        This function load the model bundle saved by model_bundle.save_bundle.
+
+        With flatten_trees, tree models are replaced by a tree_runtime.TreeEnsemble, which gives
+        the same predictions with a much lower latency on small batches.
+        """
+        self.bundle = load_bundle(self.model_name)
+        if self.service_config.flatten_trees and is_tree_model(self.bundle.model):
+            self.bundle.model = TreeEnsemble.from_model(self.bundle.model)
+            logging.info(f"Flattened {self.bundle.model.n_trees} trees of {self.model_name}")
+        logging.info(f"Prediction service loaded {self.model_name} ({self.bundle.metadata.get('created_at')})")
+
+    def predict_batch(self, records):
+        """
+        This function transform and predict a list of records in one vectorized call.
+
+        Args:
+        records (list): dicts with the feature columns written to final_data
+
+        return
+            list : predicted class per record
+        """
+        import pandas as pd
+
+        return self.bundle.predict(pd.DataFrame.from_records(records)).tolist()
+
+    def day_records(self, day, as_of=None, site=None):
+        """
+        This function fetch the rows of one day from the feature store as records, the store is opened on first use.
+        """
+        with self.store_lock:
+            if self.feature_store is None:
+                from feature_store import FeatureStore
+                self.feature_store = FeatureStore()
+        df = self.feature_store.get_day(day, as_of, site)
+        if df.empty:
+            raise ValueError(f"No features stored for {day}")
+        return df.to_dict("records")
+
+    def batch_worker(self):
+        """
+        This function collect pending requests until max_batch_size records are queued or max_wait_ms
+        has passed since the first one, then predict them together.
+        """
+        max_wait = self.service_config.max_wait_ms / 1000
+        while True:
+            pending = [self.requests.get()]
+            try:
+                n_records = len(pending[0].records)
+                deadline = time.perf_counter() + max_wait
+
+                while n_records < self.service_config.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        request = self.requests.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    pending.append(request)
+                    n_records += len(request.records)
+
+                records = [record for request in pending for record in request.records]
+                try:
+                    predictions = self.predict_batch(records)
+                    offset = 0
+                    for request in pending:
+                        request.predictions = predictions[offset:offset + len(request.records)]
+                        offset += len(request.records)
+                except Exception as e:
+                    # One malformed request should not fail the others, retry them one by one
+                    logging.warning(f"Batch prediction failed, predicting requests separately : {e}")
+                    for request in pending:
+                        try:
+                            request.predictions = self.predict_batch(request.records)
+                        except Exception as request_error:
+                            request.error = str(request_error)
+
+                self.metrics.record_batch(pending, n_records)
+            except Exception as e:
+                # The worker serves every later request, it must never die on a bad one
+                logging.error(f"Batch worker failed : {e}")
+                for request in pending:
+                    if request.predictions is None and request.error is None:
+                        request.error = str(e)
+            finally:
+                for request in pending:
+                    request.done.set()
+
+    def submit(self, records, timeout=30):
+        """
+        This function queue records for the next micro-batch and wait for their predictions.
+        """
+        request = PendingRequest(records)
+        self.requests.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("Prediction timed out")
+        if request.error:
+            raise ValueError(request.error)
+        return request.predictions
+
+    def make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    self.send_json(200, {"status": "ok", "model": service.model_name, "version": service.bundle.metadata})
+                elif self.path == "/metrics":
+                    self.send_json(200, service.metrics.snapshot())
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                if self.path != "/predict":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                    if isinstance(body, dict) and "date" in body:
+                        records = service.day_records(body["date"], body.get("as_of"), body.get("site"))
+                    else:
+                        records = body["records"] if isinstance(body, dict) and "records" in body else body
+                    if isinstance(records, dict):
+                        records = [records]
+                    if not isinstance(records, list) or not records or not all(isinstance(record, dict) for record in records):
+                        raise ValueError("Expected a record or a non-empty list of records")
+                    self.send_json(200, {"predictions": service.submit(records)})
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send_json(400, {"error": str(e)})
+                except TimeoutError as e:
+                    self.send_json(503, {"error": str(e)})
+                except Exception as e:
+                    # Feature store and model failures still get an answer
+                    logging.error(f"Prediction request failed : {e}")
+                    self.send_json(500, {"error": str(e)})
+
+        return Handler
+
+    def create_server(self, host=None, port=None):
+        """
+        This function load the model, start the batch worker and return the HTTP server, not yet serving.
+
+        Endpoints:
+            POST /predict : {"records": [...]} or a single record, returns {"predictions": [...]}
+                            or {"date": ...} to predict the rows of a day of the feature store
+            GET /metrics : latency percentiles and throughput
+            GET /health
+        """
+        try:
+            self.load()
+            threading.Thread(target=self.batch_worker, daemon=True).start()
+            host = host or self.service_config.host
+            port = self.service_config.port if port is None else port
+            return PredictionServer((host, port), self.make_handler())
+
+        except Exception as e:
+            logging.error(f"Unable to start prediction service : {e}")
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve predictions of a saved model over HTTP")
+    parser.add_argument("--model", help="name given to save_bundle, defaults to prediction_service.model_name")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    args = parser.parse_args()
+
+    server = PredictionService(args.model).create_server(args.host, args.port)
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import itertools
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from utils import config_field
+
+# Prometheus metric per field of a stage record
+PROMETHEUS_GAUGES = {
+    "wall_time_s": ("solar_stage_wall_seconds", "Wall time of the last run of the stage"),
+    "cpu_time_s": ("solar_stage_cpu_seconds", "CPU time of the last run of the stage"),
+    "rows_in": ("solar_stage_rows_in", "Rows read by the last run of the stage"),
+    "rows_out": ("solar_stage_rows_out", "Rows produced by the last run of the stage"),
+    "rows_per_s": ("solar_stage_rows_per_second", "Input rows per second of the last run of the stage"),
+    "peak_rss_mb": ("solar_stage_peak_rss_megabytes", "Peak resident memory during the last run of the stage"),
+}
+
+@dataclass
+class StageMetricsConfig:
+    enabled: bool = config_field('metrics', 'enabled')
+    jsonl_path: str = config_field('metrics', 'jsonl_path')
+    prometheus_path: str = config_field('metrics', 'prometheus_path')
+    state_path: str = config_field('metrics', 'state_path')
+    profile: bool = config_field('metrics', 'profile')
+    profile_path: str = config_field('metrics', 'profile_path')
+
+
+@dataclass
+class StageRecord:
+    stage: str
+    rows_in: int = None
+    rows_out: int = None
+    status: str = "ok"
+    # Peak seen before nested stages reset the high-water mark of the process, and theirs
+    inner_peak_mb: float = 0.0
+    # Thread running the stage, and whether a stage of another thread ran at the same time
+    thread: int = None
+    shared: bool = False
+    extra: dict = field(default_factory=dict)
+
+
+_local = threading.local()
+# Stages of several threads export one at a time
+_export_lock = threading.Lock()
+# Running stages of every thread, the high-water mark is only reset when no other thread is in a stage
+_active_records = []
+_active_lock = threading.Lock()
+# Set by set_profiling, overrides metrics.profile
+_profiling = None
+RUN_ID = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+_profile_count = itertools.count()
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+def _reset_peak_rss():
+    """
+    Reset the resident memory high-water mark of the process (Linux 4.0+), False when not possible.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # Peak of the whole process when the high-water mark cannot be read
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _count_rows(value):
+    """
+    Rows of a dataframe, series or array, None for anything else.
+    """
+    shape = getattr(value, "shape", None)
+    if shape:
+        return int(shape[0])
+    return None
+
+def set_profiling(enabled):
+    """
+    Turn cProfile on or off for every stage of the process, overriding metrics.profile.
+    """
+    global _profiling
+    _profiling = enabled
+
+def stage_rows(rows_in=None, rows_out=None):
+    """
+    Record the rows read and produced by the innermost running stage, when they cannot be
+    inferred from its arguments and return value.
+    """
+    stack = _stack()
+    if not stack:
+        return
+    if rows_in is not None:
+        stack[-1].rows_in = int(rows_in)
+    if rows_out is not None:
+        stack[-1].rows_out = int(rows_out)
+
+@contextmanager
+def stage(name):
+    """
+    Measure a pipeline stage : wall and CPU time, rows in / out, rows per second and peak
+    resident memory. The record is appended to metrics.jsonl_path and the Prometheus text file
+    is rewritten. With profiling on, the outermost profiled stage is run under cProfile.
+
+    The peak is the stage's own (peak_rss_scope "stage") when the process high-water mark could be
+    reset for it. It is the process peak ("process") when a stage of another thread, such as the
+    source threads of ingestion or the prediction service handlers, overlapped it.
+
+    Example:
+    >>> with stage("scale_data"):
+    ...     stage_rows(rows_in=len(df))
+    """
+    config = StageMetricsConfig()
+    if not config.enabled:
+        yield StageRecord(name)
+        return
+
+    stack = _stack()
+    record = StageRecord(name)
+    profiler = None
+    profile = config.profile if _profiling is None else _profiling
+    if profile and not any(parent.extra.get("profiled") for parent in stack):
+        import cProfile
+        profiler = cProfile.Profile()
+        record.extra["profiled"] = True
+
+    if stack:
+        stack[-1].inner_peak_mb = max(stack[-1].inner_peak_mb, _peak_rss_mb())
+    stack.append(record)
+    record.thread = threading.get_ident()
+    with _active_lock:
+        # The high-water mark is process wide, resetting it would cut the peak of the stages of other threads
+        others = [active for active in _active_records if active.thread != record.thread]
+        for active in others:
+            active.shared = True
+        record.shared = bool(others)
+        _active_records.append(record)
+        peak_reset = not others and _reset_peak_rss()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    except BaseException:
+        record.status = "error"
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        wall_time, cpu_time = time.perf_counter() - start_wall, time.process_time() - start_cpu
+        peak_mb = max(_peak_rss_mb(), record.inner_peak_mb)
+        stack.pop()
+        with _active_lock:
+            _active_records.remove(record)
+        if stack:
+            stack[-1].inner_peak_mb = max(stack[-1].inner_peak_mb, peak_mb)
+
+        entry = {
+            "run_id": RUN_ID,
+            "stage": name,
+            "status": record.status,
+            "finished_at": time.time(),
+            "wall_time_s": wall_time,
+            "cpu_time_s": cpu_time,
+            "rows_in": record.rows_in,
+            "rows_out": record.rows_out,
+            "rows_per_s": record.rows_in / wall_time if record.rows_in is not None and wall_time > 0 else None,
+            "peak_rss_mb": peak_mb,
+            "peak_rss_scope": "stage" if peak_reset and not record.shared else "process",
+        }
+        if profiler:
+            entry["profile"] = write_profile(profiler, name, config.profile_path)
+        export(entry, config)
+
+def track_stage(name):
+    """
+    Decorator running a function as a stage. Rows in default to the rows of the first
+    dataframe / array argument, rows out to the rows of the return value.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                for value in list(args) + list(kwargs.values()):
+                    rows = _count_rows(value)
+                    if rows is not None:
+                        record.rows_in = rows
+                        break
+                result = func(*args, **kwargs)
+                if record.rows_out is None:
+                    record.rows_out = _count_rows(result)
+                return result
+        return wrapper
+    return decorator
+
+def write_profile(profiler, name, profile_path):
+    """
+    This function write the cProfile stats of a stage to profile_path : <stage>_<run>_<n>.prof, to open
+    with snakeviz or flameprof, and the 40 slowest functions by cumulative time in a .txt.
+
+    return
+        str : path of the .prof file
+    """
+    import io
+    import pstats
+
+    os.makedirs(profile_path, exist_ok=True)
+    path = os.path.join(profile_path, f"{name}_{RUN_ID}_{next(_profile_count)}.prof")
+    profiler.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+    with open(os.path.splitext(path)[0] + ".txt", "w") as f:
+        f.write(summary.getvalue())
+    return path
+
+def load_state(config):
+    """
+    This function read the last record of every stage and the runs per stage and status from state_path.
+
+    The state is built from jsonl_path once when state_path does not exist yet, then kept up to date by
+    export, so a stage exit never reads the whole history.
+
+    return
+        dict, dict : last record per stage, runs per (stage, status)
+    """
+    last, runs = {}, {}
+    if os.path.exists(config.state_path):
+        try:
+            with open(config.state_path, "r") as f:
+                state = json.load(f)
+            return state["last"], {tuple(key.split("\t")): count for key, count in state["runs"].items()}
+        except (ValueError, KeyError):
+            logging.warning(f"Unreadable {config.state_path}, rebuilt from {config.jsonl_path}")
+
+    if os.path.exists(config.jsonl_path):
+        with open(config.jsonl_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                last[record["stage"]] = record
+                runs[(record["stage"], record["status"])] = runs.get((record["stage"], record["status"]), 0) + 1
+    return last, runs
+
+def save_state(last, runs, config):
+    os.makedirs(os.path.dirname(config.state_path) or ".", exist_ok=True)
+    tmp_path = config.state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"last": last, "runs": {"\t".join(key): count for key, count in runs.items()}}, f)
+    os.replace(tmp_path, config.state_path)
+
+def export(entry, config):
+    """
+    This function append a stage record to jsonl_path and rewrite prometheus_path from the
+    last record of every stage and the number of runs per stage and status, kept in state_path.
+    """
+    try:
+        logging.info(f"Stage {entry['stage']} {entry['status']} in {entry['wall_time_s']:.3f}s, "
+                     f"rows {entry['rows_in']} -> {entry['rows_out']}, peak {entry['peak_rss_mb']:.0f} MB")
+        with _export_lock:
+            last, runs = load_state(config)
+            os.makedirs(os.path.dirname(config.jsonl_path) or ".", exist_ok=True)
+            with open(config.jsonl_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+            last[entry["stage"]] = entry
+            runs[(entry["stage"], entry["status"])] = runs.get((entry["stage"], entry["status"]), 0) + 1
+            save_state(last, runs, config)
+
+            lines = []
+            for key, (metric, help_text) in PROMETHEUS_GAUGES.items():
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+                lines += [f'{metric}{{stage="{stage_name}"}} {record[key]}'
+                          for stage_name, record in sorted(last.items()) if record.get(key) is not None]
+            lines += ["# HELP solar_stage_runs_total Runs of the stage by status", "# TYPE solar_stage_runs_total counter"]
+            lines += [f'solar_stage_runs_total{{stage="{stage_name}",status="{status}"}} {count}'
+                      for (stage_name, status), count in sorted(runs.items())]
+
+            # Written aside and renamed, a textfile collector never reads half a file
+            os.makedirs(os.path.dirname(config.prometheus_path) or ".", exist_ok=True)
+            tmp_path = config.prometheus_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, config.prometheus_path)
+
+    except OSError as e:
+        # Metrics never fail a stage
+        logging.warning(f"Fail to export stage metrics : {e}")
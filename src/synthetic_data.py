@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+from datetime import date, timedelta
+from dataclasses import dataclass
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+from logger import logging
+from customexcept import CustomException
+from utils import config_field
+from data_transformation import DataTransformation, DEW_POINT_ALIASES, WIND_DIRECTION_ALIASES
+
+import numpy as np
+import pandas as pd
+
+# Bumped whenever the generated data changes, older databases are generated again
+SYNTHETIC_VERSION = 1
+
+# Text columns of the weather table, mean of their values
+WEATHER_TEXT_COLUMNS = {
+    'Daily Rainfall Total (mm)': 6.0,
+    'Highest 30 Min Rainfall (mm)': 3.0,
+    'Highest 60 Min Rainfall (mm)': 4.0,
+    'Highest 120 Min Rainfall (mm)': 5.0,
+    'Min Temperature (deg C)': 26.0,
+    'Maximum Temperature (deg C)': 31.5,
+    'Min Wind Speed (km/h)': 6.0,
+    'Max Wind Speed (km/h)': 30.0,
+}
+REGIONS = ['north', 'south', 'east', 'west', 'central']
+EFFICIENCY_LABELS = ['Low', 'Medium', 'High']
+LAST_DATE = date(9999, 12, 31)
+
+
+@dataclass
+class SyntheticDataConfig:
+    output_path: str = config_field('synthetic_data', 'output_path')
+    base_days: int = config_field('synthetic_data', 'base_days')
+    chunk_days: int = config_field('synthetic_data', 'chunk_days')
+    start_date: str = config_field('synthetic_data', 'start_date')
+    seed: int = config_field('synthetic_data', 'seed')
+    duplicate_rate: float = config_field('synthetic_data', 'duplicate_rate')
+    split_rate: float = config_field('synthetic_data', 'split_rate')
+    placeholder_rate: float = config_field('synthetic_data', 'placeholder_rate')
+    sources: dict = config_field('data_ingestion', 'sources')
+
+
+class SyntheticData:
+    """
+    Seeded generator of weather and air_quality databases with the schemas and the defects of the source
+    tables : exact duplicate rows, air_quality readings split over two rows sharing a data_ref,
+    '-' / '--' placeholders in the text columns and the label variants of DEW_POINT_ALIASES and
+    WIND_DIRECTION_ALIASES.
+
+    Scale 1 is base_days days, one weather and one air_quality reading per day. Days are generated
+    and appended chunk_days at a time, each chunk from its own seed, so memory does not grow with
+    the scale.
+    """
+    def __init__(self):
+        self.synthetic_config = SyntheticDataConfig()
+
+    @staticmethod
+    def data_refs(rng, n):
+        # Random uuid4 like strings, as in the source tables
+        digits = rng.bytes(16 * n).hex()
+        return [f"{digits[i:i + 8]}-{digits[i + 8:i + 12]}-4{digits[i + 13:i + 16]}-"
+                f"{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}" for i in range(0, 32 * n, 32)]
+
+    def as_text(self, rng, values):
+        """
+        This function format values as text with one decimal and replace placeholder_rate of them by '-' or '--'.
+        """
+        text = np.round(values, 1).astype(str).astype(object)
+        placeholders = rng.random(len(text)) < self.synthetic_config.placeholder_rate
+        text[placeholders] = rng.choice(['-', '--'], placeholders.sum())
+        return text
+
+    def weather_chunk(self, rng, dates):
+        """
+        This function create the weather rows of dates, before duplication.
+
+        The efficiency label follows sunshine, cloud cover and rainfall with noise, so models have something to learn.
+
+        return
+            pd.DataFrame
+        """
+        n = len(dates)
+        df = pd.DataFrame({'data_ref': self.data_refs(rng, n), 'date': dates})
+
+        rainfall = rng.gamma(0.6, 10.0, n) * (rng.random(n) < 0.6)
+        for column, mean in WEATHER_TEXT_COLUMNS.items():
+            if 'Rainfall' in column:
+                values = rainfall * mean / WEATHER_TEXT_COLUMNS['Daily Rainfall Total (mm)']
+            else:
+                values = np.abs(rng.normal(mean, mean / 8, n))
+            df[column] = self.as_text(rng, values)
+
+        sunshine = np.clip(rng.normal(6.5, 2.5, n), 0.1, 12.0)
+        cloud = np.clip(rng.normal(60.0, 15.0, n) - 3.0 * (sunshine - 6.5), 1.0, 100.0)
+        df['Sunshine Duration (hrs)'] = sunshine.round(1)
+        df['Cloud Cover (%)'] = cloud.round(0)
+        df['Wet Bulb Temperature (deg F)'] = rng.normal(78.0, 2.0, n).round(1)
+        df['Relative Humidity (%)'] = np.clip(rng.normal(80.0, 8.0, n), 30.0, 100.0).round(1)
+        df['Air Pressure (hPa)'] = rng.normal(1009.0, 2.0, n).round(1)
+        df['Dew Point Category'] = rng.choice(list(DEW_POINT_ALIASES), n)
+        df['Wind Direction'] = rng.choice(list(WIND_DIRECTION_ALIASES), n)
+
+        score = sunshine / 2.5 - cloud / 25.0 - np.log1p(rainfall) / 2.0 + rng.normal(0.0, 0.5, n)
+        df['Daily Solar Panel Efficiency'] = np.array(EFFICIENCY_LABELS)[np.digitize(score, [-1.0, 1.2])]
+        return df
+
+    def air_quality_chunk(self, rng, dates):
+        """
+        This function create the air_quality rows of dates, before duplication. split_rate of the days
+        have their pm25 and psi readings on two rows sharing a data_ref, with placeholders where
+        the other row holds the reading.
+
+        return
+            pd.DataFrame
+        """
+        n = len(dates)
+        df = pd.DataFrame({'data_ref': self.data_refs(rng, n), 'date': dates})
+        level = rng.lognormal(0.0, 0.3, n)
+        for region in REGIONS:
+            df[f'pm25_{region}'] = self.as_text(rng, level * rng.normal(18.0, 3.0, n))
+        for region in REGIONS:
+            df[f'psi_{region}'] = self.as_text(rng, level * rng.normal(50.0, 8.0, n))
+
+        split = rng.random(n) < self.synthetic_config.split_rate
+        pm25_rows, psi_rows = df[split].copy(), df[split].copy()
+        for region in REGIONS:
+            pm25_rows[f'psi_{region}'] = rng.choice(['-', '--'], len(pm25_rows))
+            psi_rows[f'pm25_{region}'] = rng.choice(['-', '--'], len(psi_rows))
+        return pd.concat([df[~split], pm25_rows, psi_rows], ignore_index=True)
+
+    def with_duplicates(self, rng, df):
+        """
+        This function append exact copies of duplicate_rate of the rows and shuffle the rows.
+        """
+        duplicates = df[rng.random(len(df)) < self.synthetic_config.duplicate_rate]
+        df = pd.concat([df, duplicates], ignore_index=True)
+        return df.iloc[rng.permutation(len(df))]
+
+    def dates(self, n_days):
+        """
+        This function return the first of n_days consecutive days, start_date unless the last one
+        would come after 9999-12-31.
+        """
+        start = date.fromisoformat(self.synthetic_config.start_date)
+        return min(start, LAST_DATE - timedelta(days=n_days - 1))
+
+    def output_dir(self, scale, seed):
+        return os.path.join(self.synthetic_config.output_path, f"seed{seed}_{scale:g}x")
+
+    def generate(self, scale=1, out_dir=None, seed=None, force=False):
+        """
+        This function write the weather and air_quality databases of a scale factor.
+
+        The databases are written aside and renamed once complete, with a manifest.json describing
+        them. Databases already generated with the same settings are reused unless force is set.
+
+        Args:
+        scale (float): multiple of base_days to generate, 1 to 1000 and beyond
+        out_dir (str): folder of the databases, output_path/seed<seed>_<scale>x when not given
+        seed (int): seed of the data, synthetic_data.seed when not given
+        force (bool): generate the databases even if they exist
+
+        return
+            dict : manifest, with the path of the database of every source
+        """
+        try:
+            config = self.synthetic_config
+            seed = config.seed if seed is None else seed
+            out_dir = out_dir or self.output_dir(scale, seed)
+            n_days = max(1, int(round(config.base_days * scale)))
+            settings = {
+                "version": SYNTHETIC_VERSION, "seed": seed, "days": n_days, "chunk_days": config.chunk_days,
+                "duplicate_rate": config.duplicate_rate,
+                "split_rate": config.split_rate, "placeholder_rate": config.placeholder_rate,
+                "start_date": config.start_date,
+            }
+
+            manifest_path = os.path.join(out_dir, "manifest.json")
+            if not force and os.path.exists(manifest_path):
+                with open(manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                if manifest["settings"] == settings and all(os.path.exists(path) for path in manifest["paths"].values()):
+                    logging.info(f"Synthetic data of {n_days} days already in {out_dir}")
+                    return manifest
+
+            os.makedirs(out_dir, exist_ok=True)
+            paths = {name: os.path.join(out_dir, os.path.basename(source["db_path"]))
+                     for name, source in config.sources.items()}
+            chunk_funcs = {"weather": self.weather_chunk, "air_quality": self.air_quality_chunk}
+            for name in paths:
+                if name not in chunk_funcs:
+                    raise ValueError(f"No generator for source {name}")
+                if os.path.exists(paths[name] + ".tmp"):
+                    os.remove(paths[name] + ".tmp")
+
+            start = self.dates(n_days)
+            chunk_days = config.chunk_days
+            # One seed per chunk and source, chunks are independent of each other
+            chunk_seeds = np.random.SeedSequence(seed).spawn((n_days + chunk_days - 1) // chunk_days)
+            rows = dict.fromkeys(paths, 0)
+            connections = {name: sqlite3.connect(path + ".tmp") for name, path in paths.items()}
+            try:
+                for index, chunk_seed in enumerate(chunk_seeds):
+                    first = index * chunk_days
+                    days = pd.date_range(start + timedelta(days=first), periods=min(chunk_days, n_days - first),
+                                         freq='D', unit='s')
+                    dates = days.strftime(DataTransformation.DATE_FORMAT)
+                    for source_seed, (name, conn) in zip(chunk_seed.spawn(len(paths)), connections.items()):
+                        rng = np.random.default_rng(source_seed)
+                        df = self.with_duplicates(rng, chunk_funcs[name](rng, dates))
+                        df.to_sql(config.sources[name]["table"], conn, if_exists='append', index=False)
+                        rows[name] += len(df)
+                    for conn in connections.values():
+                        conn.commit()
+                    logging.info(f"Synthetic chunk {index + 1}/{len(chunk_seeds)} written")
+            finally:
+                for conn in connections.values():
+                    conn.close()
+            for path in paths.values():
+                os.replace(path + ".tmp", path)
+
+            manifest = {"settings": settings, "scale": scale, "rows": rows, "paths": paths,
+                        "first_date": str(start), "last_date": str(start + timedelta(days=n_days - 1))}
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=4)
+            logging.info(f"Synthetic data of {n_days} days written to {out_dir} : {rows}")
+            return manifest
+
+        except Exception as e:
+            logging.error(f"Fail to generate synthetic data : {e}")
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic weather and air_quality databases")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1], help="multiples of synthetic_data.base_days")
+    parser.add_argument("--seed", type=int, help="defaults to synthetic_data.seed")
+    parser.add_argument("--out", help="folder of the databases, only with a single scale")
+    parser.add_argument("--force", action="store_true", help="generate again even if the databases exist")
+    args = parser.parse_args()
+
+    if args.out and len(args.scales) > 1:
+        parser.error("--out takes a single scale")
+    generator = SyntheticData()
+    for scale in args.scales:
+        manifest = generator.generate(scale, args.out, args.seed, args.force)
+        print(f"{scale:g}x : {manifest['rows']} rows, {manifest['first_date']} to {manifest['last_date']}, "
+              f"in {os.path.dirname(next(iter(manifest['paths'].values())))}")
@@ -0,0 +1,224 @@
+import os
+import json
+import numpy as np
+
+# Bumped whenever the layout of the exported file changes
+TREE_FORMAT_VERSION = 1
+
+ARRAYS = ["feature", "threshold", "first_child", "missing_left", "is_leaf", "proba", "roots"]
+
+
+def _tree_estimators(model):
+    """
+    Decision trees of a fitted model with the input columns each one was trained on.
+    """
+    name = type(model).__name__
+    if hasattr(model, "tree_"):
+        return [(model, None)]
+    if name in ("RandomForestClassifier", "ExtraTreesClassifier"):
+        return [(tree, None) for tree in model.estimators_]
+    if name in ("BaggingClassifier", "BalancedBaggingClassifier"):
+        trees = []
+        for estimator, features in zip(model.estimators_, model.estimators_features_):
+            # imblearn fits a sampler + classifier pipeline per bag, only the classifier predicts
+            estimator = estimator[-1] if hasattr(estimator, "steps") else estimator
+            if not hasattr(estimator, "tree_"):
+                raise ValueError(f"Bagged {type(estimator).__name__} is not a decision tree")
+            if len(estimator.classes_) != len(model.classes_):
+                raise ValueError("Bags that did not see every class are not supported")
+            trees.append((estimator, features))
+        return trees
+    raise ValueError(f"{name} is not a tree model")
+
+
+def is_tree_model(model):
+    try:
+        _tree_estimators(model)
+        return True
+    except (ValueError, AttributeError):
+        return False
+
+
+class TreeEnsemble:
+    """
+    Trees of a fitted DecisionTree, RandomForest or bagged trees flattened into packed node arrays.
+
+    Nodes of all trees are laid out level by level, tree after tree within a level, and the two
+    children of a node are next to each other. A batch walks all trees at once : every step reads
+    the split feature and threshold of the current nodes and moves to first_child + (x > threshold).
+    Leaves point to themselves, and rows that reached one are dropped every few steps.
+
+    Thresholds are stored as float32 rounded down, for float32 rows x > threshold gives the same
+    answer as sklearn's float64 comparison. Probabilities are normalized and summed in estimator
+    order as sklearn does, so predict and predict_proba are identical to the model's.
+
+    predict / predict_proba / classes_ follow sklearn, so an ensemble can be the model of a ModelBundle.
+    """
+    # Steps between two removals of the rows that reached a leaf
+    COMPACT_EVERY = 4
+
+    def __init__(self, feature, threshold, first_child, missing_left, is_leaf, proba, roots, max_depth, classes,
+                 max_nodes_per_step=1 << 18):
+        self.feature = feature
+        self.threshold = threshold
+        self.first_child = first_child
+        self.missing_left = missing_left
+        self.is_leaf = is_leaf
+        self.proba = proba
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = np.asarray(classes)
+        self.max_nodes_per_step = max_nodes_per_step
+
+    @classmethod
+    def from_model(cls, model, **kwargs):
+        """
+        This function flatten the trees of a fitted sklearn / imblearn model.
+
+        Args:
+        model: fitted DecisionTreeClassifier, RandomForestClassifier, ExtraTreesClassifier or
+            (Balanced)BaggingClassifier of decision trees
+
+        return
+            TreeEnsemble
+        """
+        feature, threshold, children, missing_left, is_leaf, proba, roots = [], [], [], [], [], [], []
+        offset, max_depth = 0, 0
+        for estimator, features in _tree_estimators(model):
+            tree = estimator.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("Multi-output trees are not supported")
+
+            tree_feature = np.maximum(tree.feature, 0)
+            if features is not None:
+                tree_feature = np.asarray(features)[tree_feature]
+            feature.append(tree_feature)
+            threshold.append(tree.threshold)
+            children.append(np.stack([tree.children_left, tree.children_right], axis=1) + offset)
+            is_leaf.append(tree.children_left == -1)
+            missing = getattr(tree, "missing_go_to_left", None)
+            missing_left.append(np.ones(tree.node_count, dtype=bool) if missing is None else missing.astype(bool))
+
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :estimator.n_classes_]
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba.append(value / normalizer)
+
+            roots.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        feature, threshold, children = np.concatenate(feature), np.concatenate(threshold), np.concatenate(children)
+        missing_left, is_leaf, proba = np.concatenate(missing_left), np.concatenate(is_leaf), np.concatenate(proba)
+        roots = np.array(roots)
+
+        # Level by level, children of the nodes of a level in the order of their parents
+        levels, level = [], roots
+        while len(level):
+            levels.append(level)
+            level = children[level[~is_leaf[level]]].ravel()
+        order = np.concatenate(levels)
+        position = np.empty(offset, dtype=np.intp)
+        position[order] = np.arange(offset)
+
+        is_leaf = is_leaf[order]
+        first_child = np.where(is_leaf, np.arange(offset), position[children[order, 0]])
+        # Largest float32 not above the threshold
+        threshold = threshold[order]
+        threshold32 = threshold.astype(np.float32)
+        above = threshold32 > threshold
+        threshold32[above] = np.nextafter(threshold32[above], np.float32(-np.inf))
+        # Leaves send every row, NaN included, back to themselves
+        threshold32[is_leaf] = np.inf
+        missing_left = missing_left[order] | is_leaf
+
+        return cls(np.where(is_leaf, 0, feature[order]).astype(np.intp), threshold32, first_child.astype(np.intp),
+                   missing_left, is_leaf, proba[order], position[roots], max_depth, model.classes_, **kwargs)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def save(self, path):
+        """
+        Write the node arrays to a .npz file.
+        """
+        spec = {"format_version": TREE_FORMAT_VERSION, "max_depth": int(self.max_depth), "n_trees": self.n_trees}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, spec=np.array(json.dumps(spec)), classes=self.classes_,
+                 **{name: getattr(self, name) for name in ARRAYS})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Read an ensemble written by save.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            spec = json.loads(str(data["spec"]))
+            if spec["format_version"] != TREE_FORMAT_VERSION:
+                raise ValueError(f"Tree format {spec['format_version']} is not supported, expected {TREE_FORMAT_VERSION}")
+            return cls(*(data[name] for name in ARRAYS), spec["max_depth"], data["classes"], **kwargs)
+
+    def leaves(self, X):
+        """
+        This function return the leaf reached by every row in every tree, (trees, rows).
+
+        Args:
+        X (np.ndarray): float32 rows, (rows, features)
+        """
+        n_rows, n_features = X.shape
+        values = X.ravel()
+        has_nan = np.isnan(values).any()
+
+        # One walker per tree and row, tree major
+        node = np.repeat(self.roots, n_rows)
+        offset = np.tile(np.arange(n_rows) * n_features, self.n_trees)
+        walker = np.arange(len(node))
+        leaves = np.empty(len(node), dtype=np.intp)
+        for step in range(1, self.max_depth + 1):
+            x = values.take(offset + self.feature.take(node))
+            go_right = x > self.threshold.take(node)
+            if has_nan:
+                go_right |= np.isnan(x) & ~self.missing_left.take(node)
+            node = self.first_child.take(node) + go_right
+
+            if step % self.COMPACT_EVERY == 0:
+                done = self.is_leaf.take(node)
+                leaves[walker[done]] = node[done]
+                running = ~done
+                walker, node, offset = walker[running], node[running], offset[running]
+                if not len(walker):
+                    break
+        leaves[walker] = node
+        return leaves.reshape(self.n_trees, n_rows)
+
+    def predict_proba(self, X):
+        """
+        This function return the mean class probabilities of the trees for every row.
+
+        Args:
+        X (np.ndarray): preprocessed features, (rows, features)
+
+        return
+            np.ndarray : (rows, classes), columns ordered as classes_
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        # Rows per step so that the walkers of a step stay in cache
+        step = max(1, self.max_nodes_per_step // self.n_trees)
+        out = np.empty((len(X), self.proba.shape[1]))
+        for start in range(0, len(X), step):
+            # Summed tree by tree along the first axis, in estimator order like sklearn
+            out[start:start + step] = self.proba[self.leaves(X[start:start + step])].sum(axis=0)
+        out /= self.n_trees
+        return out
+
+    def predict(self, X):
+        """
+        This function return the class of highest mean probability for every row.
+        """
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
@@ -1,86 +1,400 @@
 import json
-import numpy as np
-import pandas as pd
-import pickle
 import os
+from dataclasses import field
+from functools import lru_cache
 
 from logger import logging
 from customexcept import CustomException
 
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+# Override the config file with SOLAR_CONFIG_PATH and single values with
+# SOLAR_CONFIG__<section>__<key>=<json value>, e.g. SOLAR_CONFIG__data_ingestion__max_workers=4
+CONFIG_ENV_PATH = "SOLAR_CONFIG_PATH"
+CONFIG_ENV_PREFIX = "SOLAR_CONFIG__"
+
+# Required keys and their types per section
+CONFIG_SCHEMA = {
+    "data_preprocessing": {"clean_data.csv": str},
+    "feature_store": {
+        "enabled": bool, "db_path": str, "site": str, "training_start": str, "training_end": str, "as_of": str,
+    },
+    "data_transformation": {
+        "raw_weather_data_path": str, "raw_air_quality_data_path": str, "clean_data_path": str,
+        "merged_data_path": str, "final_data_path": str,
+        "merged_partition_path": str, "downcast_floats": bool,
+        "streaming": bool, "chunk_rows": int, "sketch_capacity": int, "partitioned": bool, "max_workers": int,
+        "partitions_per_worker": int, "sqlite_pushdown": bool,
+    },
+    "data_ingestion": {
+        "db_path": str, "sources": dict, "max_workers": int, "source_timeout": float, "retry_backoff": float,
+        "download_chunk_size": int, "download_retries": int, "download_timeout": float,
+        "raw_partition_path": str, "watermark_path": str, "incremental": bool,
+    },
+    "model_training": {},
+    "leaderboard": {"output_path": str, "max_workers": int},
+    "model_tuning": {
+        "model_name": str, "search": str, "n_candidates": int, "cv": int, "factor": int, "min_samples": int,
+        "scoring": str, "early_stop_margin": float, "random_state": int, "max_workers": int,
+        "cache_path": str, "checkpoint_path": str, "output_path": str, "search_spaces": dict,
+    },
+    "imbalance": {
+        "strategy": str, "k_neighbors": int, "n_estimators": int, "n_jobs": int, "random_state": int, "cache_path": str,
+    },
+    "deep_learning_model": {"models_path": str, "epochs": int, "batch_size": int, "learning_rate": float,
+                            "validation_split": float, "patience": int, "shuffle_buffer": int,
+                            "intra_op_threads": int, "inter_op_threads": int, "random_state": int, "history_path": str,
+                            "export_path": str, "bundle_name": str},
+    "synthetic_data": {"output_path": str, "base_days": int, "chunk_days": int, "start_date": str, "seed": int,
+                       "duplicate_rate": float, "split_rate": float, "placeholder_rate": float},
+    "storage": {"intermediate_format": str, "export_csv": bool, "memory_map": bool},
+    "pipeline": {"cache_path": str, "model_name": str, "bundle_name": str},
+    "prediction_service": {"host": str, "port": int, "model_name": str, "max_batch_size": int, "max_wait_ms": float,
+                           "flatten_trees": bool},
+    "models": {"model_path": str},
+    "metrics": {"enabled": bool, "jsonl_path": str, "prometheus_path": str, "state_path": str, "profile": bool, "profile_path": str},
+}
+
+class FrozenDict(dict):
+    """
+    Read-only dict holding the parsed config, still a dict for json.dumps, pickle and ** unpacking.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("config is read-only, use SOLAR_CONFIG__ environment overrides instead")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _apply_env_overrides(config):
+    for name, raw in os.environ.items():
+        if not name.startswith(CONFIG_ENV_PREFIX):
+            continue
+        keys = name[len(CONFIG_ENV_PREFIX):].split("__")
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = raw
+
+        target = config
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+        logging.info(f"config {'.'.join(keys)} overridden from environment")
+
+def validate_config(config):
+    """
+    Check config against CONFIG_SCHEMA.
+
+    Args:
+    config (dict): parsed config
+
+    Raises:
+    ValueError : listing every missing key and wrong type
+    """
+    errors = []
+    for section, keys in CONFIG_SCHEMA.items():
+        if not isinstance(config.get(section), dict):
+            errors.append(f"missing section {section}")
+            continue
+        for key, expected in keys.items():
+            if key not in config[section]:
+                errors.append(f"missing {section}.{key}")
+                continue
+            value = config[section][key]
+            # ints are valid floats, bools are not valid numbers
+            allowed = (int, float) if expected is float else expected
+            if not isinstance(value, allowed) or (expected is not bool and isinstance(value, bool)):
+                errors.append(f"{section}.{key} should be {expected.__name__}, got {type(value).__name__}")
+    if errors:
+        raise ValueError("Invalid config : " + "; ".join(errors))
+
+@lru_cache(maxsize=None)
+def get_config():
+    """
+    Parse, override and validate config.json once per process.
+
+    The file is resolved next to this module unless SOLAR_CONFIG_PATH is set, so it does not depend
+    on the working directory. Call get_config.cache_clear() to read it again.
+
+    Returns : 
+    FrozenDict : read-only config
+    """
+    path = os.environ.get(CONFIG_ENV_PATH, CONFIG_PATH)
+    logging.info(f"Reading {path}")
+    with open(path, 'r') as f:
+        config = json.load(f)
+
+    _apply_env_overrides(config)
+    validate_config(config)
+    return _freeze(config)
+
 def load_config(filename):
     """
-    Read config.json
+    Read a section of config.json
 
     Args: 
     filename (str): name of the key 
 
     Returns : 
-    dict : items in the key
+    dict : items in the key, read-only
     """
-    logging.info("Reading config.json")
-    with open('src/config.json', 'r') as f:
-        config = json.load(f)  
-        
-    return config[filename]
+    return get_config()[filename]
 
-def save_model(model,name):
+def config_field(section, *keys):
     """
-    Save a machine learning model to a .pkl file.
+    Dataclass field reading its default from config.json when the dataclass is instantiated,
+    so importing a module declaring a config dataclass does not read the file.
 
-    Args: 
-    object: The machine learning model to be saved
-    filename (str): The name of the .pkl file.
+    Example:
+    >>> db_path: str = config_field("data_ingestion", "db_path")
+    """
+    def factory():
+        value = load_config(section)
+        for key in keys:
+            value = value[key]
+        return value
+    return field(default_factory=factory)
+
+INTERMEDIATE_EXTENSIONS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+}
+
+def intermediate_path(path, fmt):
+    """
+    Swap the extension of a configured path for the one of the intermediate format.
+
+    Args:
+    path (str): path from config.json
+    fmt (str): csv, parquet or feather
+
+    Returns:
+    str : path with the extension of fmt
+    """
+    if fmt not in INTERMEDIATE_EXTENSIONS:
+        raise ValueError(f"Unknown intermediate format {fmt}, expected one of {list(INTERMEDIATE_EXTENSIONS)}")
+    return os.path.splitext(path)[0] + INTERMEDIATE_EXTENSIONS[fmt]
+
+def normalize_mixed_columns(df):
+    """
+    Columns read from SQLite can hold ints and placeholder strings side by side,
+    which arrow refuses to write. Store those as strings, keeping missing values.
+
+    Args:
+    df (pd.DataFrame): dataframe to normalize, left untouched
+
+    Returns:
+    pd.DataFrame : copy with mixed object columns as strings
+    """
+    import pandas as pd
+
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[column], skipna=True) not in ("string", "empty"):
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+def write_frame(df, path, fmt="parquet", export_csv=False):
+    """
+    Write a dataframe between pipeline stages.
+
+    Args:
+    df (pd.DataFrame): dataframe to write, the index is not kept
+    path (str): path from config.json, the extension is replaced to match fmt
+    fmt (str): csv, parquet or feather
+    export_csv (bool): also write a csv copy at the .csv path
+
+    Returns:
+    str : path written
 
     Example:
-    >>> save_model(model, filename)
+    >>> write_frame(df, "data/clean/merged_data.csv", "parquet")
     """
-    try:
-        # Read config and set path
-        config = load_config("models")
-        path = config["model_path"]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    out_path = intermediate_path(path, fmt)
 
-        # Ensure there is an existing path
-        logging.info("Saving models...")
-        dir_path = os.path.dirname(path)
-        os.makedirs(dir_path, exist_ok=True)
+    if fmt == "csv":
+        df.to_csv(out_path, index=False)
+    elif fmt == "parquet":
+        normalize_mixed_columns(df).to_parquet(out_path, index=False)
+    else:
+        normalize_mixed_columns(df).reset_index(drop=True).to_feather(out_path)
 
-        # Write model to path
-        with open(f"{dir_path}/{name}.pkl", 'wb') as file:
-            pickle.dump(model,file)
-            print("Model have been saved in models")
+    if export_csv and fmt != "csv":
+        df.to_csv(intermediate_path(path, "csv"), index=False)
 
-    except Exception as e :
-            logging.error(f"Fail to save model : {e}")
+    logging.info(f"Dataframe written to {out_path}")
+    return out_path
 
-def load_model(name : str): 
+def read_frame(path, fmt="parquet", columns=None, memory_map=False):
     """
-    Load a machine learning model from a .pkl file.
+    Read a dataframe written by write_frame.
 
-    Args: 
-    filename (str): The path to the .pkl file.
+    Args:
+    path (str): path from config.json, the extension is replaced to match fmt
+    fmt (str): csv, parquet or feather
+    columns (list): only read these columns
+    memory_map (bool): memory map parquet / feather files instead of reading them into memory
 
     Returns:
-    object: The machine learning model loaded from the .pkl file.
+    pd.DataFrame
+    """
+    import pandas as pd
+
+    in_path = intermediate_path(path, fmt)
+    logging.info(f"Reading dataframe from {in_path}")
+
+    if fmt == "csv":
+        return pd.read_csv(in_path, usecols=columns)
+    if fmt == "parquet":
+        return pd.read_parquet(in_path, columns=columns, memory_map=memory_map)
+
+    from pyarrow import feather
+    return feather.read_table(in_path, columns=columns, memory_map=memory_map).to_pandas()
+
+def iter_frame(path, fmt="parquet", chunk_rows=100_000, columns=None):
+    """
+    Read a dataframe written by write_frame in chunks of at most chunk_rows rows, so only
+    one chunk is held in memory at a time. Files are read rather than memory mapped, mapped
+    pages of a large file would count against the memory of the process.
+
+    Args:
+    path (str): path from config.json, the extension is replaced to match fmt
+    fmt (str): csv, parquet or feather
+    chunk_rows (int): rows per chunk
+    columns (list): only read these columns
+
+    Yields:
+    pd.DataFrame : chunks in file order
+    """
+    import pandas as pd
+
+    in_path = intermediate_path(path, fmt)
+    logging.info(f"Streaming dataframe from {in_path}")
+
+    if fmt == "csv":
+        yield from pd.read_csv(in_path, usecols=columns, chunksize=chunk_rows)
+        return
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(in_path).iter_batches(batch_size=chunk_rows, columns=columns)
+    else:
+        import pyarrow as pa
+        reader = pa.ipc.open_file(pa.OSFile(in_path))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        if columns is not None:
+            batches = (batch.select(columns) for batch in batches)
+
+    for batch in batches:
+        # Feather batches are as large as the writer made them
+        for offset in range(0, batch.num_rows, chunk_rows):
+            yield batch.slice(offset, chunk_rows).to_pandas()
+
+class FrameWriter:
+    """
+    Append chunks to one file of an intermediate format, the counterpart of iter_frame.
+
+    Every chunk must have the columns and dtypes of the first one. Use as a context manager.
 
     Example:
-    >>> load_model(filename)
-    """
-    try:
-        # Read config and set path
-        config = load_config("models")
-        path = config["model_path"]
-
-        # Ensure there is an existing path 
-        logging.info("Loading models...")
-        dir_path = os.path.dirname(path)
-        os.makedirs(dir_path, exist_ok=True)
-        
-        # load .pkl file to model
-        with open(f"{dir_path}/{name}.pkl", 'rb') as file:
-            model = pickle.load(file)
-            print("Model had been loaded")
-
-        return model
-
-    except Exception as e :
-            logging.error(f"Fail to load model : {e}")
\ No newline at end of file
+    >>> with FrameWriter("data/clean/final_data.csv", "parquet") as writer:
+    ...     for chunk in chunks:
+    ...         writer.write(chunk)
+    """
+    def __init__(self, path, fmt="parquet", export_csv=False):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.fmt = fmt
+        self.out_path = intermediate_path(path, fmt)
+        self.csv_path = intermediate_path(path, "csv") if export_csv or fmt == "csv" else None
+        self.schema = None
+        self.writer = None
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, df):
+        if self.csv_path:
+            df.to_csv(self.csv_path, index=False, mode='w' if self.rows == 0 else 'a', header=self.rows == 0)
+
+        if self.fmt != "csv":
+            import pyarrow as pa
+
+            if self.schema is None:
+                table = pa.Table.from_pandas(normalize_mixed_columns(df), preserve_index=False)
+                self.schema = table.schema
+                if self.fmt == "parquet":
+                    import pyarrow.parquet as pq
+                    self.writer = pq.ParquetWriter(self.out_path, self.schema)
+                else:
+                    self.writer = pa.ipc.new_file(self.out_path, self.schema)
+            else:
+                table = pa.Table.from_pandas(normalize_mixed_columns(df), schema=self.schema, preserve_index=False)
+            self.writer.write_table(table)
+
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        logging.info(f"{self.rows} rows written to {self.out_path}")
+
+def month_partitions(dates, date_format="%d/%m/%Y"):
+    """
+    Partition key (YYYY-MM) of every date, dates that cannot be parsed go to "unknown".
+
+    Args:
+    dates (pd.Series): dates as stored in the source tables
+
+    Returns:
+    pd.Series : partition key per row
+    """
+    import pandas as pd
+
+    parsed = pd.to_datetime(dates, format=date_format, errors="coerce")
+    return parsed.dt.strftime("%Y-%m").fillna("unknown")
+
+def partition_dir(root, table, month):
+    return os.path.join(root, table, f"month={month}")
+
+def list_partition_files(root, table, fmt):
+    """
+    List the files of a date-partitioned table.
+
+    Args:
+    root (str): root folder of the partitioned store
+    table (str): table name
+    fmt (str): csv, parquet or feather
+
+    Returns:
+    dict : partition key -> sorted list of file paths
+    """
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return {}
+
+    partitions = {}
+    for name in sorted(os.listdir(table_dir)):
+        if not name.startswith("month="):
+            continue
+        folder = os.path.join(table_dir, name)
+        files = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                 if f.endswith(INTERMEDIATE_EXTENSIONS[fmt])]
+        if files:
+            partitions[name[len("month="):]] = files
+    return partitions
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from data_transformation import DataTransformation, float32_lossless
+
+
+def test_float32_lossless_accepts_short_decimals():
+    assert float32_lossless(np.array([23.4, 1013.25, -0.5, 0.0, np.nan, 123456.0, 2.25e-12]))
+
+
+def test_float32_lossless_rejects_values_float32_changes():
+    for values in ([1234567.0], [0.1234567], [1 / 3], [np.inf], [1e39], [1e-40]):
+        assert not float32_lossless(np.array(values)), values
+
+
+def test_downcast_keeps_long_columns_float64():
+    df = pd.DataFrame({"short": [23.4, 25.1, np.nan], "long": [1 / 3, 2 / 3, 1.0]})
+
+    df = DataTransformation().downcast_float_columns(df)
+
+    assert df["short"].dtype == np.float32
+    assert df["long"].dtype == np.float64
+    assert df["short"].astype(np.float64).round(1).tolist()[:2] == [23.4, 25.1]
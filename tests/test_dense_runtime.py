@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from dense_runtime import DenseNetwork, export_dense
+
+# Largest predict_proba difference allowed between Keras and the NumPy forward pass, both in float32
+PARITY_ATOL = 1e-5
+
+
+def test_keras_parity(tmp_path):
+    tf = pytest.importorskip("tensorflow")
+    from dl_model import DeepLearningModel
+
+    tf.keras.utils.set_random_seed(0)
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(512, 12)).astype(np.float32)
+    y = tf.keras.utils.to_categorical((X[:, 0] > 0).astype(int) + (X[:, 1] > 1).astype(int), 3)
+
+    model = DeepLearningModel().model_architect(X)
+    model.compile(optimizer="adam", loss="categorical_crossentropy")
+    model.fit(X, y, epochs=3, batch_size=64, verbose=0)
+
+    path = str(tmp_path / "dense_network.npz")
+    export_dense(model, path, np.array(["High", "Low", "Moderate"]))
+    network = DenseNetwork.load(path)
+
+    X_new = rng.normal(size=(256, 12)).astype(np.float32)
+    expected = model.predict(X_new, verbose=0)
+    np.testing.assert_allclose(network.predict_proba(X_new), expected, rtol=0, atol=PARITY_ATOL)
+    assert list(network.predict(X_new)) == list(network.classes_[expected.argmax(axis=1)])
+
+
+def test_save_load_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    kernels = [rng.normal(size=(4, 8)), rng.normal(size=(8, 3))]
+    biases = [rng.normal(size=8), rng.normal(size=3)]
+    network = DenseNetwork(kernels, biases, ["relu", "softmax"], ["a", "b", "c"])
+
+    path = str(tmp_path / "dense_network.npz")
+    network.save(path)
+    loaded = DenseNetwork.load(path)
+
+    X = rng.normal(size=(16, 4)).astype(np.float32)
+    hidden = np.maximum(X.astype(np.float64) @ kernels[0] + biases[0], 0)
+    logits = hidden @ kernels[1] + biases[1]
+    expected = np.exp(logits - logits.max(axis=1, keepdims=True))
+    expected /= expected.sum(axis=1, keepdims=True)
+
+    np.testing.assert_allclose(loaded.predict_proba(X), expected, rtol=0, atol=PARITY_ATOL)
+    assert list(loaded.classes_) == ["a", "b", "c"]
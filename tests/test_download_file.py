@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+import dataclasses
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from data_ingestion import DataIngestion
+
+CONTENT = bytes(range(256)) * 64
+ETAG = '"v1"'
+
+
+class FileServer(ThreadingHTTPServer):
+    """
+    Stand-in for the blob storage serving one file, with ETag, Range / If-Range and failure switches.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.content = CONTENT
+        self.etag = ETAG
+        # Answer 500 to the next failures requests
+        self.failures = 0
+        # Answer 200 with the whole file to range requests
+        self.ignore_range = False
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/weather.db"
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.failures:
+            server.failures -= 1
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.send_header("ETag", server.etag)
+            self.end_headers()
+            return
+
+        body, status = server.content, 200
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") == server.etag and not server.ignore_range:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            body, status = server.content[start:], 206
+            self.send_response(status)
+            self.send_header("Content-Range", f"bytes {start}-{len(server.content) - 1}/{len(server.content)}")
+        else:
+            self.send_response(status)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ingestion():
+    ingestion = DataIngestion()
+    ingestion.ingestion_config = dataclasses.replace(
+        ingestion.ingestion_config, download_chunk_size=1024, download_retries=3,
+        download_timeout=5, retry_backoff=0.01, source_timeout=10)
+    return ingestion
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_writes_file_and_meta(server, ingestion, tmp_path):
+    path = str(tmp_path / "weather.db")
+
+    assert ingestion.download_file(server.url, path) is True
+    assert read(path) == CONTENT
+    assert not os.path.exists(path + ".part")
+    with open(path + ".meta.json") as f:
+        meta = json.load(f)
+    assert meta["etag"] == ETAG
+    assert "partial" not in meta
+
+
+def test_unchanged_file_is_skipped_with_etag(server, ingestion, tmp_path):
+    path = str(tmp_path / "weather.db")
+    ingestion.download_file(server.url, path)
+    modified = os.path.getmtime(path)
+
+    assert ingestion.download_file(server.url, path) is False
+    assert server.requests[-1]["If-None-Match"] == ETAG
+    assert os.path.getmtime(path) == modified
+
+
+def test_interrupted_download_resumes_from_part(server, ingestion, tmp_path):
+    path = str(tmp_path / "weather.db")
+    offset = len(CONTENT) // 3
+    with open(path + ".part", "wb") as f:
+        f.write(CONTENT[:offset])
+    with open(path + ".meta.json", "w") as f:
+        json.dump({"partial": {"etag": ETAG, "last_modified": None}}, f)
+
+    assert ingestion.download_file(server.url, path) is True
+    assert server.requests[-1]["Range"] == f"bytes={offset}-"
+    assert server.requests[-1]["If-Range"] == ETAG
+    assert read(path) == CONTENT
+
+
+def test_full_response_to_range_request_restarts_file(server, ingestion, tmp_path):
+    path = str(tmp_path / "weather.db")
+    with open(path + ".part", "wb") as f:
+        f.write(b"stale bytes of an older version")
+    with open(path + ".meta.json", "w") as f:
+        json.dump({"partial": {"etag": ETAG, "last_modified": None}}, f)
+    server.ignore_range = True
+
+    assert ingestion.download_file(server.url, path) is True
+    assert "Range" in server.requests[-1]
+    assert read(path) == CONTENT
+
+
+def test_server_errors_are_retried(server, ingestion, tmp_path):
+    path = str(tmp_path / "weather.db")
+    server.failures = 2
+
+    assert ingestion.download_file(server.url, path) is True
+    assert len(server.requests) == 3
+    assert read(path) == CONTENT
+
+
+def test_gives_up_after_download_retries(server, ingestion, tmp_path):
+    path = str(tmp_path / "weather.db")
+    server.failures = 10
+
+    with pytest.raises(ConnectionError):
+        ingestion.download_file(server.url, path)
+    assert len(server.requests) == ingestion.ingestion_config.download_retries
+    assert not os.path.exists(path)
+
+
+def test_deadline_cuts_the_retries(server, ingestion, tmp_path):
+    path = str(tmp_path / "weather.db")
+    server.failures = 10
+    ingestion.ingestion_config = dataclasses.replace(ingestion.ingestion_config, download_retries=10, retry_backoff=30)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        ingestion.download_file(server.url, path, deadline=start + 0.5)
+    # The backoff sleep is capped at the deadline
+    assert time.monotonic() - start < 5
+    assert len(server.requests) == 1
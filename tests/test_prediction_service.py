@@ -0,0 +1,126 @@
+import copy
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import prediction_service
+from model_bundle import ModelBundle, feature_schema
+from prediction_service import PredictionService
+
+FEATURES = ["Daily Rainfall Total (mm)", "Max Wind Speed (km/h)", "Sunshine Duration (hrs)"]
+
+
+@pytest.fixture(scope="module")
+def bundle():
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(300, len(FEATURES))), columns=FEATURES)
+    y = np.where(X[FEATURES[2]] > 0.5, "High", np.where(X[FEATURES[0]] > 0, "Medium", "Low"))
+    preprocessing = Pipeline([("scaler", StandardScaler())]).fit(X)
+    model = RandomForestClassifier(n_estimators=10, random_state=0).fit(preprocessing.transform(X), y)
+    return ModelBundle(model, preprocessing, LabelEncoder().fit(y), feature_schema(X))
+
+
+@pytest.fixture
+def service(bundle, monkeypatch):
+    # The service flattens the trees of its own copy of the bundle
+    monkeypatch.setattr(prediction_service, "load_bundle", lambda name: copy.deepcopy(bundle))
+    service = PredictionService("test_bundle")
+    service.service_config.max_wait_ms = 50
+    server = service.create_server("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    service.url = f"http://127.0.0.1:{server.server_port}"
+    yield service
+    server.shutdown()
+    server.server_close()
+
+
+def records(n, seed=1):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.normal(size=(n, len(FEATURES))), columns=FEATURES).to_dict("records")
+
+
+def post(url, body):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    request = urllib.request.Request(f"{url}/predict", data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_predictions_match_bundle(service, bundle):
+    rows = records(20)
+    status, body = post(service.url, {"records": rows})
+
+    assert status == 200
+    assert body["predictions"] == bundle.predict(pd.DataFrame.from_records(rows)).tolist()
+
+    status, body = post(service.url, rows[0])
+    assert status == 200
+    assert body["predictions"] == bundle.predict(pd.DataFrame.from_records(rows[:1])).tolist()
+
+
+def test_concurrent_requests_are_micro_batched(service, bundle):
+    rows = records(16, seed=2)
+    results = [None] * len(rows)
+
+    def client(index):
+        results[index] = post(service.url, [rows[index]])
+
+    clients = [threading.Thread(target=client, args=(index,)) for index in range(len(rows))]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    expected = bundle.predict(pd.DataFrame.from_records(rows)).tolist()
+    assert [body["predictions"][0] for _, body in results] == expected
+    assert all(status == 200 for status, _ in results)
+    # 16 single record requests within max_wait_ms of each other share batches
+    assert len(service.metrics.batch_sizes) < len(rows)
+    assert max(service.metrics.batch_sizes) > 1
+
+
+@pytest.mark.parametrize("body", [b"not json", [], [1, 2], "record", {"records": [{"a": 1}, 3]}, [{"unknown": 1.0}]])
+def test_rejected_bodies_return_400(service, body):
+    status, response = post(service.url, body)
+
+    assert status == 400
+    assert "error" in response
+    # The batch worker keeps serving
+    assert post(service.url, records(1))[0] == 200
+
+
+def test_unexpected_errors_return_500(service, monkeypatch):
+    def broken_store(day, as_of=None, site=None):
+        raise RuntimeError("feature store unavailable")
+    monkeypatch.setattr(service, "day_records", broken_store)
+
+    status, response = post(service.url, {"date": "2023-01-02"})
+    assert status == 500
+    assert response["error"] == "feature store unavailable"
+
+
+def test_metrics_report_latency_and_throughput(service):
+    for _ in range(5):
+        post(service.url, records(3))
+
+    with urllib.request.urlopen(f"{service.url}/metrics", timeout=10) as response:
+        metrics = json.load(response)
+
+    assert metrics["requests"] == 5
+    assert metrics["records"] == 15
+    assert 0 < metrics["latency_p50_ms"] <= metrics["latency_p99_ms"]
+    assert metrics["requests_per_s"] > 0
+    assert metrics["records_per_s"] > 0